@@ -29,13 +29,29 @@
 import sys
 import os
 import argparse
+import asyncio
+import time
+import unicodedata
+import re
+import random
+import sqlite3
+import zipfile
+import multiprocessing
+import concurrent.futures
 import logging
 from datetime import datetime
 from pprint import pprint
 from sauce import SAUCE
-from itertools import groupby
+from itertools import groupby, chain
+from functools import lru_cache
 from textwrap import wrap
 
+try:
+    import numpy as np
+except ImportError:
+    # Only --shrink and image input need NumPy
+    np = None
+
 logger = logging.getLogger(__name__)
 
 # CP437 extended to EBCDIC:
@@ -198,7 +214,9 @@ cp437_to_ebcdic = {
     '\'': '7D'
 }
 
-usstable_jcl = '''//{user_job:<8} JOB 'build usstable',
+# The USS table job: the job card and comments, the table's source and
+# the step assembling it and linking it in to the load library
+usstable_job = '''//{user_job:<8} JOB 'build usstable',
 //   'Build USSTABLE',
 //   NOTIFY=&SYSUID,
 //   MSGCLASS=H,
@@ -215,25 +233,12 @@ usstable_jcl = '''//{user_job:<8} JOB 'build usstable',
 //* /vary tcpip,tn3270,obeyfile,dsn=user.tcpparms(tn3270)
 //*
 //********************************************************************
-//BUILD   EXEC ASMACL
-//C.SYSLIB  DD DSN=SYS1.SISTMAC1,DISP=SHR
-//          DD DSN=SYS1.MACLIB,DISP=SHR
-//C.SYSIN   DD *
-         MACRO
+'''
+
+usstable_source = '''{segments}         MACRO
 &NAME    SCREEN &MSG=.,&TEXT=.
          AIF   ('&MSG' EQ '.' OR '&TEXT' EQ '.').END
-         LCLC  &BFNAME,&BFSTART,&BFEND
-&BFNAME  SETC  'BUF'.'&MSG'
-&BFBEGIN SETC  '&BFNAME'.'B'
-&BFEND   SETC  '&BFNAME'.'E'
-.BEGIN   DS    0F
-&BFNAME  DC    AL2(&BFEND-&BFBEGIN)    MESSAGE LENGTH
-&BFBEGIN EQU   *                       START OF MESSAGE
-         DC    X'F5'       ERASE/WRITE
-         DC    X'C3'       WCC
-{hlasm}
-{cursor}
-&BFEND   EQU   *                       END OF MESSAGE
+{screen}
 .END     MEND
 *
 *
@@ -310,12 +315,92 @@ END      USSEND
     SCREEN MSG=12,TEXT='Required parameter is missing'
     SCREEN MSG=14,TEXT='There is an undefined USS message'
    END
-/*
+'''
+
+usstable_jcl = usstable_job + '''//BUILD   EXEC ASMACL
+//C.SYSLIB  DD DSN=SYS1.SISTMAC1,DISP=SHR
+//          DD DSN=SYS1.MACLIB,DISP=SHR
+//C.SYSIN   DD *
+''' + usstable_source + '''/*
 //L.SYSLMOD DD DSN={dataset},DISP=SHR
 //L.SYSIN   DD *
-  NAME {logofile}(R)
+{deck}  NAME {logofile}(R)
 //*'''
 
+# --variants: the source is copied to a temporary data set once, then
+# every variant is assembled from it with its name in SYSPARM and linked
+# in to a member of its own
+uss_variants_jcl = usstable_job + '''//SOURCE  EXEC PGM=IEBGENER
+//SYSPRINT  DD SYSOUT=*
+//SYSIN     DD DUMMY
+//SYSUT2    DD DSN=&&USSSRC,DISP=(NEW,PASS),UNIT=SYSDA,
+//             SPACE=(TRK,(15,15)),DCB=(RECFM=FB,LRECL=80,BLKSIZE=3120)
+//SYSUT1    DD *
+''' + usstable_source + '''/*
+{builds}//*'''
+
+uss_variant_build = '''//{step:<8}EXEC ASMACL,PARM.C='OBJECT,NODECK,SYSPARM({name})'
+//C.SYSLIB  DD DSN=SYS1.SISTMAC1,DISP=SHR
+//          DD DSN=SYS1.MACLIB,DISP=SHR
+//C.SYSIN   DD DSN=&&USSSRC,DISP=(OLD,PASS)
+//L.SYSLMOD DD DSN={dataset},DISP=SHR
+//L.SYSIN   DD *
+  NAME {member}(R)
+'''
+
+# The SCREEN macro's message, and the message linked in from an object deck
+uss_screen = '''         LCLC  &BFNAME,&BFSTART,&BFEND
+&BFNAME  SETC  'BUF'.'&MSG'
+&BFBEGIN SETC  '&BFNAME'.'B'
+&BFEND   SETC  '&BFNAME'.'E'
+.BEGIN   DS    0F
+&BFNAME  DC    AL2(&BFEND-&BFBEGIN)    MESSAGE LENGTH
+&BFBEGIN EQU   *                       START OF MESSAGE
+         DC    X'F5'       ERASE/WRITE
+         DC    X'C3'       WCC
+{hlasm}
+{cursor}
+&BFEND   EQU   *                       END OF MESSAGE'''
+
+uss_screen_object = '''         EXTRN BUF&MSG                 MESSAGE FROM THE OBJECT DECK'''
+
+# --write-messages: MSG 10 shows the art, the other messages are a Write
+# that puts the message on the line below the input field (above it on the
+# last line) and clears the input field, leaving the art on the screen
+uss_write_screen = '''         AIF   ('&MSG' NE '10').WRITE
+{art}
+         AGO   .END
+.WRITE   ANOP
+         LCLC  &BFNAME,&BFSTART,&BFEND
+&BFNAME  SETC  'BUF'.'&MSG'
+&BFBEGIN SETC  '&BFNAME'.'B'
+&BFEND   SETC  '&BFNAME'.'E'
+         DS    0F
+&BFNAME  DC    AL2(&BFEND-&BFBEGIN)    MESSAGE LENGTH
+&BFBEGIN EQU   *                       START OF MESSAGE
+         DC    X'F1'       WRITE
+         DC    X'C3'       WCC
+{message}
+         DC    CL{length}&TEXT
+{field}
+&BFEND   EQU   *                       END OF MESSAGE'''
+
+# --variants: a row segment the variants share, written in the source once
+# and expanded in each variant's art that calls it
+uss_segment = '''         MACRO
+         {name}
+{hlasm}
+         MEND
+'''
+
+# --variants: the art of the variant named in SYSPARM, the first when
+# SYSPARM names none of them
+uss_variant_pick = "         AIF   ('&SYSPARM' EQ '{name}').VAR{number}\n"
+uss_variant = '''         AGO   .VAREND
+.VAR{number:<4} ANOP
+{hlasm}
+'''
+
 sysgen_jcl = '''//{user_job:<8} JOB  (SETUP),
 //             'Build Netsol',
 //             CLASS=A,
@@ -373,14 +458,7 @@ sysgen_jcl = '''//{user_job:<8} JOB  (SETUP),
 * NETSOL screen created by ANSi2EBCDiC.py
          PUSH  PRINT
          PRINT OFF
-EGMSG    DS 0C EGMSG
-         $WCC  (RESETKBD,MDT)
-         $SBA  (1,1)
-{hlasm}
-{cursor}
-         $SBA  (24,80)
-         $SF   (SKIP,HI)
-EGMSGLN EQU *-EGMSG
+{screen}
          POP   PRINT
 ./ CHANGE NAME=NETSOL
          CLI   MSGINDEX,X'0C'                                           23164802
@@ -430,11 +508,25 @@ ISTNSC00 CSECT ,
 //LKED    EXEC PGM=IEWL,PARM='XREF,LIST,LET,NCAL',REGION=1024K
 //SYSPRINT DD  SYSOUT=*
 //SYSLIN   DD  DISP=(OLD,DELETE,DELETE),DSN=*.ASM.SYSPUNCH
-//SYSLMOD  DD  DISP=SHR,DSN=SYS1.VTAMLIB(ISTNSC00)
+{deck}//SYSLMOD  DD  DISP=SHR,DSN=SYS1.VTAMLIB(ISTNSC00)
 //SYSUT1   DD  UNIT=VIO,SPACE=(1024,(200,20))
 //*
 //'''
 
+# The SYSGEN NETSOL screen copybook, and the one for a screen linked in
+# from an object deck
+sysgen_screen = '''EGMSG    DS 0C EGMSG
+         $WCC  (RESETKBD,MDT)
+         $SBA  (1,1)
+{hlasm}
+{cursor}
+         $SBA  (24,80)
+         $SF   (SKIP,HI)
+EGMSGLN EQU *-EGMSG'''
+
+sysgen_screen_object = '''         EXTRN EGMSG
+EGMSGLN  EQU   {length}'''
+
 netsol_jcl = '''//{user_job:<8} JOB  (SETUP),
 //             'Build Netsol',
 //             CLASS=A,
@@ -527,6 +619,7 @@ TK4MDATE DC    CL8' '
          $SBA  (2,72)
          $SF   (SKIP,HI)
 TK4MTIME DC    CL8' \'
+         $SBA  (1,1)
 {hlasm}
 {cursor}
          $SBA  (24,80)
@@ -714,13 +807,20 @@ ISTNSC00 CSECT ,
 //LKED    EXEC PGM=IEWL,PARM='XREF,LIST,LET,NCAL',REGION=1024K
 //SYSPRINT DD  SYSOUT=*
 //SYSLIN   DD  DISP=(OLD,DELETE,DELETE),DSN=*.ASM.SYSPUNCH
-//SYSLMOD  DD  DISP=SHR,DSN=SYS1.VTAMLIB(ISTNSC00)
+{deck}//SYSLMOD  DD  DISP=SHR,DSN=SYS1.VTAMLIB(ISTNSC00)
 //SYSUT1   DD  UNIT=VIO,SPACE=(1024,(200,20))
 //*
 //'''
 
 max_len = len('1234567890123456789012345678901234567890123456')
 
+# --dense statements: operands go in columns 16-71, a continued card has an
+# X in column 72. TK4-'s assembler (IFOX00) takes two continuation cards
+# per statement, HLASM nine.
+dense_start = 15
+dense_end = 71
+dense_continuations = {True: 2, False: 9}
+
 tk4_tso_jcl = '''//{user_job:<8} JOB  (ASSEMBLE),
 //             'ASSEMBLE HLASM',
 //             CLASS=A,
@@ -743,7 +843,7 @@ tk4_tso_jcl = '''//{user_job:<8} JOB  (ASSEMBLE),
 {tso_hlasm}
 //LKED.SYSLMOD DD DSN={dataset},DISP=SHR
 //LKED.SYSIN DD *
-  NAME {member}(R)
+{deck}  NAME {member}(R)
 /*'''
 
 zos_tso_jcl = '''//{user_job:<8}   JOB (ASSY),'JOBBYJOB',CLASS=A,MSGCLASS=Y,
@@ -763,7 +863,7 @@ zos_tso_jcl = '''//{user_job:<8}   JOB (ASSY),'JOBBYJOB',CLASS=A,MSGCLASS=Y,
 {tso_hlasm}
 /*
 //L.SYSLMOD DD DSN={dataset}({member}),DISP=(SHR)
-//
+{deck}//
 '''
 
 tso_hlasm = '''TN3270   CSECT ,
@@ -796,9 +896,9 @@ STREAM   DS    0C
          DC    X'27'       ESCAPE CHAR
          DC    X'F5'       ERASE/WRITE
          DC    X'C3'       WCC
-         DC    X'114040'   SBA(1,1)
-         DC    X'1DF8'     SF (PROT,HIGH INTENSITY)
 {hlasm}
+         DC    X'115D7F'   SBA(24,80)
+         DC    X'1DF8'     SF (PROT,HIGH INTENSITY)
 STREAMLN EQU   *-STREAM
 *
 *
@@ -808,6 +908,82 @@ INBUFLN  EQU   *-INBUF
 SAVEA    DS    18F
          END   ,'''
 
+# Paged TSO program: Enter and PF8 show the next page, PF7 the previous
+# one, any other key or Enter on the last page ends it. The pages come
+# after the code and are only reached through the page table's address
+# constants so they don't use up the base register.
+tso_pages_hlasm = '''TN3270   CSECT ,
+         SAVE  (14,12),,*
+         LR    12,15
+         USING TN3270,12
+*
+         LA    1,SAVEA
+         ST    1,8(,13)
+         ST    13,4(,1)
+         LR    13,1
+*
+         STFSMODE ON,INITIAL=YES,NOEDIT=YES
+         STTMPMD ON
+*
+         L     3,=A(PAGES) FIRST PAGE
+SHOW     L     1,0(,3)     PAGE ADDRESS
+         L     0,4(,3)     PAGE LENGTH
+         TPUT  (1),(0),FULLSCR
+*
+         TGET  INBUF,INBUFLN,ASIS
+         CLI   INBUF,X'F7' PF7
+         BE    PREV
+         CLI   INBUF,X'F8' PF8
+         BE    NEXT
+         CLI   INBUF,X'7D' ENTER
+         BNE   DONE
+NEXT     LA    3,8(,3)
+         ICM   1,15,0(3)   PAST THE LAST PAGE?
+         BNZ   SHOW
+         B     DONE
+PREV     C     3,=A(PAGES)
+         BE    SHOW        ALREADY ON THE FIRST PAGE
+         S     3,=F'8'
+         B     SHOW
+*
+DONE     STLINENO LINE=1
+         STFSMODE OFF
+         STTMPMD OFF
+*
+         L     13,4(,13)
+         LM    14,12,12(13)
+         SLR   15,15
+         BR    14
+*
+         LTORG
+*
+INBUF    DS    XL128
+INBUFLN  EQU   *-INBUF
+*
+SAVEA    DS    18F
+*
+{pages}         END   ,'''
+
+tso_page = '''P{page:04d}    DS    0C
+         DC    X'27'       ESCAPE CHAR
+         DC    X'F5'       ERASE/WRITE
+         DC    X'C3'       WCC
+{hlasm}
+         DC    X'115D7F'   SBA(24,80)
+         DC    X'1DF8'     SF (PROT,HIGH INTENSITY)
+L{page:04d}    EQU   *-P{page:04d}
+*
+'''
+
+# Page labels are P0001 to P9999
+max_pages = 9999
+
+
+# Longest escape sequence kept, anything longer is left out
+max_escape = 32
+
+# Control sequence parameters the state machine understands
+csi_params = re.compile(r'[0-9;]*$')
 
 escape_types = {
     "A" : "Move cursor Up",
@@ -828,6 +1004,9 @@ escape_types = {
     "t" : "Mystery"
 }
 
+# Control sequence final bytes the state machine handles, HVP (f) is CUP (H)
+csi_finals = dict({final: final for final in escape_types}, f='H')
+
 ansi_color_escape_types = {
     # attributes
     "0" : "Normal Display",
@@ -1006,6 +1185,989 @@ intense_color_escape_types = {
     "47" : "(BG) White",
 }
 
+# 3270 6-bit buffer address / field attribute translation
+tn3270_ba = [
+    '40','C1','C2','C3','C4','C5','C6','C7','C8','C9','4A','4B','4C','4D','4E','4F',
+    '50','D1','D2','D3','D4','D5','D6','D7','D8','D9','5A','5B','5C','5D','5E','5F',
+    '60','61','E2','E3','E4','E5','E6','E7','E8','E9','6A','6B','6C','6D','6E','6F',
+    'F0','F1','F2','F3','F4','F5','F6','F7','F8','F9','7A','7B','7C','7D','7E','7F']
+
+# $SF macro keywords to 3270 field attribute bits
+field_attributes = {
+    "UNPROT" : 0x00,
+    "PROT" : 0x20,
+    "NUM" : 0x10,
+    "SKIP" : 0x30,
+    "HI" : 0x08,
+    "NODISP" : 0x0C,
+    "MDT" : 0x01
+}
+
+# --targets names: (jcl, tk4)
+target_types = {
+    "tso-tk4" : ('tso', True),
+    "tso-zos" : ('tso', False),
+    "netsol" : ('netsol', True),
+    "sysgen" : ('sysgen', True),
+    "usstable" : ('usstable', False)
+}
+
+
+def ebcdic_table(codec, swaps=''):
+    # Latin-1 to EBCDIC translation table from a Python codec, with the
+    # EBCDIC codes of each pair of characters in swaps exchanged
+    table = bytearray(bytes(range(256)).decode('latin-1').encode(codec))
+    for a, b in zip(swaps[::2], swaps[1::2]):
+        table[ord(a)], table[ord(b)] = table[ord(b)], table[ord(a)]
+    return bytes(table)
+
+
+# EBCDIC code pages, --codepage names. CP1047 is CP037 with six characters
+# and the line ends moved around.
+ebcdic_codepages = {
+    "037" : ebcdic_table('cp037'),
+    "1047" : ebcdic_table('cp037', '¬^Ý[¨]\n\x85'),
+    "500" : ebcdic_table('cp500')
+}
+
+# EBCDIC to Latin-1 for each code page
+latin1_codepages = {codepage : bytes(table.index(code) for code in range(256))
+                    for codepage, table in ebcdic_codepages.items()}
+
+
+def to_ebcdic(text, codepage='037'):
+    return text.encode('latin-1', 'replace').translate(ebcdic_codepages[codepage])
+
+
+def from_ebcdic(data, codepage='037'):
+    return data.translate(latin1_codepages[codepage]).decode('latin-1')
+
+
+def ebcdic_records(text, codepage='037'):
+    # text as fixed length 80 byte EBCDIC records, ready to be uploaded in
+    # binary to a RECFM=FB,LRECL=80 dataset
+    records = []
+    for number, line in enumerate(text.splitlines(), 1):
+        if len(line) > 80:
+            logger.warning("Line {} is longer than 80 characters, truncating it: {}".format(number, line))
+        records.append(to_ebcdic(line[:80].ljust(80), codepage))
+    return b''.join(records)
+
+
+# Printable ASCII that isn't at the same place in every code page, sent as
+# hex so what the assembler thinks the code page is doesn't matter
+variant_chars = ''.join(char for char in map(chr, range(0x20, 0x7F))
+                        if len(set(table[ord(char)] for table in ebcdic_codepages.values())) > 1)
+
+# Unicode for the glyphs CP437 shows for bytes 0x00-0x1F, UTF-8 art uses
+# these instead of the control characters
+cp437_glyphs = '\x00☺☻♥♦♣♠•◘○◙♂♀♪♫☼►◄↕‼¶§▬↨↑↓→←∟↔▲▼'
+
+
+def ebcdic_entry(char, codepage='037'):
+    # (EBCDIC hex, graphic) for char. Graphic characters are sent as hex
+    # (X'..' or with a graphic escape X'08..'), the rest as C'..' constants
+    code = cp437_to_ebcdic.get(char) or cp437_to_ebcdic.get(ord(char))
+    if not code and char in cp437_glyphs[1:]:
+        code = cp437_to_ebcdic.get(cp437_glyphs.index(char))
+    if code:
+        if len(code) == 2 and int(code, 16) >= 0x40:
+            # cp437_to_ebcdic characters are CP500, find them in codepage
+            code = to_ebcdic(from_ebcdic(bytes.fromhex(code), '500'), codepage).hex().upper()
+        return code, True
+    if ' ' <= char <= '~' and char not in variant_chars + "'&":
+        return to_ebcdic(char, codepage).hex().upper(), False
+    if unicodedata.category(char)[0] == 'C':
+        # Control characters would be 3270 orders, show them as blanks
+        return '40', True
+    if ord(char) > 0xFF:
+        logger.debug("No EBCDIC for {!r}, using '?'".format(char))
+    return to_ebcdic(char, codepage).hex().upper(), True
+
+
+class InputCodec(dict):
+
+    # The decode table for an input code page: character : (EBCDIC hex,
+    # graphic). Single byte code pages are compiled for all 256 bytes up
+    # front, anything else the first time it shows up.
+
+    def __init__(self, name, encoding, codepage='037', single_byte=True, replace=None):
+        super().__init__()
+        self.name = name
+        self.encoding = encoding
+        self.codepage = codepage
+        # Characters the code page uses in place of others
+        self.replace = replace or {}
+        if single_byte:
+            for char in bytes(range(256)).decode(encoding):
+                self[char]
+
+    def __missing__(self, char):
+        entry = ebcdic_entry(char, self.codepage)
+        self[char] = entry
+        return entry
+
+    def decode(self, data):
+        text = data.decode(self.encoding, 'replace')
+        for old, new in self.replace.items():
+            text = text.replace(old, new)
+        return text
+
+
+# Input code pages, --input-codec names: (Python codec, single byte, replacements)
+input_codecs = {
+    "cp437" : ('cp437', True, None),
+    "utf-8" : ('utf-8', False, None),
+    "iso-8859-1" : ('latin-1', True, None),
+    # Topaz is Latin-1, 0x9B is the Amiga's single byte CSI
+    "amiga" : ('latin-1', True, {'\x9b': '\x1b[', '\xa0': ' '})
+}
+compiled_codecs = {}
+
+
+# Segments (runs of text) each cache below keeps
+segment_cache_size = 4096
+
+
+@lru_cache(maxsize=segment_cache_size)
+def segment_codes(segment, codec, codepage='037'):
+    # The (EBCDIC code, is GE) of every character of segment in the codec
+    # input code page
+    table = input_codec(codec, codepage)
+    return tuple(ebcdic_code(table[char][0]) for char in segment)
+
+
+@lru_cache(maxsize=segment_cache_size)
+def graphic_segment(segment, codec, codepage='037'):
+    # segment as the GE order's data
+    table = input_codec(codec, codepage)
+    return bytes.fromhex(''.join(table[char][0] for char in segment))
+
+
+def input_codec(name, codepage='037'):
+    # The InputCodec for name and an EBCDIC code page, compiled the first
+    # time it's needed
+    if (name, codepage) not in compiled_codecs:
+        encoding, single_byte, replace = input_codecs[name]
+        compiled_codecs[name, codepage] = InputCodec(name, encoding, codepage, single_byte, replace)
+    return compiled_codecs[name, codepage]
+
+
+def sauce_codec(font):
+    # The input code page for a SAUCE font name (TInfoS), None if unknown
+    if font.startswith('Amiga '):
+        return 'amiga'
+    if font.startswith('IBM '):
+        codepage = font.split()[-1]
+        if codepage == '819':
+            return 'iso-8859-1'
+        if codepage == '437' or not codepage.isdigit():
+            return 'cp437'
+    return None
+
+
+def apply_sa(sa, orders):
+    # Updates sa, [fg, bg, highlight], with the SA orders in the hex string orders
+    orders = bytes.fromhex(orders)
+    for i in range(0, len(orders) - 2, 3):
+        if orders[i + 1] == 0x00:
+            sa[:] = [0, 0, 0]
+        elif orders[i + 1] in (0x42, 0x45, 0x41):
+            sa[(0x42, 0x45, 0x41).index(orders[i + 1])] = orders[i + 2]
+
+
+# Characters --shrink treats as two pixels, one above the other: character :
+# (top pixel in the foreground color, bottom pixel in the foreground color).
+# Anything else written is text, both its pixels are foreground.
+half_blocks = {
+    ' ': (False, False), '░': (False, False), '▒': (True, True), '▓': (True, True),
+    '█': (True, True), '▀': (True, False), '▄': (False, True), '▌': (True, True), '▐': (True, True),
+}
+
+
+def cell_blocks(cells, across, down):
+    # rows x cols array cells as (rows / down) x (cols / across) x (down *
+    # across), the cells each shrunk cell is made of, padded with zeros
+    rows, cols = cells.shape[:2]
+    padded = np.zeros((-(-rows // down) * down, -(-cols // across) * across), cells.dtype)
+    padded[:rows, :cols] = cells
+    shape = (len(padded) // down, down, padded.shape[1] // across, across)
+    return padded.reshape(shape).transpose(0, 2, 1, 3).reshape(shape[0], shape[2], -1)
+
+
+def dominant(values):
+    # The most common value along the last axis of a uint8 array, the
+    # highest on a tie so colors win over black
+    palette = np.flatnonzero(np.bincount(values.reshape(-1), minlength=256))[::-1].astype(np.uint8)
+    counts = np.zeros(values.shape[:-1] + palette.shape, np.uint16)
+    for i in range(values.shape[-1]):
+        counts += values[..., i, None] == palette
+    return palette[counts.argmax(axis=-1)]
+
+
+def pixel_cells(top, bottom):
+    # The characters, foreground and background of cells made of a top and
+    # a bottom pixel (3270 colors, 0 for black): a space, full block or half
+    # block
+    chars = np.full(top.shape, ord(' '), np.uint32)
+    chars[(top != 0) & (bottom == top)] = ord('█')
+    chars[(top != 0) & (bottom != top)] = ord('▀')
+    chars[(top == 0) & (bottom != 0)] = ord('▄')
+    fg = np.where(top != 0, top, bottom).astype(np.uint8)
+    bg = np.where((top != 0) & (bottom != 0) & (top != bottom), bottom, 0).astype(np.uint8)
+    return chars, fg, bg
+
+
+def shrink_grid(grid, across, down):
+    # Shrinks grid (art_grid()'s arrays) so every across x down cells become
+    # one. Each cell is turned in to two pixels with half_blocks, each half
+    # of a shrunk cell takes the most common color of its pixels and the
+    # two halves become a space, full block or half block. Shrunk cells
+    # that are at least half text keep their first character instead.
+    chars, fg, bg, hl, written = grid
+    ink = np.where(fg == 0, 0xF7, fg)
+    ink[np.isin(ink, (0xF0, 0xF8))] = 0
+    paper = np.where(np.isin(bg, (0xF0, 0xF8)) | ~written, 0, bg)
+    blocks = np.array([ord(char) for char in half_blocks], np.uint32)
+    text = written & ~np.isin(chars, blocks)
+    top_ink = text | (written & np.isin(chars, [ord(char) for char, (top, bottom) in half_blocks.items() if top]))
+    bottom_ink = text | (written & np.isin(chars, [ord(char) for char, (top, bottom) in half_blocks.items() if bottom]))
+
+    # Pixel rows, two for every row of cells, split in to the top and
+    # bottom half of each shrunk cell
+    pixels = np.empty((2 * len(chars), chars.shape[1]), np.uint8)
+    pixels[0::2] = np.where(top_ink, ink, paper)
+    pixels[1::2] = np.where(bottom_ink, ink, paper)
+    halves = cell_blocks(pixels, across, 2 * down)
+    new_chars, new_fg, new_bg = pixel_cells(dominant(halves[..., :across * down]), dominant(halves[..., across * down:]))
+    new_hl = dominant(cell_blocks(hl, across, down)).astype(np.uint8)
+
+    text = cell_blocks(text, across, down)
+    kept = 2 * text.sum(axis=-1) >= across * down
+    first = text.argmax(axis=-1)[..., None]
+    for new, old in ((new_chars, chars), (new_fg, fg), (new_bg, bg), (new_hl, hl)):
+        new[kept] = np.take_along_axis(cell_blocks(old, across, down), first, axis=-1)[..., 0][kept]
+    return new_chars, new_fg, new_bg, new_hl, cell_blocks(written, across, down).any(axis=-1)
+
+
+image_extensions = ('.pbm', '.pgm', '.ppm', '.pnm')
+
+# Whitespace and comments in front of a number in a PNM header or plain
+# PNM raster
+pnm_number = re.compile(rb'(?:\s|#[^\n]*(?:\n|$))*(\d+)')
+
+# The 3270 colors images are drawn in, normal and --extended, 0xF0 is black
+image_colors = {
+    False: (0xF0, 0xF1, 0xF2, 0xF3, 0xF4, 0xF5, 0xF6, 0xF7),
+    True: (0xF0, 0xF1, 0xF2, 0xF3, 0xF4, 0xF5, 0xF6, 0xF7, 0xF9, 0xFA, 0xFB, 0xFC, 0xFD, 0xFE),
+}
+
+
+def read_pnm(data):
+    # The pixels of a PBM, PGM or PPM image, plain (P1-P3) or raw (P4-P6),
+    # as a rows x cols x 3 array of 8-bit RGB
+    if data[:1] != b'P' or data[1:2] not in (b'1', b'2', b'3', b'4', b'5', b'6'):
+        raise ValueError("not a PBM, PGM or PPM image")
+    kind = int(data[1:2])
+    fields = []
+    position = 2
+    while len(fields) < (2 if kind in (1, 4) else 3):
+        match = pnm_number.match(data, position)
+        if not match:
+            raise ValueError("bad P{} header".format(kind))
+        fields.append(int(match.group(1)))
+        position = match.end()
+    width, height = fields[:2]
+    maxval = fields[2] if len(fields) == 3 else 1
+    if not width or not height or not 0 < maxval < 65536:
+        raise ValueError("bad P{} header: {}".format(kind, ' '.join(map(str, fields))))
+    size = width * height * (3 if kind in (3, 6) else 1)
+
+    if kind == 1:
+        # Plain PBM bits don't need whitespace between them
+        body = re.sub(rb'#[^\n]*', b'', data[position:])
+        values = np.frombuffer(body, np.uint8)
+        values = (values[(values == ord('0')) | (values == ord('1'))] - ord('0'))[:size]
+    elif kind in (2, 3):
+        values = np.array(re.sub(rb'#[^\n]*', b'', data[position:]).split()[:size], np.int64)
+    elif kind == 4:
+        # Raw PBM rows are padded to whole bytes
+        rows = np.frombuffer(data, np.uint8, height * -(-width // 8), position + 1)
+        values = np.unpackbits(rows.reshape(height, -1), axis=1)[:, :width].reshape(-1)
+    else:
+        dtype = np.dtype('>u2' if maxval > 255 else 'u1')
+        values = np.frombuffer(data[position + 1:position + 1 + size * dtype.itemsize], dtype)
+    if len(values) < size:
+        raise ValueError("P{} image data is cut short".format(kind))
+    if kind in (1, 4):
+        # 1 is black
+        values = 1 - values
+    values = (values.astype(np.int64) * 255 + maxval // 2) // maxval
+    return np.broadcast_to(values.astype(np.uint8).reshape(height, width, -1), (height, width, 3))
+
+
+def image_grid(pixels, extended=False):
+    # An image as a grid like art_grid()'s: every pixel becomes the nearest
+    # 3270 color and every two rows of pixels one row of half blocks
+    colors = image_colors[extended]
+    palette = np.array([[int(colors_3270[color][1][i:i + 2], 16) for i in (1, 3, 5)] for color in colors], np.int64)
+    # Nearest by squared distance, |pixel|² is the same for every color
+    rgb = pixels.reshape(-1, 3).astype(np.int64)
+    nearest = ((palette ** 2).sum(axis=1) - 2 * rgb @ palette.T).argmin(axis=1)
+    codes = np.array([0 if color == 0xF0 else color for color in colors], np.uint8)[nearest]
+    codes = codes.reshape(pixels.shape[:2])
+    if len(codes) % 2:
+        codes = np.vstack((codes, np.zeros((1, codes.shape[1]), np.uint8)))
+    chars, fg, bg = pixel_cells(codes[0::2], codes[1::2])
+    return chars, fg, bg, np.zeros(fg.shape, np.uint8), np.ones(fg.shape, bool)
+
+
+def blank_visible(bg, highlight):
+    # Whether a space in these character attributes looks any different
+    # from an empty cell
+    return bg not in (0x00, 0xF0, 0xF8) or highlight in (0xF2, 0xF4)
+
+
+def erase_range(x, y, etype, mode, cols=80, size=1920):
+    # The first and last address ESC[<mode>J or ESC[<mode>K clears with the
+    # cursor at x,y
+    address = ((x - 1) * cols + y - 1) % size
+    if etype == 'K':
+        first = address - address % cols
+        last = first + cols - 1
+    else:
+        first, last = 0, size - 1
+    if mode in ('', '0'):
+        first = address
+    elif mode == '1':
+        last = address
+    return first, last
+
+
+class Order:
+    # One 3270 order of the intermediate representation the converter
+    # builds before a backend lowers it to HLASM or bytes:
+    #   SBA   address          Set Buffer Address
+    #   SA    type, value      Set Attribute
+    #   TEXT  data (str)       characters the assembler translates, DC C'...'
+    #   GE    data (bytes)     EBCDIC, graphic escapes included, DC X'...'
+    #   RA    address, data    Repeat to Address with one (GE) character
+    #   SF    value            Start Field with 6-bit attribute value
+    #   SFE   data             Start Field Extended, (type, value) pairs
+    #   IC                     Insert Cursor
+    # comment is a line the HLASM backends put in front of the order.
+    __slots__ = ('op', 'address', 'type', 'value', 'data', 'comment')
+
+    def __init__(self, op, address=0, type=0, value=0, data=None, comment=None):
+        self.op = op
+        self.address = address
+        self.type = type
+        self.value = value
+        self.data = data
+        self.comment = comment
+
+    def __repr__(self):
+        if self.op == 'SBA':
+            return 'SBA({})'.format(self.address)
+        if self.op == 'SA':
+            return 'SA({:02X},{:02X})'.format(self.type, self.value)
+        if self.op == 'RA':
+            return 'RA({},{})'.format(self.address, self.data.hex().upper())
+        if self.op == 'SF':
+            return 'SF({:02X})'.format(self.value)
+        if self.op in ('TEXT', 'GE', 'SFE'):
+            return '{}({!r})'.format(self.op, self.data)
+        return self.op
+
+
+# Names of the SA order values, for the comments on orders drawn from the
+# finished screen
+sa_kinds = {0x42: '(FG)', 0x45: '(BG)', 0x41: '(HL)'}
+color_names_3270 = {
+    0x00: 'Default', 0xF0: 'Neutral', 0xF1: 'Blue', 0xF2: 'Red', 0xF3: 'Pink', 0xF4: 'Green',
+    0xF5: 'Turquoise', 0xF6: 'Yellow', 0xF7: 'White', 0xF8: 'Black', 0xF9: 'Deep Blue', 0xFA: 'Orange',
+    0xFB: 'Purple', 0xFC: 'Pale Green', 0xFD: 'Pale Turquoise', 0xFE: 'Grey', 0xFF: 'White',
+}
+highlight_names_3270 = {0x00: 'Normal', 0xF1: 'Blink', 0xF2: 'Reverse Video', 0xF4: 'Underline', 0xF8: 'Intensify'}
+
+
+def position_comment(address, orders, prefix=''):
+    # The "* (row,col) ..." comment the state machine puts on its SA
+    # orders, for SA orders (and the SFE fields' colors) set at address
+    names = [prefix] if prefix else []
+    for order in orders:
+        if order.op != 'SA' or order.type == 0x00:
+            names.append('Reset')
+            continue
+        values = highlight_names_3270 if order.type == 0x41 else color_names_3270
+        names.append('{} {}'.format(sa_kinds[order.type], values.get(order.value, '{:02X}'.format(order.value))))
+    return "* ({},{}) {}".format(address // 80 + 1, address % 80 + 1, ' '.join(names))
+
+
+def ge_units(data):
+    # Splits EBCDIC in to one bytes object per character, GE pairs included
+    units = []
+    i = 0
+    while i < len(data):
+        size = 2 if data[i] == 0x08 else 1
+        units.append(data[i:i + size])
+        i += size
+    return units
+
+
+def compress(items):
+    # Splits items in to ([items], 1) stretches and ([item], count) runs
+    # of 5 or more of the same item, which are cheaper as DC nC'x'
+    result = []
+    for item, group in groupby(items):
+        count = len(list(group))
+        if count >= 5:
+            result.append(([item], count))
+        elif result and result[-1][1] == 1:
+            result[-1][0].extend([item] * count)
+        else:
+            result.append(([item] * count, 1))
+    return result
+
+
+def buffer_address(address):
+    # The two byte 12-bit buffer address as hex
+    return tn3270_ba[address >> 6 & 0x3F] + tn3270_ba[address & 0x3F]
+
+
+def sf_keywords(value):
+    # The $SF macro keywords for a field attribute, None if there are none
+    protection = {0x00: 'UNPROT', 0x20: 'PROT', 0x10: 'NUM', 0x30: 'SKIP'}[value & 0x30]
+    display = {0x00: [], 0x08: ['HI'], 0x0C: ['NODISP']}.get(value & 0x0C)
+    if display is None or value & 0x02:
+        return None
+    return ','.join([protection] + display + (['MDT'] if value & 0x01 else []))
+
+
+@lru_cache(maxsize=segment_cache_size)
+def text_lines(data):
+    # The DC statements for a TEXT order's characters
+    dc = "         DC    {}\n"
+    lines = []
+    for items, count in compress(data):
+        if count > 1:
+            lines.append(dc.format("{}C'{}'".format(count, items[0])))
+        else:
+            for string in wrap(''.join(items), max_len, drop_whitespace=False):
+                lines.append(dc.format("C'{}'".format(string)))
+    return tuple(lines)
+
+
+@lru_cache(maxsize=segment_cache_size)
+def graphic_lines(data):
+    # The DC statements for a GE order's data
+    dc = "         DC    {}\n"
+    lines = []
+    for items, count in compress(ge_units(data)):
+        if count > 1:
+            lines.append(dc.format("{}X'{}'".format(count, items[0].hex().upper())))
+            continue
+        buffer = ''
+        for item in items:
+            buffer += item.hex().upper()
+            if len(buffer) > max_len:
+                lines.append(dc.format("X'{}'".format(buffer)))
+                buffer = ''
+        if buffer:
+            lines.append(dc.format("X'{}'".format(buffer)))
+    return tuple(lines)
+
+
+# Art repeats the same rows and runs (borders, shading, blank lines) over
+# and over, within a screen and across a batch of files
+segment_caches = (segment_codes, graphic_segment, text_lines, graphic_lines)
+
+
+def segment_cache_report():
+    hits = sum(cache.cache_info().hits for cache in segment_caches)
+    misses = sum(cache.cache_info().misses for cache in segment_caches)
+    return "Segment cache: {} hits, {} misses ({:.1%} hit rate)".format(hits, misses, hits / ((hits + misses) or 1))
+
+
+def hlasm_backend(orders, macros=False):
+    # Lowers orders to HLASM, with the TK4- $SBA/$SF/$IC macros or as
+    # plain DC statements for z/OS
+    dc = "         DC    {}\n"
+    lines = []
+    sa = None
+    for order in orders:
+        if order.comment is not None:
+            lines.append(order.comment + "\n")
+        if order.op == 'SA' and sa is not None and order.comment is None:
+            # Consecutive SA orders share a DC
+            sa += '28{:02X}{:02X}'.format(order.type, order.value)
+            lines[-1] = dc.format("X'{}'".format(sa))
+            continue
+        sa = None
+        row, col = order.address // 80 + 1, order.address % 80 + 1
+        if order.op == 'SBA':
+            if macros:
+                lines.append("         $SBA  ({},{})\n".format(row, col))
+            else:
+                lines.append("         DC    X'11{}'    SBA({},{})\n".format(buffer_address(order.address), row, col))
+        elif order.op == 'SA':
+            sa = '28{:02X}{:02X}'.format(order.type, order.value)
+            lines.append(dc.format("X'{}'".format(sa)))
+        elif order.op == 'TEXT':
+            lines.extend(text_lines(order.data))
+        elif order.op == 'GE':
+            lines.extend(graphic_lines(order.data))
+        elif order.op == 'RA':
+            lines.append("         DC    X'3C{}{}'    RA({},{})\n".format(
+                buffer_address(order.address), order.data.hex().upper(), row, col))
+        elif order.op == 'SF':
+            keywords = sf_keywords(order.value)
+            if macros and keywords:
+                lines.append("         $SF   ({})\n".format(keywords))
+            else:
+                lines.append("         DC    X'1D{}'    SF({})\n".format(tn3270_ba[order.value], keywords or ''))
+        elif order.op == 'SFE':
+            pairs = ''.join('{:02X}{}'.format(kind, tn3270_ba[value] if kind == 0xC0 else '{:02X}'.format(value))
+                            for kind, value in order.data)
+            keywords = [sf_keywords(value) for kind, value in order.data if kind == 0xC0]
+            lines.append("         DC    X'29{:02X}{}'    SFE({})\n".format(len(order.data), pairs, keywords[0] if keywords else ''))
+        elif order.op == 'IC':
+            lines.append("         $IC\n" if macros else "         DC    X'13'    IC\n")
+    return ''.join(lines)
+
+
+def tk4_backend(orders):
+    return hlasm_backend(orders, macros=True)
+
+
+def zos_backend(orders):
+    return hlasm_backend(orders)
+
+
+def dense_operands(orders):
+    # The DC operands for orders, neighbouring hex joined, as
+    # (type, value) pairs: ('X', hex), ('C', text) or ('nX'/'nC', unit)
+    # for a run of n units
+    operands = []
+
+    def add(kind, value):
+        if kind == 'X' and operands and operands[-1][0] == 'X':
+            operands[-1] = ('X', operands[-1][1] + value)
+        else:
+            operands.append((kind, value))
+
+    for order in orders:
+        if order.op == 'TEXT':
+            for items, count in compress(order.data):
+                if count > 1:
+                    add('{}C'.format(count), items[0])
+                else:
+                    add('C', ''.join(items))
+        elif order.op == 'GE':
+            for items, count in compress(ge_units(order.data)):
+                if count > 1:
+                    add('{}X'.format(count), items[0].hex().upper())
+                else:
+                    add('X', b''.join(items).hex().upper())
+        else:
+            add('X', bytes_backend([order]).hex().upper())
+    return operands
+
+
+def dense_backend(orders, continuations=9):
+    # Lowers orders to as few DC statements as possible: every card is
+    # filled up to column 71 with operands, X and C constants are split
+    # to fill what's left of a card, and statements go on for up to
+    # continuations continuation cards. Comments are left out. Assembles
+    # to the same bytes as the other backends.
+    room_per_card = dense_end - dense_start - 1  # leaves room for the comma
+    lines = []
+    cards = []
+    card = ''
+
+    def flush():
+        for i, operands in enumerate(cards):
+            start = "         DC    " if i == 0 else ' ' * dense_start
+            if i + 1 < len(cards):
+                lines.append("{:<{}}X\n".format(start + operands + ',', dense_end))
+            else:
+                lines.append(start + operands + "\n")
+        cards.clear()
+
+    def end_card():
+        nonlocal card
+        cards.append(card)
+        card = ''
+        if len(cards) > continuations:
+            flush()
+
+    def put(operand):
+        nonlocal card
+        if card and len(card) + 1 + len(operand) > room_per_card:
+            end_card()
+        card = card + ',' + operand if card else operand
+
+    for kind, value in dense_operands(orders):
+        if kind not in ('X', 'C'):
+            put("{}'{}'".format(kind, value))
+            continue
+        # Hex is split between bytes, text anywhere (it never holds quotes
+        # or ampersands, those are sent as hex)
+        step = 2 if kind == 'X' else 1
+        while value:
+            room = room_per_card - len(card) - (1 if card else 0) - 3
+            room -= room % step
+            if room < min(len(value), 4):
+                end_card()
+                continue
+            put("{}'{}'".format(kind, value[:room]))
+            value = value[room:]
+    if card:
+        end_card()
+    flush()
+    return ''.join(lines)
+
+
+def bytes_backend(orders, codepage='037', costs=None):
+    # Lowers orders straight to the bytes the assembled HLASM would hold.
+    # Given a costs list it also appends (address, cause, bytes) for what
+    # every order sends, see order_costs()
+    stream = bytearray()
+    address = 0
+    for order in orders:
+        start = len(stream)
+        if order.op == 'SBA':
+            stream += bytes.fromhex('11' + buffer_address(order.address))
+        elif order.op == 'SA':
+            stream += bytes((0x28, order.type, order.value))
+        elif order.op == 'TEXT':
+            stream += to_ebcdic(order.data, codepage)
+        elif order.op == 'GE':
+            stream += order.data
+        elif order.op == 'RA':
+            stream += bytes.fromhex('3C' + buffer_address(order.address)) + order.data
+        elif order.op == 'SF':
+            stream += bytes.fromhex('1D' + tn3270_ba[order.value])
+        elif order.op == 'SFE':
+            stream += bytes((0x29, len(order.data)))
+            for kind, value in order.data:
+                stream += bytes((kind, int(tn3270_ba[value], 16) if kind == 0xC0 else value))
+        elif order.op == 'IC':
+            stream.append(0x13)
+        if costs is not None:
+            address = order_costs(order, address, len(stream) - start, costs)
+    return bytes(stream)
+
+
+def order_costs(order, address, size, costs):
+    # Appends (address, cause, bytes) to costs for the size bytes order
+    # takes when the buffer address is address, returning the address after
+    # it. The cause is text (RA orders included), ge for the GE prefixes,
+    # sba, sa or field (SF, SFE and IC) and the address is the cell drawn,
+    # or moved to for SBA orders
+    if order.op in ('TEXT', 'GE'):
+        for unit in (order.data if order.op == 'TEXT' else ge_units(order.data)):
+            costs.append((address, 'text', 1))
+            if len(unit) == 2:
+                costs.append((address, 'ge', 1))
+            address = (address + 1) % 1920
+        return address
+    if order.op == 'SBA':
+        costs.append((order.address, 'sba', size))
+    elif order.op == 'SA':
+        costs.append((address, 'sa', size))
+    elif order.op == 'RA':
+        prefix = order.data[:1] == b'\x08'
+        costs.append((address, 'text', size - prefix))
+        if prefix:
+            costs.append((address, 'ge', 1))
+    else:
+        costs.append((address, 'field', size))
+    cells = order_cells(order)
+    return order.address if cells is None else (address + cells) % 1920
+
+
+def order_cells(order):
+    # How far order moves the buffer address, None when it sets it
+    if order.op in ('SBA', 'RA'):
+        return None
+    if order.op == 'TEXT':
+        return len(order.data)
+    if order.op == 'GE':
+        return len(ge_units(order.data))
+    if order.op in ('SF', 'SFE'):
+        return 1
+    return 0
+
+
+def drop_attributes(orders):
+    # Leaves out SA orders that set what is already set or that are
+    # replaced before any character is written, in one pass
+    types = (0x42, 0x45, 0x41)
+    current = dict.fromkeys(types, 0)
+    pending = []
+    result = []
+
+    def flush():
+        target = dict(current)
+        for order in pending:
+            if order.type == 0x00:
+                target = dict.fromkeys(types, 0)
+            elif order.type in target:
+                target[order.type] = order.value
+        changed = [kind for kind in types if target[kind] != current[kind]]
+        set_values = [kind for kind in types if target[kind]]
+        if len(changed) > 1 and len(set_values) + 1 < len(changed):
+            orders = [Order('SA', type=0x00, value=0x00)] + [Order('SA', type=kind, value=target[kind]) for kind in set_values]
+        else:
+            orders = [Order('SA', type=kind, value=target[kind]) for kind in changed]
+        if orders:
+            orders[0].comment = next((order.comment for order in pending if order.comment is not None), None)
+        result.extend(orders)
+        current.update(target)
+        pending.clear()
+
+    for order in orders:
+        if order.op == 'SA':
+            pending.append(order)
+            continue
+        if pending and order.op in ('TEXT', 'GE', 'RA'):
+            flush()
+        result.append(order)
+    if pending:
+        flush()
+    return result
+
+
+def drop_addresses(orders, size=1920):
+    # Leaves out SBA orders that don't move the buffer address or that are
+    # followed by another one, in one pass
+    address = 0
+    pending = None
+    result = []
+    for order in orders:
+        if order.op == 'SBA':
+            pending = order
+            continue
+        if pending is not None:
+            if pending.address != address:
+                result.append(pending)
+                address = pending.address
+            pending = None
+        result.append(order)
+        cells = order_cells(order)
+        address = order.address if cells is None else (address + cells) % size
+    if pending is not None and pending.address != address:
+        result.append(pending)
+    return result
+
+
+def join_text(orders):
+    # Joins neighbouring TEXT orders and neighbouring GE orders
+    result = []
+    for order in orders:
+        last = result[-1] if result else None
+        if last is not None and order.op == last.op and order.op in ('TEXT', 'GE') and order.comment is None:
+            result[-1] = Order(order.op, data=last.data + order.data, comment=last.comment)
+        else:
+            result.append(order)
+    return result
+
+
+def optimize(orders):
+    # Runs the linear passes over orders, returning new orders
+    return join_text(drop_addresses(drop_attributes(orders)))
+
+
+def row_segments(orders, cols=80, size=1920):
+    # Splits orders in to the runs that draw each row: a run starts at every
+    # SBA and wherever the buffer address reaches the start of a row, TEXT
+    # and GE orders running on to the next row are cut in two there
+    segments = [[]]
+    address = 0
+    for order in orders:
+        if order.op == 'SBA' and segments[-1]:
+            segments.append([])
+        while order.op in ('TEXT', 'GE') and address % cols + order_cells(order) > cols:
+            fits = cols - address % cols
+            if order.op == 'TEXT':
+                head, tail = order.data[:fits], order.data[fits:]
+            else:
+                units = ge_units(order.data)
+                head, tail = b''.join(units[:fits]), b''.join(units[fits:])
+            segments[-1].append(Order(order.op, data=head, comment=order.comment))
+            segments.append([])
+            address = (address + fits) % size
+            order = Order(order.op, data=tail)
+        segments[-1].append(order)
+        cells = order_cells(order)
+        address = order.address if cells is None else (address + cells) % size
+        if cells and address % cols == 0:
+            segments.append([])
+    return [segment for segment in segments if segment]
+
+
+def hlasm_rows(orders, cols=80, size=1920):
+    # Splits orders in to runs at the first order drawn on each new row,
+    # without cutting an order in two or parting SA orders that share a
+    # DC, so every run lowers to the same HLASM on its own as it does
+    # with the others
+    runs = []
+    row = None
+    address = 0
+    for order in orders:
+        start = order.address if order.op == 'SBA' else address
+        shares_dc = runs and order.op == 'SA' and runs[-1][-1].op == 'SA' and order.comment is None
+        if not runs or (start // cols != row and not shares_dc):
+            runs.append([])
+            row = start // cols
+        runs[-1].append(order)
+        cells = order_cells(order)
+        address = order.address if cells is None else (address + cells) % size
+    return runs
+
+
+def orders_key(orders):
+    # orders as something hashable that's equal for orders that lower the same
+    return tuple((order.op, order.address, order.type, order.value,
+                  tuple(order.data) if isinstance(order.data, list) else order.data, order.comment)
+                 for order in orders)
+
+
+# Extended colors to the nearest of the seven base colors
+near_colors = {0xF8: 0xF0, 0xF9: 0xF1, 0xFA: 0xF6, 0xFB: 0xF3, 0xFC: 0xF4, 0xFD: 0xF5, 0xFE: 0xF7, 0xFF: 0xF7}
+
+# Plain characters for the ones sent as graphic escapes
+plain_chars = {
+    '─': '-', '│': '|', '┌': '+', '┐': '+', '└': '+', '┘': '+', '├': '+', '┤': '+',
+    '┬': '+', '┴': '+', '┼': '+', '╤': '+', '╧': '+',
+    '▀': '"', '▄': '_', '█': '#', '▌': '#', '▐': '#', '■': '#',
+    '∙': '.', '≡': '=', '≈': '~', '≤': '<', '≥': '>', '⌠': '(', '⌡': ')', '∞': '8', '∩': 'n',
+    'Σ': 'E', 'Φ': 'O', 'Ω': 'O', 'ε': 'e', 'π': 'n', 'σ': 'o',
+}
+
+
+def merge_colors(screen, written, text):
+    # Extended foreground and background colors become the nearest base color
+    merged = 0
+    for address in written:
+        for colors in (screen.fg, screen.bg):
+            if colors[address] in near_colors:
+                colors[address] = near_colors[colors[address]]
+                merged += 1
+    return merged and "merged {} extended colors in to base colors".format(merged)
+
+
+def drop_backgrounds(screen, written, text):
+    dropped = sum(bool(screen.bg[address]) for address in written)
+    screen.bg[:] = bytes(screen.size)
+    return dropped and "dropped the background color of {} cells".format(dropped)
+
+
+def plain_graphics(screen, written, text):
+    # Characters sent as graphic escapes (two bytes each) become plain ones
+    replaced = 0
+    for address in written:
+        char, graphic = text[address]
+        if graphic:
+            text[address] = (plain_chars.get(char, '*'), False)
+            replaced += 1
+    return replaced and "replaced {} graphic characters with plain ones".format(replaced)
+
+
+# The ways fit_budget() makes a screen smaller, least lossy first. Each
+# changes (screen, written, text) from ansi_screen() in place and says
+# what it did, or returns something false when there was nothing to do.
+budget_reductions = (merge_colors, drop_backgrounds, plain_graphics)
+
+
+def object_card(kind, fields, sequence, codepage='037'):
+    # One 80 byte object deck card: X'02', the card type and columns 5-72
+    # from fields (a dict of 1-based column: bytes), blanks elsewhere
+    card = bytearray(to_ebcdic(' ' * 80, codepage))
+    card[0] = 0x02
+    card[1:4] = to_ebcdic(kind, codepage)
+    for column, data in fields.items():
+        card[column - 1:column - 1 + len(data)] = data
+    card[72:80] = to_ebcdic('A2E{:05d}'.format(sequence), codepage)
+    return bytes(card)
+
+
+def object_symbol(text, codepage='037'):
+    # text as an 8 character external symbol
+    return to_ebcdic(text.upper().ljust(8)[:8], codepage)
+
+
+def object_txt(offset, data, sequence, codepage='037'):
+    # The TXT cards putting data at offset in the section with ESDID 1,
+    # numbered from sequence
+    return [object_card('TXT', {6: (offset + start).to_bytes(3, 'big'),
+                                11: len(data[start:start + 56]).to_bytes(2, 'big'),
+                                15: (1).to_bytes(2, 'big'), 17: data[start:start + 56]},
+                        sequence + number, codepage)
+            for number, start in enumerate(range(0, len(data), 56))]
+
+
+def object_deck(name, data, labels=(), relocations=(), codepage='037', external=None):
+    # data as an object deck holding one control section called name: ESD
+    # cards defining it and labels ((name, offset) pairs), TXT cards with
+    # the data, RLD cards for the 4 byte address constants at relocations
+    # (offsets of addresses in to the section itself, or in to the section
+    # called external when given) and an END card
+    def halfword(value):
+        return value.to_bytes(2, 'big')
+
+    cards = []
+    # SD has ESDID 1 and the external reference ESDID 2, label definitions
+    # point back at the SD
+    items = [object_symbol(name, codepage) + b'\x00' + bytes(3) + b'\x00' + len(data).to_bytes(3, 'big')]
+    if external:
+        items.append(object_symbol(external, codepage) + b'\x02' + bytes(3) + b'\x40' + bytes(3))
+    items += [object_symbol(label, codepage) + b'\x01' + offset.to_bytes(3, 'big') + b'\x40' + (1).to_bytes(3, 'big')
+              for label, offset in labels]
+    for i in range(0, len(items), 3):
+        fields = {11: halfword(16 * len(items[i:i + 3])), 17: b''.join(items[i:i + 3])}
+        if i == 0:
+            fields[15] = halfword(1)
+        cards.append(object_card('ESD', fields, len(cards) + 1, codepage))
+
+    cards += object_txt(0, data, len(cards) + 1, codepage)
+
+    # R pointer the section or external, P pointer the section, flag:
+    # A-type, 4 bytes, positive
+    entries = [halfword(2 if external else 1) + halfword(1) + b'\x0C' + offset.to_bytes(3, 'big')
+               for offset in relocations]
+    for i in range(0, len(entries), 7):
+        rld = b''.join(entries[i:i + 7])
+        cards.append(object_card('RLD', {11: halfword(len(rld)), 17: rld}, len(cards) + 1, codepage))
+
+    cards.append(object_card('END', {}, len(cards) + 1, codepage))
+    return b''.join(cards)
+
+
+def object_stream(name, chunks, codepage='037'):
+    # object_deck() for a section without labels or address constants
+    # whose data comes in chunks, yielding the TXT cards for each chunk as
+    # it comes in. The SD's length is left at 0 so the END card gives it
+    # instead.
+    yield object_card('ESD', {11: (16).to_bytes(2, 'big'), 15: (1).to_bytes(2, 'big'),
+                              17: object_symbol(name, codepage) + bytes(8)}, 1, codepage)
+    sequence = 2
+    offset = 0
+    pending = b''
+    for chunk in chunks:
+        pending += chunk
+        whole = len(pending) - len(pending) % 56
+        cards = object_txt(offset, pending[:whole], sequence, codepage)
+        yield b''.join(cards)
+        sequence += len(cards)
+        offset += whole
+        pending = pending[whole:]
+    cards = object_txt(offset, pending, sequence, codepage)
+    yield b''.join(cards)
+    sequence += len(cards)
+    yield object_card('END', {29: (offset + len(pending)).to_bytes(4, 'big')}, sequence, codepage)
+
 
 class ANSITN3270:
 
@@ -1013,7 +2175,10 @@ class ANSITN3270:
                  jobname='killerb', tk4=True, zos=False,
                  row="23", column="20",input="20", color="PINK",
                  tso=True, netsol=False, sysgen=False, usstable=False,
-                 extended=False):
+                 extended=False, color_method='auto', input_codec='auto', codepage='037',
+                 binary=False, viewport=(1, 1), paged=False, overlap=0, object=False,
+                 max_bytes=0, dense=False, shrink=None, write_messages=False,
+                 import_hlasm=False, variants=(), generate=True):
 
         self.hlasm = ''
         self.cursor_hlasm = ''
@@ -1032,6 +2197,34 @@ class ANSITN3270:
         self.cursor = { 'loc': (row,column), 'spaces' : input, 'color' : color}
 
         self.extended = extended
+        self.color_method = color_method
+        self.input_codec = input_codec
+        self.codepage = codepage
+        self.binary = binary or object
+        # Link the art from an object deck instead of assembling it
+        self.object = object
+        # The row and column of the art shown in the top left corner
+        self.viewport = viewport
+        # Paged TSO programs show the art 24 rows at a time, each page
+        # repeating the last overlap rows of the one before
+        self.paged = paged
+        self.overlap = overlap
+        # Largest data stream allowed, fit_budget() degrades the art until
+        # it fits and lists what it changed in self.reductions
+        self.max_bytes = max_bytes
+        # Pack the DC statements on full cards with continuations
+        self.dense = dense
+        # (columns, rows) of the art shrunk in to each cell, or 'auto' to
+        # shrink wide art to 80 columns
+        self.shrink = shrink
+        # USS messages other than MSG 10 only write the message line
+        self.write_messages = write_messages
+        # The input file is a screen in HLASM to generate again
+        self.import_hlasm = import_hlasm
+        # USS table art picked by SYSPARM from the input file and these
+        self.variants = [ansifile] + list(variants) if variants else []
+        self.reductions = []
+        self.fits = True
         self.bold = False
         self.current_fg = '(FG) White'
 
@@ -1051,15 +2244,7 @@ class ANSITN3270:
             self.zos = True
             self.tk4 = False
 
-        f = open(ansifile, "r", encoding='cp437')
-        self.ansi = f.read()
-
-        #Remove ANSI SAUCE record
-        if self.ansi.rfind('\x1aSAUCE') >= 0:
-            self.ansi = self.ansi[:self.ansi.rfind('SAUCE')-1]
-
-        #Parse the SAUCE record:
-        self.sauced = SAUCE(ansifile)
+        self.read_ansi(ansifile)
 
         print("[+] ANSi to EBCDiC Starting")
         print("[+] Arguments:\n\n    ANSi File:\t{}".format(ansifile))
@@ -1067,11 +2252,44 @@ class ANSITN3270:
         if self.extended:
                 print("    Extended:\t\tTrue")
 
+        if color_method != 'auto':
+                print("    Colors:\t\t{}".format(color_method.upper()))
+
+        if self.image is not None:
+            print("    Image:\t\t{}x{} pixels".format(self.image.shape[1], self.image.shape[0]))
+
+        print("    Input codec:\t{}".format(self.codec.name))
+        print("    Code page:\t\t{}".format(codepage))
+
+        if object:
+            print("    Object deck:\tTrue")
+
+        if max_bytes:
+            print("    Max bytes:\t\t{}".format(max_bytes))
+
+        if dense:
+            print("    Dense HLASM:\tTrue")
+
+        if write_messages:
+            print("    USS messages:\tWrite")
+
+        if variants:
+            print("    Variants:\t\t{}".format(', '.join('{} ({})'.format(*variant) for variant in
+                                                         zip(self.variant_names(), self.variant_members()))))
+
+        if shrink:
+            print("    Shrink:\t\t{}".format('auto' if shrink == 'auto' else '{}x{} cells per cell'.format(*shrink)))
+
+        if viewport != (1, 1) or self.canvas[0] != 80:
+            print("    Viewport:\t\t{},{} of {} column wide art".format(viewport[0], viewport[1], self.canvas[0]))
+
         if tso:
             if tk4:
                 print("    Type:\t\tTSO (TK4-)")
             else:
                 print("    Type:\t\tTSO (z/OS)")
+            if paged:
+                print("    Pages:\t\t24 rows, {} overlapping".format(overlap))
 
         if netsol:
             print("    Type:\t\tTK4- NETSOL (VTAM)")
@@ -1084,8 +2302,8 @@ class ANSITN3270:
         print("    Member:\t\t{}".format(member))
 
         if not tso:
-            print("    Cursor: (IC)\n\tLocation:\t{},{}".format(row, column))
-            print("\tInput length:\t{}".format(input))
+            print("    Cursor: (IC)\n\tLocation:\t{},{}".format(*self.cursor['loc']))
+            print("\tInput length:\t{}".format(self.cursor['spaces']))
             print("\tInput Color:\t{}".format(color))
 
         try:
@@ -1099,47 +2317,1086 @@ class ANSITN3270:
 
         print("\n\n")
 
+        if generate:
+            self.generate_output()
+
+    def read_ansi(self, ansifile):
+        data = read_art(ansifile)
+
+        # Images have no text or SAUCE record, ansi_pages() draws their pixels
+        self.image = None
+        self.imported = None
+        if os.path.splitext(ansifile)[1].lower() in image_extensions:
+            self.image = read_pnm(data)
+            self.sauced = None
+            self.codec = input_codec(self.input_codec if self.input_codec != 'auto' else 'cp437', self.codepage)
+            self.ansi = ''
+            self.canvas = (self.image.shape[1], 1 << 30)
+            return
 
-        self.generate_output()
+        if self.import_hlasm:
+            self.read_hlasm(data)
+            return
 
+        #Parse the SAUCE record:
+        self.sauced = SAUCE(data=data) if data else None
 
-    def generate_output(self):
+        #Remove ANSI SAUCE record
+        if data.rfind(b'\x1aSAUCE') >= 0:
+            data = data[:data.rfind(b'SAUCE')-1]
+
+        self.codec = input_codec(self.detect_codec(data), self.codepage)
+        self.ansi = self.codec.decode(data)
+
+        # The art wraps at the SAUCE width, rows don't wrap at all
+        try:
+            width = int(self.sauced.tinfo1)
+        except:
+            width = 0
+        self.canvas = (width if 0 < width <= 1000 else 80, 1 << 30)
+
+    def read_hlasm(self, data):
+        # --import-hlasm: plays the screen in data (see hlasm_stream()) on a
+        # 3270, self.imported holds it and the size of its data stream. The
+        # input field goes where the screen has its unprotected field.
+        try:
+            hlasm = data.decode('utf-8')
+        except UnicodeDecodeError:
+            hlasm = data.decode('latin-1')
+        stream = hlasm_stream(hlasm, self.codepage)
+        if stream is None:
+            raise ValueError("No 3270 screen found in {}".format(self.ansifile))
+        played = Screen3270(codepage=self.codepage)
+        played.write(stream)
+        size = len(stream)
+        header = netsol_header(self.codepage)[:-3]
+        if self.jcl == 'netsol' and stream.startswith(header):
+            # Counted like data_stream() does, without NETSOL's own fields
+            # (up to the SBA to the art)
+            size -= len(header) - 2
+        self.imported = (played, size)
+        self.sauced = None
+        self.codec = input_codec('utf-8', self.codepage)
+        self.ansi = ''
+        self.canvas = (80, 1 << 30)
+
+        fields = sorted(played.fields)
+        unprotected = [address for address in fields if not played.fields[address][0] & field_attributes['PROT']]
+        if unprotected and self.jcl != 'tso':
+            # The one holding the cursor, up to the next field or the end of its row
+            holding = [address for address in unprotected if played.field_map()[played.cursor] == played.fields[address]]
+            start = (holding or unprotected)[0]
+            following = (fields[(fields.index(start) + 1) % len(fields)] - start - 1) % played.size
+            self.cursor['loc'] = (str(start // 80 + 1), str(start % 80 + 1))
+            self.cursor['spaces'] = str(min(following or played.size - 1, 79 - start % 80) or 1)
+            logger.debug("Imported input field at {},{} of {} characters".format(
+                         *self.cursor['loc'], self.cursor['spaces']))
+
+    def imported_screen(self):
+        # The imported screen as ansi_screen() would give it: every cell
+        # that doesn't look empty, in the colors it's shown in, leaving out
+        # what NETSOL's own part of the screen already shows
+        played = self.imported[0]
+        template = [None] * played.size
+        if self.jcl == 'netsol':
+            header = Screen3270(codepage=self.codepage)
+            header.write(netsol_header(self.codepage))
+            template = header.looks()
+        screen = Screen3270(unformatted=(field_attributes['SKIP'] | field_attributes['HI'], 0, 0, 0),
+                            codepage=self.codepage)
+        written, text = set(), {}
+        for address, (char, fg, bg, hl) in enumerate(played.looks()):
+            if (char == ' ' and not blank_visible(bg, hl)) or template[address] == (char, fg, bg, hl):
+                continue
+            code, ge = (played.chars[address], bool(played.ge[address])) if char != ' ' else (0x40, False)
+            if ge and code not in ge_chars:
+                char, code, ge = '?', to_ebcdic('?', self.codepage)[0], False
+            screen.put(address, code, ge, fg, bg, hl)
+            written.add(address)
+            text[address] = (ge_chars[code] if ge else char, ge)
+        return screen, written, text
+
+    def detect_codec(self, data):
+        # --input-codec, or the SAUCE font, or UTF-8 if it decodes as UTF-8
+        # and isn't plain ASCII, or CP437
+        if self.input_codec != 'auto':
+            return self.input_codec
+        try:
+            font = self.sauced.filler
+            if isinstance(font, bytes):
+                font = font.decode('cp437')
+            codec = sauce_codec(font.replace('\x00', '').strip())
+        except:
+            codec = None
+        if codec:
+            logger.debug("SAUCE font {} uses {}".format(font, codec))
+            return codec
+        try:
+            data.decode('utf-8')
+            if not data.isascii():
+                return 'utf-8'
+        except UnicodeDecodeError:
+            pass
+        return 'cp437'
+
+    def reset(self):
+        self.orders = []
+        self.hlasm = ''
+        self.cursor_orders = []
+        self.cursor_hlasm = ''
+        self.reset_cursor()
+
+    def reset_cursor(self):
+        # The state machine's cursor, colors and what it knows of the screen,
+        # leaving the orders converted so far alone
+        self.x = 1
+        self.y = 1
+        # Where the cursor wraps
+        self.width = 80
+        self.height = 24
+        self.moved = False
+        # Cells known to be empty, Erase/Write starts with all of them empty
+        self.blank = bytearray(b'\x01') * 1920
+        self.sa = [0, 0, 0]
+        self.bold = False
+        self.current_fg = '(FG) White'
 
+    def convert(self):
+        # (Re)builds self.orders, self.cursor_orders and their HLASM from self.ansi
+        self.reset()
         self.ansi_state_machine(self.ansi)
+        self.choose_colors()
+
+        if self.jcl != 'tso':
+            self.generate_cursor()
+        self.fit_budget()
+
+    def row_state(self):
+        # Everything the state machine carries from one line to the next
+        return (self.x, self.y, self.moved, bytes(self.blank), tuple(self.sa),
+                self.bold, self.current_fg, self.escaped,
+                self.escape_sequence, self.graphic, self.ascii_text)
+
+    def restore_row_state(self, state):
+        (self.x, self.y, self.moved, blank, sa,
+         self.bold, self.current_fg, self.escaped,
+         self.escape_sequence, self.graphic, self.ascii_text) = state
+        self.blank = bytearray(blank)
+        self.sa = list(sa)
+
+    def convert_rows(self):
+        # Like convert() but line by line, reusing the tokens and orders of
+        # every line whose text and starting state haven't changed since the
+        # last call. The colors are still chosen from the whole finished
+        # screen, drawn from the kept tokens, and only the rows of HLASM that
+        # changed are lowered again (lower_rows). Returns the number of lines
+        # that had to be converted.
+        previous = getattr(self, 'rows', [])
+        if previous:
+            last = (self.orders, self.hlasm, self.cursor_orders, self.cursor_hlasm)
+        self.reset()
+        self.ansi_state_machine('')
+        lines = self.ansi.split('\n')
+        lines = [line + '\n' for line in lines[:-1]] + lines[-1:]
+        rows = []
+        converted = 0
+        state = self.row_state()
+
+        for i, line in enumerate(lines):
+            key = (line, state)
+            if i < len(previous) and previous[i][0] == key:
+                orders, state, tokens = previous[i][1:]
+                self.restore_row_state(state)
+            else:
+                self.orders = []
+                tokens = self.tokenize(line)
+                self.render(tokens)
+                orders = self.orders
+                state = self.row_state()
+                converted += 1
+            rows.append((key, orders, state, tokens))
+
+        if not converted and len(lines) == len(previous):
+            self.orders, self.hlasm, self.cursor_orders, self.cursor_hlasm = last
+            self.lowered = 0
+            return 0
+
+        self.rows = rows
+        self.orders = [order for row in rows for order in row[1]]
+        self.choose_colors([token for row in rows for token in row[3]], lower=self.lower_rows)
+
+        if self.jcl != 'tso':
+            self.generate_cursor()
+        self.fit_budget()
+        return converted
+
+    def lower_rows(self, orders):
+        # lower() a run of rows at a time (hlasm_rows), reusing the HLASM of
+        # every run the last call lowered too. self.lowered is how many runs
+        # had to be lowered. --dense packs its DCs across rows so it's
+        # lowered in one go.
+        previous = getattr(self, 'row_hlasm', {})
+        self.row_hlasm = {}
+        self.lowered = 0
+        if self.dense:
+            self.lowered = 1
+            return self.lower(orders)
+        hlasm = []
+        for run in hlasm_rows(orders):
+            key = orders_key(run)
+            if key not in self.row_hlasm:
+                if key in previous:
+                    self.row_hlasm[key] = previous[key]
+                else:
+                    self.row_hlasm[key] = self.lower(run)
+                    self.lowered += 1
+            hlasm.append(self.row_hlasm[key])
+        return ''.join(hlasm)
+
+    def watch_output(self):
+        # jcl_output() for watch(): the JCL around the HLASM is only formatted
+        # again when something that goes in to it changed, the HLASM is
+        # spliced in to it
+        key = (self.ansi_info, self.command_args, self.cursor_hlasm, datetime.today().date())
+        if getattr(self, 'frame', (None,))[0] != key:
+            hlasm, self.hlasm = self.hlasm, '\x00'
+            try:
+                parts = self.jcl_output().split('\x00')
+            finally:
+                self.hlasm = hlasm
+            self.frame = (key, parts if len(parts) == 2 else None)
+        parts = self.frame[1]
+        if parts is None:
+            return self.jcl_output()
+        return parts[0] + self.hlasm.rstrip() + parts[1]
+
+    def watch(self, ansifile, interval=0.05):
+        # Regenerates self.filename every time ansifile changes
+        mtime = None
+        while True:
+            try:
+                current = os.stat(ansifile).st_mtime_ns
+            except OSError:
+                current = mtime
+            if current != mtime:
+                mtime = current
+                start = time.perf_counter()
+                try:
+                    self.read_ansi(ansifile)
+                    converted = self.convert_rows()
+                    self.SAUCE_info()
+                    self.command_args_info()
+                    self.write_output(self.watch_output())
+                    print("[+] {}: {} of {} lines converted, {} rows of HLASM lowered, {} written in {:.1f}ms".format(
+                          ansifile, converted, len(self.rows), self.lowered, self.filename,
+                          (time.perf_counter() - start) * 1000))
+                except Exception as e:
+                    print("[!] Could not convert {}: {}".format(ansifile, e))
+            time.sleep(interval)
+
+    def write_output(self, output, filename=None):
+        # Replaces the output file atomically so readers never see half a
+        # file, output is a string or an iterable of whole lines (and, for
+        # --binary, bytes written as they are)
+        filename = filename or self.filename
+        tmp = filename + '.tmp'
+        if isinstance(output, str):
+            output = [output]
+        with open(tmp, 'wb' if self.binary else 'w') as outfile:
+            for chunk in output:
+                if isinstance(chunk, bytes):
+                    outfile.write(chunk)
+                else:
+                    outfile.write(ebcdic_records(chunk, self.codepage) if self.binary else chunk)
+        os.replace(tmp, filename)
+
+    def set_target(self, jcl, tk4=True, extended=False):
+        self.jcl = jcl
+        self.tk4 = tk4
+        self.zos = not tk4
+        self.extended = extended
+
+    def generate_targets(self, targets, extended_modes):
+        # Parses the ANSi once and renders it for every target in targets
+        # (names from target_types) and every extended mode (True/False),
+        # writing one JCL file per combination
+        self.reset_parser()
+        tokens = self.tokenize(self.ansi)
         self.SAUCE_info()
         self.command_args_info()
 
+        if self.filename:
+            root, ext = os.path.splitext(self.filename)
+        else:
+            root, ext = os.path.splitext(self.ansifile)[0], '.jcl'
+
+        for target in targets:
+            for extended in extended_modes:
+                self.set_target(*target_types[target], extended=extended)
+                self.reset()
+                self.render(tokens)
+                self.choose_colors(tokens)
+                if self.jcl != 'tso':
+                    self.generate_cursor()
+                filename = "{}-{}{}{}".format(root, target, '-extended' if extended else '', ext)
+                print("[+] Saving {}{} JCL + HLASM to {}".format(target, ' (extended)' if extended else '', filename))
+                self.write_output(self.jcl_output(), filename)
+        print("[+] {}".format(segment_cache_report()))
+
+    def data_stream(self):
+        # The Erase/Write data stream the generated HLASM would send, as bytes
+        if self.jcl == 'tso':
+            # tso_hlasm STREAM minus the TPUT escape character
+            hlasm = self.hlasm + "\n         DC    X'115D7F'\n         DC    X'1DF8'"
+        elif self.jcl == 'usstable':
+            hlasm = self.hlasm + "\n" + self.cursor_hlasm
+        else:
+            hlasm = "         $SBA  (1,1)\n{}\n{}\n         $SBA  (24,80)\n         $SF   (SKIP,HI)".format(self.hlasm, self.cursor_hlasm)
+        return bytes.fromhex('F5C3') + assemble_hlasm(hlasm, self.codepage)
+
+    def ansi_screen(self, tokens):
+        # The screen the ANSi describes: every character placed where the
+        # state machine's cursor says it goes, in the colors its SA orders
+        # select. Returns the screen, the addresses the ANSi wrote to and the
+        # (character, graphic) it wrote at each of them.
+        return next(self.ansi_pages(tokens, count=1))
+
+    def ansi_pages(self, tokens, count=None, step=24):
+        # Like ansi_screen for every page of the art in one pass, handing out
+        # the pages one at a time: page n shows the art from the viewport
+        # moved down n * step rows. Without count there are as many pages as
+        # the art is tall, and only the pages the cursor's row is on are
+        # kept. A page is finished once the ANSi writes below it, anything
+        # the cursor goes back up to draw on it after that is left out.
+        if self.imported is not None:
+            self.clipped = False
+            yield self.imported_screen()
+            return
+
+        if self.image is not None or self.shrink:
+            grid = image_grid(self.image, self.extended) if self.image is not None else self.art_grid(tokens)
+            if self.shrink:
+                across, down = self.shrink if self.shrink != 'auto' else (-(-self.canvas[0] // 80), 1)
+                grid = shrink_grid(grid, across, down)
+            yield from self.grid_pages(grid, count, step)
+            return
+
+        # The pages still being drawn by number, done is the first of them
+        # and made is how many pages there are so far
+        pages = {}
+        done = made = 0
+
+        def page(number):
+            nonlocal made
+            while made <= number:
+                pages[made] = (Screen3270(unformatted=(field_attributes['SKIP'] | field_attributes['HI'], 0, 0, 0),
+                                          codepage=self.codepage), set(), {})
+                made += 1
+            return pages[number]
+
+        def finish(number):
+            # Hands out the pages in front of page number
+            nonlocal done
+            if number > done:
+                page(number - 1)
+            while done < number:
+                yield pages.pop(done)
+                done += 1
+
+        def on_pages(row):
+            # The pages still being drawn that show row (counted from the
+            # first page's top row)
+            if row < 0:
+                return range(0)
+            last = row // step
+            if count:
+                last = min(last, count - 1)
+            elif last >= max_pages:
+                return range(0)
+            return range(max(done, -((23 - row) // step)), last + 1)
+
+        if count:
+            page(count - 1)
+        sa = [0, 0, 0]
+        self.reset_cursor()
+        # Work in the art's own space and only keep what the pages show,
+        # self.clipped says if anything fell outside them
+        self.width, self.height = self.canvas
+        top, left = self.viewport
+        self.clipped = False
+        for token in tokens:
+            if token[0] == 'text':
+                codes = segment_codes(token[1], self.codec.name, self.codec.codepage)
+                for char, (code, ge) in zip(token[1], codes):
+                    row, col = self.x - top, self.y - left
+                    if not count and row >= 24 + done * step:
+                        yield from finish(min(-((23 - row) // step), max_pages))
+                    numbers = on_pages(row) if 0 <= col < 80 else range(0)
+                    for number in numbers:
+                        screen, written, text = page(number)
+                        address = (row - number * step) * 80 + col
+                        screen.put(address, code, ge, *sa)
+                        written.add(address)
+                        text[address] = (char, token[2])
+                    if not numbers:
+                        self.clipped = True
+                    self.inc_y()
+            elif token[0] == 'newline':
+                self.inc_x()
+                self.reset_y()
+            elif token[2] == 'm':
+                apply_sa(sa, self.sgr_sa(token[1])[1])
+            elif token[2] in 'ABCDEFGRH':
+                self.move_cursor(token[1], token[2])
+            elif token[2] in 'JK':
+                if not on_pages(self.x - top) or not 0 <= self.y - left < 80:
+                    self.clipped = True
+                for number, (screen, written, text) in pages.items():
+                    for address in self.erase_cells(token[2], token[1][1:], screen, top + number * step, left):
+                        screen.put(address, 0x40, False, *sa)
+                        written.add(address)
+                        text[address] = (' ', False)
+                if token[2] == 'J' and token[1][1:] == '2':
+                    self.x, self.y = 1, 1
+        self.width, self.height = 80, 24
+        yield from finish(made)
+
+    def art_grid(self, tokens):
+        # The whole art as NumPy arrays of rows x art width: the character
+        # (code point) in every cell, its foreground, background and
+        # highlight and whether the ANSi wrote to it. Walking the tokens only
+        # collects the runs written (ESC[J and ESC[K write spaces), they're
+        # all put in the arrays at once with the last write to a cell
+        # winning.
+        width = self.canvas[0]
+        limit = 24 * max_pages * width
+        starts, texts, colors = [], [], []
+        end = 0
+        sa = [0, 0, 0]
+        self.reset_cursor()
+        self.width, self.height = self.canvas
+        for token in tokens:
+            position = (self.x - 1) * width + self.y - 1
+            if token[0] == 'text':
+                stop = position + len(token[1])
+                if stop <= limit:
+                    starts.append(position)
+                    texts.append(token[1])
+                    colors.append(tuple(sa))
+                    end = max(end, stop)
+                self.x, self.y = stop // width + 1, stop % width + 1
+            elif token[0] == 'newline':
+                self.inc_x()
+                self.reset_y()
+            elif token[2] == 'm':
+                apply_sa(sa, self.sgr_sa(token[1])[1])
+            elif token[2] in 'ABCDEFGRH':
+                self.move_cursor(token[1], token[2])
+            elif token[2] in 'JK' and position < limit:
+                line = position - position % width
+                # ESC[J clears at least a screen full, like on a terminal
+                last = max(-(-end // width) * width, line + width, 24 * width)
+                start, stop = {'J': (position, last), 'J1': (0, position + 1), 'J2': (0, last),
+                               'K': (position, line + width), 'K1': (line, position + 1),
+                               'K2': (line, line + width)}.get(token[2] + token[1][1:].lstrip('0'), (0, 0))
+                starts.append(start)
+                texts.append(' ' * (stop - start))
+                colors.append(tuple(sa))
+                end = max(end, stop)
+                if token[2] == 'J' and token[1][1:] == '2':
+                    self.x, self.y = 1, 1
+        self.width, self.height = 80, 24
+
+        rows = -(-end // width)
+        grid = [np.zeros(rows * width, dtype) for dtype in (np.uint32, np.uint8, np.uint8, np.uint8, bool)]
+        lengths = np.array([len(text) for text in texts], np.int64)
+        if lengths.sum():
+            # Every character's cell, then only the last write to each cell
+            offsets = np.repeat(np.array(starts, np.int64) - (np.cumsum(lengths) - lengths), lengths)
+            cells = offsets + np.arange(len(offsets))
+            last = len(cells) - 1 - np.unique(cells[::-1], return_index=True)[1]
+            cells = cells[last]
+            grid[0][cells] = np.frombuffer(''.join(texts).encode('utf-32-le'), np.uint32)[last]
+            sa = np.repeat(np.array(colors, np.uint8).reshape(-1, 3), lengths, axis=0)[last]
+            grid[1][cells], grid[2][cells], grid[3][cells] = sa.T
+            grid[4][cells] = True
+        return tuple(cells.reshape(rows, width) for cells in grid)
+
+    def grid_pages(self, grid, count=None, step=24):
+        # ansi_pages() for art as arrays (from art_grid() or shrink_grid()),
+        # one screen at a time
+        chars, fg, bg, hl, written = grid
+        top, left = self.viewport
+        shown = written[top - 1:, left - 1:left + 79]
+        used = np.flatnonzero(shown.any(axis=1))
+        if not count:
+            count = min(used[-1] // step + 1, max_pages) if len(used) else 0
+        self.clipped = bool(written.sum() > shown[:(count - 1) * step + 24].sum()) if count else bool(written.any())
+
+        # Every character's EBCDIC code, GE flag and graphic mode
+        unique = np.unique(chars[written])
+        entries = [self.codec[chr(char)] for char in unique.tolist()]
+        codes = np.array([ebcdic_code(entry[0])[0] for entry in entries] or [0], np.uint8)
+        ge = np.array([ebcdic_code(entry[0])[1] for entry in entries] or [False])
+        graphic = [entry[1] for entry in entries]
+
+        for number in range(count):
+            cells = [np.zeros((24, 80), array.dtype) for array in grid]
+            for page, array in zip(cells, grid):
+                part = array[top - 1 + number * step:top - 1 + number * step + 24, left - 1:left + 79]
+                page[:len(part), :part.shape[1]] = part
+            page_chars, page_fg, page_bg, page_hl, page_written = (page.reshape(-1) for page in cells)
+            index = np.where(page_written, np.searchsorted(unique, page_chars).clip(0, max(len(unique) - 1, 0)), 0)
+            screen = Screen3270(unformatted=(field_attributes['SKIP'] | field_attributes['HI'], 0, 0, 0),
+                                codepage=self.codepage)
+            screen.chars[:] = np.where(page_written, codes[index], 0).astype(np.uint8).tobytes()
+            screen.ge[:] = np.where(page_written, ge[index], False).astype(np.uint8).tobytes()
+            for screen_cells, page in ((screen.fg, page_fg), (screen.bg, page_bg), (screen.hl, page_hl)):
+                screen_cells[:] = np.where(page_written, page, 0).astype(np.uint8).tobytes()
+            addresses = np.flatnonzero(page_written).tolist()
+            text = {address: (chr(char), graphic[i]) for address, char, i in
+                    zip(addresses, page_chars[addresses].tolist(), index[addresses].tolist())}
+            yield screen, set(addresses), text
+
+    def art_extent(self, tokens):
+        # The rows and columns of the art the ANSi writes to
+        self.reset_cursor()
+        self.width, self.height = self.canvas
+        rows = cols = 0
+        for token in tokens:
+            if token[0] == 'text':
+                for char in token[1]:
+                    rows, cols = max(rows, self.x), max(cols, self.y)
+                    self.inc_y()
+            elif token[0] == 'newline':
+                self.inc_x()
+                self.reset_y()
+            elif token[2] in 'ABCDEFGRH':
+                self.move_cursor(token[1], token[2])
+            elif token[2] == 'J' and token[1][1:] == '2':
+                self.x, self.y = 1, 1
+        self.width, self.height = 80, 24
+        return rows, cols
+
+    def erase_cells(self, etype, mode, screen, top, left):
+        # The screen addresses ESC[<mode>J or ESC[<mode>K clears on a screen
+        # showing the art from row top, column left with the cursor at
+        # self.x, self.y of the art
+        row, col = self.x - top, self.y - left
+        if mode in ('', '0'):
+            cols = range(max(col, 0), screen.cols)
+            rows = range(max(row + 1, 0), screen.rows)
+        elif mode == '1':
+            cols = range(0, min(col + 1, screen.cols))
+            rows = range(0, min(row, screen.rows))
+        else:
+            cols = range(screen.cols)
+            rows = range(screen.rows)
+        cells = []
+        if etype == 'J':
+            cells = [r * screen.cols + c for r in rows if r != row for c in range(screen.cols)]
+        if 0 <= row < screen.rows:
+            cells += [row * screen.cols + c for c in cols]
+        return cells
+
+    def reserved_cells(self):
+        # Addresses the target writes its own fields to after the art: the
+        # SF at (24,80) and the input field with its attribute bytes. Returns
+        # them and the address of the protected field closing the input field.
+        reserved = set()
+        closing = None
+        if self.jcl in ('tso', 'netsol', 'sysgen'):
+            reserved.add(1919)
+        if self.jcl != 'tso':
+            row, col = map(int, self.cursor['loc'])
+            start = (row - 1) * 80 + col - 1
+            closing = (start + int(self.cursor['spaces']) + 1) % 1920
+            reserved.update(address % 1920 for address in range(start, start + int(self.cursor['spaces']) + 2))
+        if self.jcl == 'usstable' and self.write_messages:
+            # The other messages write over the rest of the message row
+            start = self.message_address()
+            reserved.update(range(start, start - start % 80 + 80))
+        return reserved, closing
+
+    def choose_colors(self, tokens=None, lower=None):
+        # Picks the smallest data stream from the SA orders the state machine
+        # generated and the ones screen_orders builds from the finished screen.
+        # The state machine's own output wraps and draws over itself so it
+        # only counts when the art fits the viewport. tokens is the ANSi
+        # already tokenized, it's tokenized again when not given. lower turns
+        # the orders in to HLASM, self.lower() when not given.
+        candidates = []
+        if self.color_method != 'sfe':
+            candidates.append(('SA', self.orders))
+        if tokens is None:
+            self.reset_parser()
+            tokens = self.tokenize(self.ansi)
+        screen = self.ansi_screen(tokens)
+        if (self.clipped or self.shrink or self.image is not None or self.imported is not None or
+                self.viewport != (1, 1) or self.canvas[0] != 80):
+            logger.debug("Art doesn't fit the viewport, drawing the screen instead")
+            candidates = []
+        if self.jcl == 'usstable' and self.write_messages:
+            logger.debug("Leaving the message row empty, drawing the screen instead")
+            candidates = []
+        self.orders = self.screen_orders(screen, candidates)
+        self.hlasm = (lower or self.lower)(self.orders)
+
+    def fit_budget(self):
+        # When the data stream is bigger than self.max_bytes, redraws the
+        # screen with budget_reductions applied one after the other until
+        # it fits, then crops rows off the bottom down to a single row. The
+        # input field and cursor are never cropped and count towards the
+        # budget. self.fits says if it ended up fitting.
+        self.reductions = []
+        self.fits = True
+        if not self.max_bytes:
+            return
+        size = len(self.data_stream())
+        self.fits = size <= self.max_bytes
+        if self.fits:
+            return
+        self.reset_parser()
+        screen = self.ansi_screen(self.tokenize(self.ansi))
+
+        def redraw(screen):
+            self.orders = self.screen_orders(screen)
+            self.hlasm = self.lower(self.orders)
+            return len(self.data_stream())
+
+        for reduction in budget_reductions:
+            changed = reduction(*screen)
+            if not changed:
+                continue
+            reduced = redraw(screen)
+            self.reductions.append("{} ({} to {} bytes)".format(changed, size, reduced))
+            size = reduced
+            if size <= self.max_bytes:
+                self.fits = True
+                return
+
+        # Keep as many rows from the top as fit, a screen without any art
+        # doesn't count as fitting
+        written = screen[1]
+        low, high = 1, 23
+        while low < high:
+            rows = (low + high + 1) // 2
+            if redraw((screen[0], {address for address in written if address < rows * 80}, screen[2])) <= self.max_bytes:
+                low = rows
+            else:
+                high = rows - 1
+        reduced = redraw((screen[0], {address for address in written if address < low * 80}, screen[2]))
+        self.reductions.append("cropped the screen to {} rows ({} to {} bytes)".format(low, size, reduced))
+        self.fits = reduced <= self.max_bytes
+
+    def screen_orders(self, screen, candidates=()):
+        # The smallest of candidates ((name, orders) pairs), the screen drawn
+        # with SA orders and the screen drawn with SFE fields (or only the SA
+        # or SFE ones when asked to), optimized
+        candidates = list(candidates)
+        if self.color_method != 'sfe' or not candidates:
+            if np is not None:
+                candidates.append(('SA screen', self.sa_runs(*screen)))
+            else:
+                candidates.append(('SA screen', self.field_colors(*screen, fields=False)))
+        if self.color_method != 'sa':
+            fields = self.field_colors(*screen)
+            if fields is None:
+                logger.debug("SFE fields can't reproduce this screen, using SA")
+            elif self.color_method == 'sfe':
+                candidates = [('SFE', fields)]
+            else:
+                candidates.append(('SFE', fields))
+        candidates = [(name, optimize(orders)) for name, orders in candidates]
+        costs = [len(bytes_backend(orders)) for name, orders in candidates]
+        logger.debug(", ".join("{}: {} bytes".format(name, cost) for (name, orders), cost in zip(candidates, costs)))
+        return candidates[costs.index(min(costs))][1]
+
+    def lower(self, orders):
+        # orders as HLASM for the target, TK4- macros or z/OS DC statements,
+        # or packed DC statements for --dense
+        if self.dense:
+            return dense_backend(orders, dense_continuations[self.tk4])
+        return tk4_backend(orders) if self.tk4 else zos_backend(orders)
+
+    def paged_hlasm(self):
+        # The pages of the paged TSO program followed by their page table,
+        # each page is only drawn and its HLASM generated when it is asked for
+        self.reset_parser()
+        pages = 0
+        for pages, screen in enumerate(self.ansi_pages(self.tokenize(self.ansi), step=24 - self.overlap), 1):
+            yield tso_page.format(page=pages, hlasm=self.lower(self.screen_orders(screen)).rstrip())
+        logger.debug("{} pages of {} rows".format(pages, 24 - self.overlap))
+        yield "PAGES    DS    0F\n"
+        for number in range(1, pages + 1):
+            yield "         DC    A(P{0:04d},L{0:04d})\n".format(number)
+        yield "         DC    F'0'\n"
+
+    def field_colors(self, screen, written, text, fields=True):
+        # Draws the screen cell by cell. The SFE strategy: a protected field
+        # carrying the foreground color goes on the empty cell in front of
+        # every color change, SA orders handle backgrounds, highlighting and
+        # color changes without an empty cell in front of them. Without
+        # fields everything is done with SA orders. Returns the orders, or
+        # None if the fields would leak on to the start of the screen.
+        reserved, closing = self.reserved_cells()
+        drawn = [address for address in sorted(written) if address not in reserved and
+                 (text[address] != (' ', False) or blank_visible(screen.bg[address], screen.hl[address]))]
+        on_screen = set(drawn)
+
+        def empty(address):
+            return address not in reserved and address not in on_screen
+
+        protected = field_attributes['SKIP'] | field_attributes['HI']
+
+        self.orders = []
+        field = 0
+        field_address = None
+        sa = [0, 0, 0]
+        address = 0
+        run = ['', False]
+
+        def flush():
+            if run[0]:
+                if run[1]:
+                    self.print_graphic(run[0])
+                else:
+                    self.print_ascii(run[0])
+            run[0] = ''
+
+        for cell in drawn:
+            if closing is not None and address <= closing < cell and (field_address is None or field_address < closing):
+                # The input field's closing SF takes over from here
+                field = 0
+            fg, bg, hl = screen.fg[cell], screen.bg[cell], screen.hl[cell]
+            change = (fg or 0xF7) != (sa[0] or field or 0xF7)
+            new_field = fields and change and cell > 0 and empty(cell - 1)
+            target = cell - 1 if new_field else cell
+
+            if address != target:
+                if 0 < target - address <= 3 and not blank_visible(sa[1], sa[2]):
+                    if run[1]:
+                        flush()
+                    run[1] = False
+                    run[0] += ' ' * (target - address)
+                else:
+                    flush()
+                    self.add_sba(target // 80 + 1, target % 80 + 1)
+                address = target
+
+            orders = []
+            if new_field:
+                flush()
+                self.add_orders(Order('SFE', data=((0xC0, protected), (0x42, fg)) if fg else ((0xC0, protected),),
+                                      comment=position_comment(target, [Order('SA', type=0x42, value=fg)], 'Field')))
+                field = fg
+                field_address = target
+                address += 1
+                if sa[0]:
+                    orders.append(Order('SA', type=0x42, value=0x00))
+                    sa[0] = 0
+            elif change:
+                sa[0] = 0 if (field or 0xF7) == (fg or 0xF7) else (fg or 0xF7)
+                orders.append(Order('SA', type=0x42, value=sa[0]))
+            if bg != sa[1]:
+                orders.append(Order('SA', type=0x45, value=bg))
+                sa[1] = bg
+            if hl != sa[2]:
+                orders.append(Order('SA', type=0x41, value=hl))
+                sa[2] = hl
+            if orders:
+                flush()
+                orders[0].comment = position_comment(cell, orders)
+                self.add_orders(*orders)
+
+            char, graphic = text[cell]
+            if graphic != run[1]:
+                flush()
+                run[1] = graphic
+            run[0] += char
+            address += 1
+        flush()
+
+        if self.jcl == 'usstable' and field and (closing is None or field_address > closing):
+            # Nothing after the last field resets the color before the
+            # screen wraps around, put a default field in the first free cell
+            first = drawn[0] if drawn else 0
+            free = [cell for cell in list(range(address, 1920)) + list(range(0, first)) if empty(cell)]
+            if not free:
+                return None
+            self.add_sba(free[0] // 80 + 1, free[0] % 80 + 1)
+            self.add_orders(Order('SFE', data=((0xC0, protected),)))
+        return self.orders
+
+    def sa_runs(self, screen, written, text):
+        # field_colors(fields=False) for the whole screen at once with NumPy.
+        # The cells that need an SBA, blank padding, SA orders or a switch
+        # between GE and plain text are found with array comparisons against
+        # the cell before them, only those cells are visited and the text in
+        # between is copied over as runs. Gives the same orders, without the
+        # per order debug logging.
+        reserved, closing = self.reserved_cells()
+        cells = sorted(written - reserved)
+        drawn = np.array([text[cell] != (' ', False) for cell in cells], bool)
+        fg, bg, hl = (np.frombuffer(attribute, np.uint8)[np.array(cells, np.int64)] for attribute in (screen.fg, screen.bg, screen.hl))
+        visible = ~np.isin(bg, (0x00, 0xF0, 0xF8)) | np.isin(hl, (0xF2, 0xF4))
+        drawn |= visible
+        cells = np.array(cells, np.int64)[drawn]
+        fg, bg, hl, visible = fg[drawn], bg[drawn], hl[drawn], visible[drawn]
+        chars = [text[cell][0] for cell in cells.tolist()]
+        graphic = np.array([text[cell][1] for cell in cells.tolist()], bool)
+
+        def previous(values):
+            # values shifted one cell on, starting from the defaults
+            return np.concatenate((np.zeros(1, values.dtype), values[:-1]))
+
+        ink = np.where(np.isin(fg, (0x00, 0xF7)), 0, fg)
+        gap = cells - np.concatenate(([0], cells[:-1] + 1))
+        pad = (gap > 0) & (gap <= 3) & ~previous(visible)
+        moved = (gap > 0) & ~pad
+        changes = [(0x42, ink, ink != previous(ink)), (0x45, bg, bg != previous(bg)), (0x41, hl, hl != previous(hl))]
+        switch = graphic != previous(graphic)
+        events = np.flatnonzero(moved | pad | switch | changes[0][2] | changes[1][2] | changes[2][2])
+
+        cells, gap, pad, moved, graphic = cells.tolist(), gap.tolist(), pad.tolist(), moved.tolist(), graphic.tolist()
+        changes = [(kind, values.tolist(), changed.tolist()) for kind, values, changed in changes]
+        orders = []
+        run = ['', False]
+
+        def flush():
+            if run[0]:
+                if run[1]:
+                    orders.append(Order('GE', data=graphic_segment(run[0], self.codec.name, self.codec.codepage)))
+                else:
+                    orders.append(Order('TEXT', data=run[0]))
+            run[0] = ''
+
+        start = 0
+        for index in events.tolist():
+            run[0] += ''.join(chars[start:index])
+            cell = cells[index]
+            if moved[index]:
+                flush()
+                orders.append(Order('SBA', address=cell))
+            elif pad[index]:
+                if run[1]:
+                    flush()
+                run[1] = False
+                run[0] += ' ' * gap[index]
+            colors = [Order('SA', type=kind, value=values[index]) for kind, values, changed in changes if changed[index]]
+            if colors:
+                flush()
+                colors[0].comment = position_comment(cell, colors)
+                orders.extend(colors)
+            if graphic[index] != run[1]:
+                flush()
+                run[1] = graphic[index]
+            run[0] += chars[index]
+            start = index + 1
+        run[0] += ''.join(chars[start:])
+        flush()
+        logger.debug("{} cells drawn with {} orders from {} changes".format(len(cells), len(orders), len(events)))
+        self.orders = orders
+        return orders
+
+    def verify(self):
+        # Converts the ANSi, plays the generated data stream on an emulated
+        # 3270 and compares it with the screen the ANSi describes. Returns the
+        # emulated screen and the cells that differ as
+        # (row, column, expected, got) with cells from Screen3270.looks()
+        self.reset_parser()
+        expected, written, text = self.ansi_screen(self.tokenize(self.ansi))
+        self.convert()
+        screen = Screen3270(codepage=self.codepage)
+        screen.write(self.data_stream())
+
+        # Field attributes and the input field cover the art on purpose
+        reserved = self.reserved_cells()[0] | set(screen.fields)
+        expected_looks, looks = expected.looks(), screen.looks()
+
+        differences = []
+        for address in sorted(written - reserved):
+            if expected_looks[address] != looks[address]:
+                differences.append((address // screen.cols + 1, address % screen.cols + 1,
+                                    expected_looks[address], looks[address]))
+        return screen, differences
+
+    def byte_costs(self):
+        # Converts the ANSi once and plays the data stream on an emulated
+        # 3270. Returns the screen, the (address, cause, bytes) costs of the
+        # art's orders and the input field's (cause cursor) from the pass
+        # that lowers them to bytes, and the bytes the target's own part of
+        # the data stream takes (command, WCC and the NETSOL/TSO frame)
+        self.convert()
+        stream = self.data_stream()
+        screen = Screen3270(codepage=self.codepage)
+        screen.write(stream)
+        costs, cursor = [], []
+        bytes_backend(self.orders, self.codepage, costs)
+        bytes_backend(self.cursor_orders, self.codepage, cursor)
+        costs += [(address, 'cursor', size) for address, cause, size in cursor]
+        return screen, costs, len(stream) - sum(size for address, cause, size in costs)
+
+    def generate_output(self):
+
+        self.SAUCE_info()
+        self.command_args_info()
+        if self.object:
+            # Only the program (or VTAM table) is assembled, the art goes
+            # straight to the linkage editor as an object deck
+            marker = '*DECK*\n'
+            if self.jcl == 'tso':
+                deck = self.pages_deck()
+                jcl = self.jcl_output(tso=tso_pages_hlasm.format(pages="         EXTRN PAGES\n"),
+                                      deck=marker if self.tk4 else "//L.SYSIN DD *\n{}/*\n".format(marker))
+            else:
+                name, data, labels, relocations = self.object_data()
+                deck = [object_deck(name, data, labels, relocations, self.codepage)]
+                if self.jcl == 'sysgen':
+                    jcl = self.jcl_output(screen=sysgen_screen_object.format(length=len(data)),
+                                          deck="//         DD  *\n{}/*\n".format(marker))
+                else:
+                    jcl = self.jcl_output(screen=uss_screen_object, deck=marker)
+            head, tail = jcl.split(marker)
+            output = chain([head], deck, [tail])
+        elif self.jcl == 'tso' and self.paged:
+            # Write the pages out as they are generated
+            marker = '*PAGES*'
+            head, tail = self.jcl_output(tso_pages_hlasm.format(pages=marker)).split(marker)
+            output = chain([head], self.paged_hlasm(), [tail])
+        elif self.variants:
+            segments, hlasm = self.variant_hlasm()
+            builds = ''.join(uss_variant_build.format(step='BUILD' + (str(number) if number > 1 else ''),
+                                                      name=name, member=member, dataset=self.dataset)
+                             for number, (name, member) in enumerate(zip(self.variant_names(), self.variant_members()), 1))
+            output = self.jcl_output(screen=uss_screen.format(hlasm=hlasm, cursor=self.cursor_hlasm),
+                                     segments=segments, builds=builds)
+        else:
+            self.convert()
+            output = self.jcl_output()
+
+        if self.max_bytes:
+            for reduction in self.reductions:
+                print("[!] Over --max-bytes {}: {}".format(self.max_bytes, reduction))
+            if not self.fits:
+                print("[!] The screen doesn't fit in {} bytes even cropped to one row, nothing written".format(self.max_bytes))
+                return
+            print("[+] Data stream: {} of {} bytes".format(len(self.data_stream()), self.max_bytes))
+
+        if self.imported is not None:
+            print("[+] Imported screen: {} bytes, now {} bytes".format(self.imported[1], len(self.data_stream())))
+
+        if self.jcl == 'usstable' and self.write_messages:
+            print("[+] USS messages: {} bytes each, MSG 10 with the art: {} bytes".format(
+                  len(self.message_stream()), len(self.data_stream())))
+
+        if not self.filename:
+            print("\n[+] Printing JCL + HLASM")
+            print("\n---------------------------- ><8 CUT AFTER HERE 8>< ----------------------------\n")
+            print(''.join(output))
+        else:
+            print("\n[+] Saving JCL + HLASM to {}".format(self.filename))
+            self.write_output(output)
+
+        report = self.parse_report()
+        if report:
+            print("[!] {}".format(report))
+        logger.debug(segment_cache_report())
+
+    def pages_deck(self):
+        # The TSO program's pages as object decks: a PAGEDATA section holding
+        # the pages, each an Escape, Erase/Write and the data stream, whose
+        # TXT cards are written out as each page is drawn, then a PAGES
+        # section with the page table pointing in to it. Without --pages
+        # there's a single page.
+        if self.paged:
+            self.reset_parser()
+            screens = self.ansi_pages(self.tokenize(self.ansi), step=24 - self.overlap)
+            pages = (bytes.fromhex('27F5C3') + bytes_backend(self.screen_orders(screen), self.codepage) +
+                     bytes.fromhex('115D7F1DF8') for screen in screens)
+        else:
+            self.convert()
+            pages = [b'\x27' + self.data_stream()]
+        lengths = []
+
+        def measured():
+            for page in pages:
+                lengths.append(len(page))
+                yield page
+
+        def table():
+            data = bytearray()
+            offset = 0
+            for length in lengths:
+                data += offset.to_bytes(4, 'big') + length.to_bytes(4, 'big')
+                offset += length
+            data += bytes(4)
+            yield object_deck('PAGES', bytes(data), (), [8 * number for number in range(len(lengths))],
+                              self.codepage, external='PAGEDATA')
+
+        return chain(object_stream('PAGEDATA', measured(), self.codepage), table())
+
+    def object_data(self):
+        # The object deck for the USS table or the sysgen screen as (section
+        # name, data, label definitions, offsets of address constants in to
+        # the section)
+        self.convert()
         if self.jcl == 'sysgen':
-            self.generate_cursor()
+            # The stream starts with the WCC, VTAM sends the command
+            return 'EGMSG', self.data_stream()[1:], (), ()
+        # Every SCREEN message shows the same art, or only MSG 10 with
+        # --write-messages
+        stream = self.data_stream()
+        messages = ['10'] if self.write_messages else re.findall(r"^ +SCREEN MSG=(\d+)", usstable_jcl, re.M)
+        return 'USSART', len(stream).to_bytes(2, 'big') + stream, [('BUF' + msg, 0) for msg in messages], ()
+
+    def jcl_output(self, tso=None, screen=None, deck='', segments='', builds=''):
+        # tso is the TSO program to use instead of tso_hlasm, screen the
+        # NETSOL copybook or USS message instead of the one holding the
+        # HLASM and deck what goes in to the linkage editor's input. The USS
+        # table's source starts with segments, with builds (--variants) it's
+        # assembled by those steps instead of the one in usstable_jcl.
+
+        if self.jcl == 'sysgen':
+            if screen is None:
+                screen = sysgen_screen.format(hlasm=self.hlasm.rstrip(), cursor=self.cursor_hlasm)
             output = sysgen_jcl.format(user_job=self.jobname,
                                        logofile=self.member,
                                        date=datetime.today().strftime('%d-%m-%Y'),
                                        ansi_info=self.ansi_info,
                                        comd_args=self.command_args,
-                                       hlasm = self.hlasm.rstrip(),
-                                       cursor = self.cursor_hlasm)
+                                       screen = screen,
+                                       deck = deck)
         if self.jcl == 'netsol':
-            self.generate_cursor()
             output = netsol_jcl.format(user_job=self.jobname,
                                        logofile=self.member,
                                        date=datetime.today().strftime('%d-%m-%Y'),
                                        ansi_info=self.ansi_info,
                                        comd_args=self.command_args,
                                        hlasm = self.hlasm.rstrip(),
-                                       cursor = self.cursor_hlasm)
+                                       cursor = self.cursor_hlasm,
+                                       deck = deck)
         if self.jcl == 'usstable':
-            self.generate_cursor()
-            output = usstable_jcl.format(user_job=self.jobname,
+            if screen is None:
+                screen = uss_screen.format(hlasm=self.hlasm.rstrip(), cursor=self.cursor_hlasm)
+            if self.write_messages:
+                before, length, after = self.message_orders()
+                screen = uss_write_screen.format(art=screen, message=self.lower(before).rstrip(),
+                                                 length=length, field=self.lower(after).rstrip())
+            output = (uss_variants_jcl if builds else usstable_jcl).format(user_job=self.jobname,
                                        dataset=self.dataset,
                                        logofile=self.member,
                                        date=datetime.today().strftime('%d-%m-%Y'),
                                        ansi_info=self.ansi_info,
                                        comd_args=self.command_args,
-                                       hlasm = self.hlasm.rstrip(),
-                                       cursor = self.cursor_hlasm)
+                                       screen = screen,
+                                       segments = segments,
+                                       builds = builds,
+                                       deck = deck)
 
         if self.jcl == 'tso':
-            tso = tso_hlasm.format(hlasm=self.hlasm.rstrip())
+            if tso is None:
+                tso = tso_hlasm.format(hlasm=self.hlasm.rstrip())
             if self.tk4:
                 output = tk4_tso_jcl.format(user_job=self.jobname,
                                      dataset=self.dataset,
@@ -1147,7 +3404,8 @@ class ANSITN3270:
                                      date=datetime.today().strftime('%d-%m-%Y'),
                                      ansi_info=self.ansi_info,
                                      comd_args=self.command_args,
-                                     tso_hlasm=tso)
+                                     tso_hlasm=tso,
+                                     deck=deck)
             else:
                 output = zos_tso_jcl.format(user_job=self.jobname,
                                      dataset=self.dataset,
@@ -1155,41 +3413,96 @@ class ANSITN3270:
                                      date=datetime.today().strftime('%d-%m-%Y'),
                                      ansi_info=self.ansi_info,
                                      comd_args=self.command_args,
-                                     tso_hlasm=tso)
-
-
-        if not self.filename:
-            print("\n[+] Printing JCL + HLASM")
-            print("\n---------------------------- ><8 CUT AFTER HERE 8>< ----------------------------\n")
-            print(output)
-        else:
-            print("\n[+] Saving JCL + HLASM to {}".format(self.filename))
-            outfile = open(self.filename, 'w')
-            outfile.write(output)
-            outfile.close()
+                                     tso_hlasm=tso,
+                                     deck=deck)
+        return output
+
+    def variant_names(self):
+        # The SYSPARM name of each --variants file, its file name or VARn
+        names = []
+        for number, path in enumerate(self.variants, 1):
+            name = re.sub('[^A-Z0-9]', '', os.path.splitext(os.path.basename(path))[0].upper())[:8]
+            if not name[:1].isalpha() or name in names:
+                name = 'VAR{}'.format(number)
+            names.append(name)
+        return names
+
+    def variant_members(self):
+        # The member each --variants table is linked in to: --member for
+        # the input file, the SYSPARM name for the others (VARn when that's
+        # --member)
+        return [self.member] + [name if name != self.member else 'VAR{}'.format(number)
+                                for number, name in enumerate(self.variant_names()[1:], 2)]
+
+    def variant_hlasm(self):
+        # --variants: the segment macros the variants share and the HLASM
+        # that picks a variant's art by SYSPARM. A USS message has to be one
+        # run of bytes so a table only holds the art of the variant it's
+        # assembled with: one source, one member per variant. The rows the
+        # variants have in common are written in the source once as macros,
+        # each assembly still expands the ones its variant calls. Converts
+        # the input file last so it's the one reported on.
+        names = self.variant_names()
+        members = dict(zip(names, self.variant_members()))
+        arts = []
+        for name, path in zip(names[1:] + names[:1], self.variants[1:] + self.variants[:1]):
+            self.read_ansi(path)
+            self.convert()
+            arts.append([self.lower(segment) for segment in row_segments(self.orders)])
+            print("[+] Variant {}: {} bytes, member {}".format(name, len(self.data_stream()), members[name]))
+        arts.insert(0, arts.pop())
+
+        # Rows drawn the same way in more than one variant, in the order
+        # they're first drawn
+        counts = {}
+        for segments in arts:
+            for segment in dict.fromkeys(segments):
+                counts[segment] = counts.get(segment, 0) + 1
+        shared = [segment for segment, count in counts.items() if count > 1 and segment.count('\n') > 1]
+        macros = {segment: 'SEG{:04d}'.format(number) for number, segment in enumerate(shared, 1)}
+        lines = sum(segment.count('\n') for segments in arts for segment in segments)
+
+        arts = [''.join("         {}\n".format(macros[segment]) if segment in macros else segment for segment in segments)
+                for segments in arts]
+        hlasm = ''.join(uss_variant_pick.format(name=name, number=number) for number, name in enumerate(names[1:], 2))
+        hlasm += arts[0] + ''.join(uss_variant.format(number=number, hlasm=art.rstrip())
+                                   for number, art in enumerate(arts[1:], 2))
+        hlasm += '.VAREND  ANOP'
+        segments = "*  VARIANTS: {}, THE FIRST FOR ANY OTHER SYSPARM\n".format(', '.join(names))
+        segments += ''.join(uss_segment.format(name=name, hlasm=segment.rstrip()) for segment, name in macros.items())
+        print("[+] Variants: {} row segments shared, {} HLASM source lines instead of {}".format(
+              len(shared), (segments + hlasm).count('\n') + 1, lines))
+        return segments, hlasm
+
+    def message_address(self):
+        # Where --write-messages puts the message text: the line below the
+        # input field from the same column, or the line above it when the
+        # input field is on the last line. The art leaves the rest of that
+        # line empty (see reserved_cells).
+        row, col = map(int, self.cursor['loc'])
+        return (row if row < 24 else row - 2) * 80 + col - 1
+
+    def message_orders(self):
+        # A --write-messages message as the orders in front of its text, the
+        # length of the text (it's padded or cut to the end of the line)
+        # and the orders after it: the text goes to message_address, then
+        # the input field is set up again
+        address = self.message_address()
+        before = [Order('SBA', address=address, comment='* Message'),
+                  Order('SA', type=0x42, value=0xF7)]
+        return before, 80 - address % 80, [Order('SA', type=0x00, value=0x00)] + self.cursor_orders
+
+    def message_stream(self, text=''):
+        # The Write data stream of a --write-messages message
+        before, length, after = self.message_orders()
+        return (bytes.fromhex('F1C3') + bytes_backend(before, self.codepage) +
+                to_ebcdic(text[:length].ljust(length), self.codepage) + bytes_backend(after, self.codepage))
 
     def generate_cursor(self):
 
-        tk4_cursor_input = '''* Insert Cursor and unprotected field
-         $SBA  ({},{})
-         DC    X'2842{}'  SA COLOR {}
-         $SF   (UNPROT,HI)
-         $IC
-         DC    CL{}' '
-         DC    X'280000'
-         DC    X'1DF8'     SF (PROT,HIGH INTENSITY)'''
-
-        uss_cursor_input = '''* Insert Cursor and unprotected field
-         DC    X'11{}'         SBA({},{})
-         DC    X'2902C0C842{}'         SFE, UNPROTECTED, {}
-         DC    X'13'                   INSERT CURSOR
-         DC    {}C' '
-         DC    X'280000'
-         DC    X'1DF8'     SF (PROT,HIGH INTENSITY)'''
-
         arg_colors ={
-                "WHITE" : 'F7', "RED" : 'F2', "GREEN" : 'F4', "YELLOW" : 'F6',
-                "BLUE" : 'F1', "PINK" : 'F3', "TURQ" : 'F5'
+                "WHITE" : 0xF7, "RED" : 0xF2, "GREEN" : 0xF4, "YELLOW" : 0xF6,
+                "BLUE" : 0xF1, "PINK" : 0xF3, "TURQ" : 0xF5
             }
 
         logger.debug("({},{}) Generating Cursor (IC)".format(self.x, self.y))
@@ -1197,26 +3510,26 @@ class ANSITN3270:
         logger.debug("({},{}) Input Length: {}".format(self.x, self.y, self.cursor['spaces']))
         logger.debug("({},{}) Cursor Color: {}".format(self.x, self.y, self.cursor['color']))
 
-        if self.jcl == 'netsol' or self.jcl == 'sysgen':
-            self.cursor_hlasm = tk4_cursor_input.format(self.cursor['loc'][0],
-                                                       self.cursor['loc'][1],
-                                                       arg_colors[self.cursor['color']],
-                                                       self.cursor['color'],
-                                                       self.cursor['spaces'])
-
+        row, col = map(int, self.cursor['loc'])
+        color = arg_colors[self.cursor['color']]
+        unprotected = field_attributes['UNPROT'] | field_attributes['HI']
+        orders = [Order('SBA', address=(row - 1) * 80 + col - 1, comment='* Insert Cursor and unprotected field')]
         if self.jcl == 'usstable':
-            sba = self.calculate_sba(int(self.cursor['loc'][0]), int(self.cursor['loc'][1]))
-            self.cursor_hlasm = uss_cursor_input.format(sba,
-                                                       self.cursor['loc'][0],
-                                                       self.cursor['loc'][1],
-                                                       arg_colors[self.cursor['color']],
-                                                       self.cursor['color'],
-                                                       self.cursor['spaces'])
+            orders.append(Order('SFE', data=((0xC0, unprotected), (0x42, color))))
+        else:
+            orders += [Order('SA', type=0x42, value=color), Order('SF', value=unprotected)]
+        orders += [Order('IC'),
+                   Order('TEXT', data=' ' * int(self.cursor['spaces'])),
+                   Order('SA', type=0x00, value=0x00),
+                   Order('SF', value=field_attributes['SKIP'] | field_attributes['HI'])]
+        self.cursor_orders = orders
+        self.cursor_hlasm = self.lower(orders).rstrip()
 
         logger.debug("({},{}) cursor hlasm: \n{}".format(self.x, self.y,self.cursor_hlasm))
 
     def command_args_info(self):
             logger.debug("({},{}) Parsing arguments passed to script ".format(self.x, self.y))
+            self.command_args = ""
             line = "//* Command Line Args: "
             for i in sys.argv[1:]:
                 if len(line) + len(i) >= 72:
@@ -1248,309 +3561,380 @@ class ANSITN3270:
         except:
             pass
 
-    def compress(self, string):
-        logger.debug("({},{}) Compressing: {}".format(self.x, self.y, string))
-        groups = groupby(string)
-        result = [(label, sum(1 for _ in group)) for label, group in groups]
-        #logger.debug("({},{}) Results: {}".format(self.x, self.y, result))
-
-        c  = ''
-        r = []
-        for i in result:
-            if i[1] < 5:
-                c += i[0]*i[1]
-            else:
-                if c != '':
-                    r.append((c,1))
-                    c = ''
-                r.append(i)
-        if c != '':
-            r.append((c,1))
-        logger.debug("({},{}) Results: {}".format(self.x, self.y, r))
-        return(r)
-
-    def add_sba(self):
-
-        sba_macro = "         $SBA  ({},{})\n"
-        sba_hex   = "         DC    X'11{}'    SBA({},{})\n"
-        logger.debug("({x},{y}) setting SBA: {x},{y}".format(x=self.x, y=self.y))
-        if self.tk4:
-            hlasm = sba_macro.format(self.x,self.y)
-        else:
-            hlasm = sba_hex.format(self.calculate_sba(self.x, self.y), self.x, self.y)
-
-        if len(self.hlasm.splitlines()) > 1 and hlasm.rstrip() != self.hlasm.splitlines()[-1]:
-            self.add_hlasm(hlasm)
+    def add_sba(self, x=None, y=None):
+        # drop_addresses() leaves out the ones that don't move the buffer address
+        x = x or self.x
+        y = y or self.y
+        logger.debug("({x},{y}) setting SBA: {x},{y}".format(x=x, y=y))
+        self.add_orders(Order('SBA', address=((x - 1) * 80 + y - 1) % 1920))
+        self.moved = False
 
     def parse_escape(self, escape, etype):
         logger.debug("({},{}) type: {} Sequence: {} (desc: {})".format(self.x, self.y, etype, escape[1:], escape_types[etype]))
-        debug_buffer = ''
-        SA_buffer = ''
 
         if etype in ['m']:
             logger.debug("({},{}) Color Escape Sequence".format(self.x, self.y))
 
-            if not self.extended:
-
-                for sequence in escape[1:].split(";"):
-                    debug_buffer += ansi_color_escape_types[sequence] + " "
-                    SA_buffer += color_escape_to_3270[sequence]
-
-            else:
-                logger.debug("({},{}) Current FG: {} Bold: {}".format(self.x, self.y, self.current_fg, self.bold))
-
-                for sequence in escape[1:].split(";"):
-
-                    if sequence == '0':
-                        if self.bold:
-                            self.bold = False
-                            self.current_fg = ansi_color_escape_types["37"]
-                        debug_buffer += ansi_color_escape_types[sequence] + " "
-                        SA_buffer += color_escape_to_3270[sequence]
-                        debug_buffer += ansi_color_escape_types["37"] + " "
-                        SA_buffer += color_escape_to_3270["37"]
-
-                    elif sequence == '1':
-                        # Is this the only entry?
-                        if len(escape[1:].split(";")) == 1:
-                            #We're going bold
-                            logger.debug("({},{}) Switching {} to BOLD".format(self.x, self.y, self.current_fg))
-                            if self.current_fg in color_escape_types.values():
-                                esc_key = (list(color_escape_types.keys())[list(color_escape_types.values()).index(self.current_fg)])
-                                SA_buffer += intense_color_escape[esc_key]
-                        #SA_buffer += color_escape_to_3270[sequence]
-                        debug_buffer += ansi_color_escape_types[sequence] + " "
-                        self.bold = True
-
-                    elif sequence == '2':
-                        # Is this the only entry?
-                        if len(escape[1:].split(";")) == 1:
-                            logger.debug("({},{}) Switching {} to DIM".format(self.x, self.y, self.current_fg))
-                            if self.current_fg in intense_color_escape.values():
-                                esc_key = (list(intense_color_escape.keys())[list(intense_color_escape.values()).index(self.current_fg)])
-                                SA_buffer += color_escape_types[esc_key]
-
-                        #SA_buffer += color_escape_to_3270[sequence]
-                        debug_buffer += ansi_color_escape_types[sequence] + " "
-                        bold = True
-                    elif sequence == '5':
-                        debug_buffer += ansi_color_escape_types[sequence] + " "
-                    else:
-                        if self.bold:
-                            debug_buffer += intense_color_escape_types[sequence] + " "
-                            SA_buffer += intense_color_escape[sequence]
-                            if int(sequence) < 40:
-                                self.current_fg = intense_color_escape_types[sequence]
-                        else:
-                            debug_buffer += color_escape_types[sequence] + " "
-                            SA_buffer += color_escape[sequence]
-                            if int(sequence) < 40:
-                                self.current_fg = color_escape_types[sequence]
-
-
+            debug_buffer, SA_buffer = self.sgr_sa(escape)
+            apply_sa(self.sa, SA_buffer)
 
             logger.debug("({},{}) {} (SA: {})".format(self.x, self.y, debug_buffer, SA_buffer))
 
             self.add_sba()
 
-            self.add_hlasm("* ({},{}) {}\n         DC    X'{}'\n".format(self.x, self.y,debug_buffer,SA_buffer))
+            orders = bytes.fromhex(SA_buffer)
+            self.add_orders(*[Order('SA', type=orders[i + 1], value=orders[i + 2],
+                                    comment=None if i else "* ({},{}) {}".format(self.x, self.y, debug_buffer))
+                              for i in range(0, len(orders) - 2, 3)])
 
             return
 
         if etype in ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'R', 'H']:
-            if escape[1:] and etype != "H":
-                num = int(escape[1:])
-            else:
-                num = 1
-            logger.debug("({},{}) Cursor Escape Sequence: {} ({})".format(self.x, self.y, etype, escape_types[etype]))
-            if etype == "A":
-                self.dec_x(num)
-                logger.debug("({x},{y}) Move cursor up {c}".format(x=self.x, y=self.y, c=num))
-            elif etype == "B":
-                self.inc_x(num)
-                logger.debug("({x},{y}) Move cursor down {c}".format(x=self.x, y=self.y, c=num))
-            elif etype == "C":
-                self.inc_y(num)
-                logger.debug("({x},{y}) Move cursor right {c}".format(x=self.x, y=self.y, c=num))
-            elif etype == "D":
-                self.dec_y(num)
-                logger.debug("({x},{y}) Move cursor left {c}".format(x=self.x, y=self.y, c=num))
-            elif etype == "E":
-                self.reset_y()
-                self.inc_x(num+1)
-                logger.debug("({x},{y}) Move cursor down {c} and left {y}".format(x=self.x, y=self.y, c=num))
-            elif etype == "F":
-                self.reset_y()
-                self.dec_x(num-1)
-                logger.debug("({x},{y}) Move cursor up {c} and left {y}".format(x=self.x, y=self.y, c=num))
-            elif etype == "G":
-                self.y = num
-                logger.debug("({x},{y}) Move cursor to column {c}".format(x=self.x, y=self.y, c=num))
-            elif etype == "R" or etype == "H":
-                new_x, new_y = list(map(int, escape[1:].split(";")))
-                logger.debug("({x},{y}) Move cursor to new {new_x},{new_y}".format(x=self.x, y=self.y, new_x=new_x,new_y=new_y))
-                self.x = new_x
-                self.y = new_y
+            self.move_cursor(escape, etype)
 
             logger.debug("({x},{y}) Cursor moved to {x},{y}, adding new SBA".format(x=self.x, y=self.y))
             self.add_sba()
+
+        if etype in ['J', 'K']:
+            self.erase(escape, etype)
         return
 
-    def print_graphic(self, ascii_string, sba=False):
-        dc_x = "         DC    X'{}'\n"
-        dc_x_num = "         DC    {}X'{}'\n"
-        hlasm = ''
-        if len(ascii_string) >= 1:
-            logger.debug("({},{}) converting: {} length: {}".format(self.x, self.y, ascii_string, len(ascii_string)))
-            compressed = self.compress(ascii_string)
-            #self.calculate_buffer_address(len(ascii_string))
-            g_buffer = ''
-            for graphics in compressed:
-                l = graphics[1]
-                graphic = graphics[0]
-                for g in graphic:
-
-                    if g in cp437_to_ebcdic:
-                        g_buffer += cp437_to_ebcdic[g]
-                    else:
-                        g_buffer += cp437_to_ebcdic[ord(g)]
-
-                    if len(g_buffer) > max_len:
-                        if l >= 5:
-                            hlasm += dc_x_num.format(l,g_buffer)
-                        else:
-                            hlasm += dc_x.format(g_buffer)
-                        g_buffer = ''
-
-                if g_buffer != '':
-                    if l >= 5:
-                        hlasm += dc_x_num.format(l,g_buffer)
-                    else:
-                        hlasm += dc_x.format(g_buffer)
-                    g_buffer = ''
+    def erase(self, escape, etype):
+        # Clears with a single RA order, skipping the cells that are
+        # empty already. ESC[2J also homes the cursor like ANSI.SYS does.
+        first, last = erase_range(self.x, self.y, etype, escape[1:])
+        visible = blank_visible(*self.sa[1:])
+        if not visible:
+            while first <= last and self.blank[first]:
+                first += 1
+            while last >= first and self.blank[last]:
+                last -= 1
+
+        if first <= last:
+            stop = (last + 1) % len(self.blank)
+            logger.debug("({},{}) Clearing {} to {}".format(self.x, self.y, first, last))
+            self.add_sba(first // 80 + 1, first % 80 + 1)
+            self.add_orders(Order('RA', address=stop, data=b'\x40'))
+            self.blank[first:last + 1] = bytes([not visible]) * (last + 1 - first)
+            self.moved = True
+
+        if etype == 'J' and escape[1:] == '2':
+            self.x, self.y = 1, 1
+            self.moved = True
+
+    def sgr_sa(self, escape):
+        # Translates a color escape sequence in to 3270 SA orders, returns
+        # the description and the SA orders as hex
+        debug_buffer = ''
+        SA_buffer = ''
 
-            self.add_hlasm(hlasm)
-            # loop through the string and convert it to graphical hex
-        return
+        codes = self.sgr_codes(escape[1:])
 
-    def print_ascii(self, ascii_string, sba=False):
-        dc_c = "         DC    C'{}'\n"
-        dc_c_num = "         DC    {}C'{}'\n"
-        if len(ascii_string) >= 1:
-            hlasm = ''
-            if sba:
-                buffer_address = self.calculate_buffer_address(len(ascii_string))
+        if not self.extended:
 
-            logger.debug("({},{}) printing ascii: \"{}\"".format(self.x, self.y,ascii_string))
-            #Can we compress it?
+            for sequence in codes:
+                debug_buffer += ansi_color_escape_types[sequence] + " "
+                SA_buffer += color_escape_to_3270[sequence]
 
-            compressed = self.compress(ascii_string)
-            logger.debug("({},{}) received compressed ascii: {}".format(self.x, self.y,compressed))
+        else:
+            logger.debug("({},{}) Current FG: {} Bold: {}".format(self.x, self.y, self.current_fg, self.bold))
+
+            for sequence in codes:
+
+                if sequence == '0':
+                    if self.bold:
+                        self.bold = False
+                        self.current_fg = ansi_color_escape_types["37"]
+                    debug_buffer += ansi_color_escape_types[sequence] + " "
+                    SA_buffer += color_escape_to_3270[sequence]
+                    debug_buffer += ansi_color_escape_types["37"] + " "
+                    SA_buffer += color_escape_to_3270["37"]
+
+                elif sequence == '1':
+                    # Is this the only entry?
+                    if len(codes) == 1:
+                        #We're going bold
+                        logger.debug("({},{}) Switching {} to BOLD".format(self.x, self.y, self.current_fg))
+                        if self.current_fg in color_escape_types.values():
+                            esc_key = (list(color_escape_types.keys())[list(color_escape_types.values()).index(self.current_fg)])
+                            SA_buffer += intense_color_escape[esc_key]
+                    #SA_buffer += color_escape_to_3270[sequence]
+                    debug_buffer += ansi_color_escape_types[sequence] + " "
+                    self.bold = True
 
-            for cstring in compressed:
-                l = cstring[1]
-                string = wrap(cstring[0], max_len, drop_whitespace=False)
+                elif sequence == '2':
+                    # Is this the only entry?
+                    if len(codes) == 1:
+                        logger.debug("({},{}) Switching {} to DIM".format(self.x, self.y, self.current_fg))
+                        if self.current_fg in intense_color_escape.values():
+                            esc_key = (list(intense_color_escape.keys())[list(intense_color_escape.values()).index(self.current_fg)])
+                            SA_buffer += color_escape_types[esc_key]
 
-                if l >= 5:
-                    for s in string:
-                        hlasm += dc_c_num.format(l,s)
+                    #SA_buffer += color_escape_to_3270[sequence]
+                    debug_buffer += ansi_color_escape_types[sequence] + " "
+                    bold = True
+                elif sequence == '5':
+                    debug_buffer += ansi_color_escape_types[sequence] + " "
                 else:
-                    for s in string:
-                        hlasm += dc_c.format(s)
+                    if self.bold:
+                        debug_buffer += intense_color_escape_types[sequence] + " "
+                        SA_buffer += intense_color_escape[sequence]
+                        if int(sequence) < 40:
+                            self.current_fg = intense_color_escape_types[sequence]
+                    else:
+                        debug_buffer += color_escape_types[sequence] + " "
+                        SA_buffer += color_escape[sequence]
+                        if int(sequence) < 40:
+                            self.current_fg = color_escape_types[sequence]
+
+        return debug_buffer, SA_buffer
+
+    def sgr_codes(self, params):
+        # The SGR codes in params sgr_sa knows, an empty one meaning 0. The
+        # rest, 38/48 (256 and RGB colors) with their parameters included,
+        # are left out and counted in self.parse_stats.
+        known = set(color_escape_to_3270) if not self.extended else set(color_escape) | {'0', '1', '2', '5'}
+        params = params.split(';')
+        codes = []
+        i = 0
+        while i < len(params):
+            code = params[i] or '0'
+            i += 1
+            if code in known:
+                codes.append(code)
+                continue
+            if code in ('38', '48') and i < len(params):
+                i += {'5': 2, '2': 4}.get(params[i], 0)
+                self.parse_stats['rgb'] += 1
+            self.parse_stats['unknown'] += 1
+        return codes
+
+    def move_cursor(self, escape, etype):
+        # Missing and 0 parameters mean 1
+        params = [int(param) if param else 0 for param in escape[1:].split(';')]
+        num = params[0] or 1
+        logger.debug("({},{}) Cursor Escape Sequence: {} ({})".format(self.x, self.y, etype, escape_types[etype]))
+        if etype == "A":
+            self.dec_x(num)
+            logger.debug("({x},{y}) Move cursor up {c}".format(x=self.x, y=self.y, c=num))
+        elif etype == "B":
+            self.inc_x(num)
+            logger.debug("({x},{y}) Move cursor down {c}".format(x=self.x, y=self.y, c=num))
+        elif etype == "C":
+            self.inc_y(num)
+            logger.debug("({x},{y}) Move cursor right {c}".format(x=self.x, y=self.y, c=num))
+        elif etype == "D":
+            self.dec_y(num)
+            logger.debug("({x},{y}) Move cursor left {c}".format(x=self.x, y=self.y, c=num))
+        elif etype == "E":
+            self.reset_y()
+            self.inc_x(num+1)
+            logger.debug("({x},{y}) Move cursor down {c} and left {y}".format(x=self.x, y=self.y, c=num))
+        elif etype == "F":
+            self.reset_y()
+            self.dec_x(num-1)
+            logger.debug("({x},{y}) Move cursor up {c} and left {y}".format(x=self.x, y=self.y, c=num))
+        elif etype == "G":
+            self.y = num
+            logger.debug("({x},{y}) Move cursor to column {c}".format(x=self.x, y=self.y, c=num))
+        elif etype == "R" or etype == "H":
+            new_x, new_y = num, (params[1] if len(params) > 1 else 0) or 1
+            logger.debug("({x},{y}) Move cursor to new {new_x},{new_y}".format(x=self.x, y=self.y, new_x=new_x,new_y=new_y))
+            self.x = new_x
+            self.y = new_y
+
+    def print_text(self, text, graphic, followed=False):
+        # Moves the cursor over text and prints it, leaving out runs of
+        # spaces that land on empty cells whenever skipping them with an SBA
+        # is cheaper than sending them
+        visible = blank_visible(*self.sa[1:])
+        segments = []
+        for char in text:
+            address = ((self.x - 1) * 80 + self.y - 1) % len(self.blank)
+            skip = char == ' ' and not visible and bool(self.blank[address])
+            if not segments or segments[-1][1] != skip:
+                segments.append(['', skip, self.x, self.y])
+            segments[-1][0] += char
+            self.blank[address] = char == ' ' and not visible
+            self.inc_y()
+
+        # Short runs in the middle of text stay, they're cheaper than an SBA
+        printed = []
+        for i, (string, skip, x, y) in enumerate(segments):
+            last = i + 1 == len(segments) and not followed
+            skip = skip and (len(string) > 3 or last)
+            if printed and not skip and not printed[-1][1]:
+                printed[-1][0] += string
+            else:
+                printed.append([string, skip, x, y])
 
+        for string, skip, x, y in printed:
+            if skip:
+                logger.debug("({},{}) skipping {} blanks".format(x, y, len(string)))
+                self.moved = True
+                continue
+            if self.moved:
+                # The 3270 buffer address isn't where the cursor is
+                self.add_sba(x, y)
+            if graphic:
+                self.print_graphic(string)
+            else:
+                self.print_ascii(string)
 
-            self.add_hlasm(hlasm)
-        return
+    def print_graphic(self, ascii_string):
+        if ascii_string:
+            logger.debug("({},{}) converting: {} length: {}".format(self.x, self.y, ascii_string, len(ascii_string)))
+            self.add_orders(Order('GE', data=graphic_segment(ascii_string, self.codec.name, self.codec.codepage)))
 
-    def add_hlasm(self, hlasm):
-        logger.debug("({},{}) adding hlasm: \n{}".format(self.x, self.y,hlasm.rstrip()))
-        self.hlasm += hlasm
+    def print_ascii(self, ascii_string):
+        if ascii_string:
+            logger.debug("({},{}) printing ascii: \"{}\"".format(self.x, self.y,ascii_string))
+            self.add_orders(Order('TEXT', data=ascii_string))
 
+    def add_orders(self, *orders):
+        logger.debug("({},{}) adding orders: {}".format(self.x, self.y, orders))
+        self.orders.extend(orders)
 
     def ansi_state_machine(self, ansi):
 
         # This uses SF/SA to make colors in line, but its messy
         # the SFE method is much cleaner, use that if your colors arent contiguous (i.e. has spaces in between them)
-        current_byte = ''
-        previous_byte = ''
-        escape_sequence = ''
-        ascii_text = ''
+        self.reset_parser()
+        self.feed(ansi)
+
+    def reset_parser(self):
+        self.escape_sequence = ''
+        self.ascii_text = ''
         self.escaped = False
         self.graphic = False
-
+        # Escape sequences tokenize() and sgr_codes() used or had to leave
+        # out, rgb counts the unknown SGR codes that are 256 or RGB colors
+        self.parse_stats = dict.fromkeys(('escapes', 'ignored', 'malformed', 'overlong', 'unknown', 'rgb'), 0)
+
+    def parse_report(self):
+        # What had to be left out of the ANSi, '' if nothing
+        names = (('malformed', 'malformed escape sequences'), ('overlong', 'overlong escape sequences'),
+                 ('ignored', 'unsupported escape sequences'), ('unknown', 'unknown SGR codes'))
+        problems = ["{} {}".format(self.parse_stats[key], name) for key, name in names if self.parse_stats[key]]
+        return "Left out " + ", ".join(problems) if problems else ''
+
+    def feed(self, ansi):
+        # Runs ansi through the state machine, carrying on from wherever the
+        # previous call stopped
+        self.render(self.tokenize(ansi))
+
+    def tokenize(self, ansi):
+        # Splits ansi in to the tokens render() turns in to HLASM:
+        #   ('text', string, graphic), ('newline',) and ('escape', sequence, type)
+        # Text still being collected when ansi runs out is kept for the next call
+        tokens = []
         for byte in ansi:
-            previous_byte = current_byte
-            current_byte = byte
+
+            if self.escaped:
+                if self.escape(byte, tokens):
+                    continue
+                # Broke off the escape sequence, byte is text (or a new one)
 
             if byte == "\n":
-                logger.debug("({},{}) Newline Found".format(self.x, self.y))
-                if self.graphic:
-                    self.print_graphic(ascii_text)
-                else:
-                    self.print_ascii(ascii_text)
-                ascii_text = ''
-                self.inc_x()
-                self.reset_y()
+                if self.ascii_text:
+                    tokens.append(('text', self.ascii_text, self.graphic))
+                    self.ascii_text = ''
+                tokens.append(('newline',))
                 continue
             if byte == "\r":
                 continue
 
             if byte == "\x1b":
-                logger.debug("({},{}) Escape Sequence Found".format(self.x, self.y))
-                if self.graphic:
-                    self.print_graphic(ascii_text)
-                else:
-                    self.print_ascii(ascii_text)
-                ascii_text = ''
+                if self.ascii_text:
+                    tokens.append(('text', self.ascii_text, self.graphic))
+                    self.ascii_text = ''
                 self.escaped = True
                 continue
 
-            if self.escaped and byte not in escape_types:
-                escape_sequence += byte
-                continue
-            elif self.escaped and byte in escape_types:
-                self.parse_escape(escape_sequence, byte)
-                self.escaped = False
-                escape_sequence = ''
-                ascii_text = ''
-                continue
+            graphic = self.codec[byte][1]
+            if graphic != self.graphic:
+                # Switching between graphic and ascii mode, print whatever
+                # we collected in the other mode
+                if self.ascii_text:
+                    tokens.append(('text', self.ascii_text, self.graphic))
+                self.graphic = graphic
+                self.ascii_text = byte
+            else:
+                self.ascii_text += byte
+        return tokens
+
+    def escape(self, byte, tokens):
+        # Feeds byte to the escape sequence after an ESC, adding a token
+        # when a supported control sequence (ESC [ parameters final) ends.
+        # Sequences longer than max_escape stop growing and are left out, so
+        # are private ones (ESC[?7h), ones with intermediate bytes and
+        # anything else the state machine can't use. Returns False when
+        # byte broke off the sequence and still has to be handled.
+        sequence = self.escape_sequence
+        code = ord(byte)
+        if byte == '\r':
+            return True
+        if not sequence:
+            if byte == '[' or 0x20 <= code <= 0x2F:
+                # A control sequence or an escape with intermediate bytes
+                self.escape_sequence = byte
+                return True
+            self.escaped = False
+            if 0x30 <= code <= 0x7E:
+                # Two character escape sequence
+                self.parse_stats['ignored'] += 1
+                return True
+            self.parse_stats['malformed'] += 1
+            return False
+
+        # Parameter bytes only belong in control sequences
+        if 0x20 <= code <= 0x2F or (0x30 <= code <= 0x3F and sequence[0] == '['):
+            if len(sequence) <= max_escape:
+                self.escape_sequence += byte
+            return True
 
-            if not self.graphic and (byte in cp437_to_ebcdic or ord(byte) in  cp437_to_ebcdic):
-                #logger.debug("({},{}) [Graphic found] Adding '{}' to graphic buffer".format(self.x, self.y, byte))
-                #if len(ascii_text) > 0:
-                    #logger.debug("({},{}) Previous String: '{}'".format(self.x, self.y, ascii_text))
-                # Switch to graphic mode
-                # print whatever strings we have collected thats arent graphic mode:
-                self.print_ascii(ascii_text)
-                self.graphic = True
-                ascii_text = byte
-
-            elif self.graphic and (byte in cp437_to_ebcdic or ord(byte) in  cp437_to_ebcdic):
-                ascii_text += byte
-                #logger.debug("({},{}) [Graphic continuing] Adding '{}' to graphic buffer".format(self.x, self.y, byte))
-
-            elif self.graphic and byte not in cp437_to_ebcdic:
-                #logger.debug("({},{}) Gaphic mode done switching to ASCII".format(self.x, self.y, byte))
-                #logger.debug("({},{}) Adding '{}' to ASCII buffer".format(self.x, self.y, byte))
-                self.graphic = False
-                self.print_graphic(ascii_text)
-                ascii_text = byte
+        self.escaped = False
+        self.escape_sequence = ''
+        if not 0x30 <= code <= 0x7E:
+            self.parse_stats['malformed'] += 1
+            return False
+        if len(sequence) > max_escape:
+            self.parse_stats['overlong'] += 1
+        elif sequence[0] != '[' or not csi_params.match(sequence[1:]) or byte not in csi_finals:
+            self.parse_stats['ignored'] += 1
+        else:
+            params = [str(int(param)) if param else '' for param in sequence[1:].split(';')]
+            if byte in 'JK':
+                params = params[:1]
+            tokens.append(('escape', '[' + ';'.join(params), csi_finals[byte]))
+            self.parse_stats['escapes'] += 1
+        return True
+
+    def render(self, tokens):
+        for i, token in enumerate(tokens):
+            if token[0] == 'text':
+                followed = i + 1 < len(tokens) and tokens[i + 1][0] == 'text'
+                self.print_text(token[1], token[2], followed)
+            elif token[0] == 'newline':
+                logger.debug("({},{}) Newline Found".format(self.x, self.y))
+                self.inc_x()
+                self.reset_y()
+                self.moved = True
             else:
-                #logger.debug("({},{}) Adding '{}' to ASCII buffer".format(self.x, self.y, byte))
-                ascii_text += byte
-            self.inc_y()
+                logger.debug("({},{}) Escape Sequence Found".format(self.x, self.y))
+                self.parse_escape(token[1], token[2])
 
     def inc_y(self, num=1):
         #logger.debug("({},{}) Adding '{}' to y".format(self.x, self.y, num))
-        self.inc_x((self.y + num)//81)
-        self.y = (self.y + num) % 81
+        self.inc_x((self.y + num)//(self.width + 1))
+        self.y = (self.y + num) % (self.width + 1)
         if self.y == 0:
             self.y += 1
         #logger.debug("({},{}) Done".format(self.x, self.y))
 
     def dec_y(self, num=1):
-        self.y = (self.y - num) % 81
-        self.dec_x(int((self.y - num)/80))
+        self.y = (self.y - num) % (self.width + 1)
+        self.dec_x(int((self.y - num)/self.width))
         if self.y == 0:
             self.y += 1
 
@@ -1558,37 +3942,985 @@ class ANSITN3270:
         self.y = 1
 
     def inc_x(self, num=1):
-        self.x = (self.x + num) % 25
+        self.x = (self.x + num) % (self.height + 1)
         if self.x == 0:
             self.x += 1
 
     def dec_x(self, num=1):
-        self.x = (self.x - num) % 25
+        self.x = (self.x - num) % (self.height + 1)
         if self.x == 0:
             self.x += 1
 
-    def calculate_sba(self, x, y):
-        logger.debug("({},{}) Calculating SBA {},{}".format(self.x, self.y, x, y))
-        tn3270_ba = [
-            '40','C1','C2','C3','C4','C5','C6','C7','C8','C9','4A','4B','4C','4D','4E','4F',
-            '50','D1','D2','D3','D4','D5','D6','D7','D8','D9','5A','5B','5C','5D','5E','5F',
-            '60','61','E2','E3','E4','E5','E6','E7','E8','E9','6A','6B','6C','6D','6E','6F',
-            'F0','F1','F2','F3','F4','F5','F6','F7','F8','F9','7A','7B','7C','7D','7E','7F']
-
-        ROW = x
-        COL = y
-        n = ((ROW-1)*80 + (COL-1))
-        logger.debug("({},{}) First calcuation: {:012b}".format(self.x, self.y, n))
-        n2 = n & int('000000111111', 2)
-        n1 = n >> 6
-        logger.debug("({},{}) n1: {:08b} n2: {:08b}".format(self.x, self.y, n1, n2))
-        logger.debug("({},{}) hex x: {} hex y: {}".format(self.x, self.y, tn3270_ba[n1], tn3270_ba[n2]))
-        return(tn3270_ba[n1]+tn3270_ba[n2])
-
     def print_hlasm(self):
         print(self.hlasm)
 
 
+def split_operands(operands):
+    # Splits a DC operand field on commas, stopping at the first blank
+    # outside of quotes (the start of the remarks)
+    result = []
+    current = ''
+    quoted = False
+    for c in operands:
+        if c == "'":
+            quoted = not quoted
+        elif not quoted and c == ' ':
+            break
+        elif not quoted and c == ',':
+            result.append(current)
+            current = ''
+            continue
+        current += c
+    if current:
+        result.append(current)
+    return result
+
+
+def assemble_dc(operand, codepage='037'):
+    # Assembles a single X or C type DC operand, e.g. 48C' ' or CL8' '
+    dup = ''
+    while operand[0].isdigit():
+        dup += operand[0]
+        operand = operand[1:]
+    dc_type = operand[0].upper()
+    operand = operand[1:]
+    length = ''
+    if operand[0].upper() == 'L':
+        operand = operand[1:]
+        while operand[0].isdigit():
+            length += operand[0]
+            operand = operand[1:]
+    value = operand[1:-1]
+    if dc_type == 'X':
+        if len(value) % 2:
+            value = '0' + value
+        data = bytes.fromhex(value)
+        pad = b'\x00'
+    elif dc_type == 'C':
+        data = to_ebcdic(value.replace("''", "'").replace("&&", "&"), codepage)
+        pad = to_ebcdic(' ', codepage)
+    else:
+        raise ValueError("Unsupported DC type: {}".format(operand))
+    if length:
+        data = (data + pad * int(length))[:int(length)]
+    return data * int(dup or 1)
+
+
+def hlasm_statements(hlasm):
+    # The (label, operation, operands) of every statement in hlasm, with
+    # continuation cards joined and comments left out
+    statement = ''
+    for card in hlasm.splitlines():
+        if not statement and (not card.strip() or card.startswith('*')):
+            continue
+        # A card with something in column 72 is continued on the next one,
+        # from column 16
+        continued = len(card) > dense_end and card[dense_end] != ' '
+        if continued:
+            card = card[:dense_end].rstrip()
+        line = statement + card[dense_start:] if statement else card
+        statement = line if continued else ''
+        if continued:
+            continue
+        fields = line[1:].split(None, 1) if line[0] == ' ' else line.split(None, 2)[1:]
+        if not fields:
+            continue
+        label = '' if line[0] == ' ' else line.split(None, 1)[0]
+        yield label, fields[0].upper(), fields[1].strip() if len(fields) > 1 else ''
+
+
+def assemble_statement(op, operands, codepage='037'):
+    # The 3270 bytes of a DC/$SBA/$SF/$IC statement, None for anything else
+    if op == 'DC':
+        return b''.join(assemble_dc(operand, codepage) for operand in split_operands(operands))
+    if op == '$SBA':
+        row, col = operands.split()[0].strip('()').split(',')
+        n = (int(row) - 1) * 80 + (int(col) - 1)
+        return bytes.fromhex('11' + tn3270_ba[n >> 6] + tn3270_ba[n & 0x3F])
+    if op == '$SF':
+        attribute = 0
+        for keyword in operands.split()[0].strip('()').split(','):
+            attribute |= field_attributes[keyword.upper()]
+        return bytes.fromhex('1D' + tn3270_ba[attribute])
+    if op == '$IC':
+        return b'\x13'
+    return None
+
+
+def assemble_hlasm(hlasm, codepage='037'):
+    # Turns the DC/$SBA/$SF/$IC statements this script generates back in to
+    # the raw 3270 bytes the assembler would produce
+    stream = b''
+    for label, op, operands in hlasm_statements(hlasm):
+        data = assemble_statement(op, operands, codepage)
+        if data is not None:
+            stream += data
+    return stream
+
+
+# Commands a data stream in HLASM can start with: Write, Erase/Write and
+# Erase/Write Alternate (EBCDIC and SNA codes)
+write_commands = (0xF1, 0xF5, 0x7E, 0x01, 0x05, 0x0D)
+
+
+def hlasm_stream(hlasm, codepage='037'):
+    # The screen in hlasm (JCL or HLASM this script made, or written by
+    # hand): the longest run of DC/$SBA/$SF/$IC statements starting with a
+    # write command (after TSO's X'27' escape) or a $WCC or $SBA macro.
+    # Returns it as a data stream, Erase/Write for the macro screens VTAM
+    # sends the command for, or None if there isn't one.
+    runs = []
+    run = None
+    for label, op, operands in hlasm_statements(hlasm):
+        try:
+            data = b'' if op == '$WCC' else assemble_statement(op, operands, codepage)
+        except (ValueError, KeyError, IndexError):
+            data = None
+        if data is None:
+            run = None
+            continue
+        if run is None:
+            run = [op, b'']
+            runs.append(run)
+        run[1] += data
+    streams = []
+    for first, data in runs:
+        if first in ('$WCC', '$SBA'):
+            streams.append(b'\xF5\xC3' + data)
+        else:
+            data = data[1:] if data[:1] == b'\x27' else data
+            if len(data) > 1 and data[0] in write_commands:
+                streams.append(data)
+    return max(streams, key=len, default=None)
+
+
+def netsol_header(codepage='037'):
+    # The data stream of NETSOL's fields in front of the art, ending with
+    # the SBA to (1,1)
+    return hlasm_stream(netsol_jcl.split('{hlasm}')[0], codepage)
+
+
+# 3270 colors as (ANSi SGR foreground, HTML color) for rendering screens
+colors_3270 = {
+    0xF0 : ('30', '#000000'),
+    0xF1 : ('94', '#7890F0'),
+    0xF2 : ('91', '#F01818'),
+    0xF3 : ('95', '#FF00FF'),
+    0xF4 : ('92', '#24D830'),
+    0xF5 : ('96', '#58F0F0'),
+    0xF6 : ('93', '#FFFF00'),
+    0xF7 : ('97', '#FFFFFF'),
+    0xF8 : ('30', '#000000'),
+    0xF9 : ('34', '#0000CD'),
+    0xFA : ('33', '#FFA500'),
+    0xFB : ('35', '#A020F0'),
+    0xFC : ('32', '#98FB98'),
+    0xFD : ('36', '#AFEEEE'),
+    0xFE : ('90', '#BEBEBE'),
+    0xFF : ('97', '#FFFFFF')
+}
+
+# Extended highlighting as ANSi SGR
+highlights_3270 = {
+    0xF1 : '5',
+    0xF2 : '7',
+    0xF4 : '4',
+    0xF8 : '1'
+}
+
+# What the cp437_to_ebcdic graphic escape (GE) characters look like
+ge_chars = {}
+for key, value in cp437_to_ebcdic.items():
+    if isinstance(key, str) and len(value) == 4:
+        ge_chars.setdefault(int(value[2:], 16), key)
+ge_chars[0x95] = '█'
+
+
+
+def ebcdic_code(code):
+    # The (EBCDIC code, is GE) for an InputCodec hex string
+    return int(code[-2:], 16), len(code) == 4
+
+
+class Screen3270:
+
+    # A 3270 display buffer. write() interprets the orders this script
+    # generates (SBA, SA, SF, SFE, IC, RA, EUA, GE) in to a grid of cells,
+    # which can then be compared or rendered as ANSi or HTML.
+
+    def __init__(self, rows=24, cols=80, unformatted=None, codepage='037'):
+        self.rows = rows
+        self.cols = cols
+        self.size = rows * cols
+        self.ebcdic_chars = from_ebcdic(bytes(range(256)), codepage)
+        # The field to show the screen with while it has none of its own
+        self.unformatted = unformatted
+        self.clear()
+
+    def clear(self):
+        self.chars = bytearray(self.size)
+        self.ge = bytearray(self.size)
+        self.fg = bytearray(self.size)
+        self.bg = bytearray(self.size)
+        self.hl = bytearray(self.size)
+        # address : (field attribute, fg, bg, highlight)
+        self.fields = {}
+        self.cursor = 0
+
+    def cell(self, address):
+        return (self.chars[address], self.ge[address], self.fg[address],
+                self.bg[address], self.hl[address])
+
+    def put(self, address, code, ge=False, fg=0, bg=0, hl=0):
+        self.fields.pop(address, None)
+        self.chars[address] = code
+        self.ge[address] = ge
+        self.fg[address] = fg
+        self.bg[address] = bg
+        self.hl[address] = hl
+        return (address + 1) % self.size
+
+    def set_field(self, address, attribute, fg=0, bg=0, hl=0):
+        self.put(address, 0)
+        self.fields[address] = (attribute, fg, bg, hl)
+        return (address + 1) % self.size
+
+    def decode_address(self, b1, b2):
+        if b1 & 0xC0 == 0:
+            # 14 bit binary address
+            return ((b1 & 0x3F) << 8 | b2) % self.size
+        return ((b1 & 0x3F) << 6 | (b2 & 0x3F)) % self.size
+
+    def write(self, stream):
+        # stream is a Write/Erase Write command byte, the WCC and orders
+        if stream[0] in (0xF5, 0x05, 0x7E, 0x0D):
+            self.clear()
+        address = self.cursor
+        sa = [0, 0, 0]
+        i = 2
+        while i < len(stream):
+            order = stream[i]
+            if order == 0x11:
+                address = self.decode_address(stream[i + 1], stream[i + 2])
+                i += 3
+            elif order == 0x28:
+                sa_type, value = stream[i + 1], stream[i + 2]
+                if sa_type == 0x00:
+                    sa = [0, 0, 0]
+                elif sa_type == 0x42:
+                    sa[0] = value
+                elif sa_type == 0x45:
+                    sa[1] = value
+                elif sa_type == 0x41:
+                    sa[2] = value
+                i += 3
+            elif order == 0x1D:
+                address = self.set_field(address, stream[i + 1])
+                i += 2
+            elif order == 0x29:
+                pairs = stream[i + 2:i + 2 + stream[i + 1] * 2]
+                attribute, fg, bg, hl = 0, 0, 0, 0
+                for j in range(0, len(pairs), 2):
+                    if pairs[j] == 0xC0:
+                        attribute = pairs[j + 1]
+                    elif pairs[j] == 0x42:
+                        fg = pairs[j + 1]
+                    elif pairs[j] == 0x45:
+                        bg = pairs[j + 1]
+                    elif pairs[j] == 0x41:
+                        hl = pairs[j + 1]
+                address = self.set_field(address, attribute, fg, bg, hl)
+                i += 2 + len(pairs)
+            elif order == 0x13:
+                self.cursor = address
+                i += 1
+            elif order == 0x3C:
+                stop = self.decode_address(stream[i + 1], stream[i + 2])
+                code, ge = stream[i + 3], False
+                i += 4
+                if code == 0x08:
+                    code, ge = stream[i], True
+                    i += 1
+                address = self.put(address, code, ge, *sa)
+                while address != stop:
+                    address = self.put(address, code, ge, *sa)
+            elif order == 0x12:
+                stop = self.decode_address(stream[i + 1], stream[i + 2])
+                i += 3
+                address = self.put(address, 0)
+                while address != stop:
+                    address = self.put(address, 0)
+            elif order == 0x08:
+                address = self.put(address, stream[i + 1], True, *sa)
+                i += 2
+            else:
+                address = self.put(address, order, False, *sa)
+                i += 1
+
+    def field_map(self):
+        # The field attribute governing every address, None when unformatted
+        governing = [self.unformatted] * self.size
+        if self.fields:
+            start = max(self.fields)
+            field = self.fields[start]
+            for i in range(1, self.size + 1):
+                address = (start + i) % self.size
+                field = self.fields.get(address, field)
+                governing[address] = field
+        return governing
+
+    def display(self):
+        # Yields (row, column, character, fg, bg, highlight) the way a
+        # color terminal would show every cell
+        governing = self.field_map()
+        for address in range(self.size):
+            field = governing[address]
+            code = self.chars[address]
+            if address in self.fields or code < 0x40 or (field and field[0] & 0x0C == 0x0C):
+                char = ' '
+            elif self.ge[address]:
+                char = ge_chars.get(code, '?')
+            else:
+                char = self.ebcdic_chars[code]
+            if field:
+                # Base color: protected/unprotected, normal/intensified
+                default = [[0xF4, 0xF2], [0xF1, 0xF7]][bool(field[0] & 0x20)][field[0] & 0x0C == 0x08]
+                fg = self.fg[address] or field[1] or default
+                bg = self.bg[address] or field[2]
+                hl = self.hl[address] or field[3]
+            else:
+                fg, bg, hl = self.fg[address] or 0xF4, self.bg[address], self.hl[address]
+            yield address // self.cols + 1, address % self.cols + 1, char, fg, bg, hl
+
+    def looks(self):
+        # What every cell looks like as (character, fg, bg, highlight), with
+        # all empty cells the same
+        looks = []
+        for row, col, char, fg, bg, hl in self.display():
+            if char == ' ':
+                fg = 0
+                if not blank_visible(bg, hl):
+                    bg, hl = 0, 0
+            looks.append((char, fg, bg, hl))
+        return looks
+
+    def to_ansi(self):
+        lines = []
+        line = ''
+        current = None
+        for row, col, char, fg, bg, hl in self.display():
+            if (fg, bg, hl) != current:
+                current = (fg, bg, hl)
+                sgr = ['0', colors_3270.get(fg, ('37',))[0]]
+                if bg in colors_3270:
+                    sgr.append(str(int(colors_3270[bg][0]) + 10))
+                if hl in highlights_3270:
+                    sgr.append(highlights_3270[hl])
+                line += "\x1b[{}m".format(';'.join(sgr))
+            line += char
+            if col == self.cols:
+                lines.append(line + "\x1b[0m")
+                line = ''
+                current = None
+        return '\n'.join(lines) + '\n'
+
+    def to_html(self):
+        html = '<pre style="background:#000000;color:#24D830;font-family:monospace">'
+        span = None
+        for row, col, char, fg, bg, hl in self.display():
+            fg_color = colors_3270.get(fg, ('', '#24D830'))[1]
+            bg_color = colors_3270.get(bg, ('', '#000000'))[1]
+            if hl == 0xF2:
+                fg_color, bg_color = bg_color, fg_color
+            style = 'color:{};background:{}'.format(fg_color, bg_color)
+            if hl == 0xF4:
+                style += ';text-decoration:underline'
+            if style != span:
+                if span:
+                    html += '</span>'
+                html += '<span style="{}">'.format(style)
+                span = style
+            html += char.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+            if col == self.cols:
+                html += '</span>\n'
+                span = None
+        return html + '</pre>\n'
+
+
+# What --costs splits the data stream's bytes in to
+cost_causes = ('text', 'ge', 'sba', 'sa', 'field', 'cursor')
+
+# The --costs heatmap background for the bytes spent on a cell, the last
+# level at or below them
+cost_levels = ((0, 0xF0), (1, 0xF1), (2, 0xF4), (3, 0xF6), (5, 0xF3), (8, 0xF2))
+
+
+def cost_report(screen, costs, frame, html=False):
+    # The emulated screen with every cell on the color of the bytes spent
+    # on it, a legend and a table of each row's bytes by cause, as ANSi or
+    # HTML. costs and frame come from ANSITN3270.byte_costs().
+    cells = [0] * screen.size
+    rows = [dict.fromkeys(cost_causes, 0) for row in range(screen.rows)]
+    for address, cause, size in costs:
+        cells[address] += size
+        rows[address // screen.cols][cause] += size
+
+    def level(size):
+        return [color for least, color in cost_levels if size >= least][-1]
+
+    def paint(text, bg):
+        fg = 0xFE if bg == 0xF0 else 0xF0
+        if html:
+            text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+            return '<span style="color:{};background:{}">{}</span>'.format(colors_3270[fg][1], colors_3270[bg][1], text)
+        return "\x1b[0;{};{}m{}\x1b[0m".format(colors_3270[fg][0], int(colors_3270[bg][0]) + 10, text)
+
+    lines = []
+    painted = [(char, level(cells[(row - 1) * screen.cols + col - 1])) for row, col, char, fg, bg, hl in screen.display()]
+    for start in range(0, screen.size, screen.cols):
+        lines.append(''.join(paint(''.join(char for char, color in run), color)
+                             for color, run in groupby(painted[start:start + screen.cols], key=lambda cell: cell[1])))
+    lines.append('')
+    legend = []
+    for (least, color), upper in zip(cost_levels, [least - 1 for least, color in cost_levels[1:]] + [None]):
+        label = '{}+'.format(least) if upper is None else '{}-{}'.format(least, upper) if upper > least else least
+        legend.append(paint(' {} '.format(label), color))
+    lines.append('Bytes per cell: ' + ' '.join(legend))
+    lines.append('')
+    lines.append('Row  ' + ''.join('{:>7}'.format(cause.upper() if cause in ('ge', 'sba', 'sa') else cause.title())
+                                     for cause in cost_causes) + '  Total')
+    for row, causes in enumerate(rows, 1):
+        lines.append('{:>3}  '.format(row) + ''.join('{:>7}'.format(causes[cause]) for cause in cost_causes) +
+                     '{:>7}'.format(sum(causes.values())))
+    totals = [sum(causes[cause] for causes in rows) for cause in cost_causes]
+    lines.append('All  ' + ''.join('{:>7}'.format(total) for total in totals) + '{:>7}'.format(sum(totals)))
+    lines.append('')
+    lines.append('Data stream: {} bytes, {} of them the command, WCC and the target\'s frame'.format(
+                 sum(totals) + frame, frame))
+    if html:
+        return '<pre style="background:#000000;color:#24D830;font-family:monospace">{}</pre>\n'.format('\n'.join(lines))
+    return '\n'.join(lines) + '\n'
+
+
+art_extensions = ('.ans', '.asc', '.ice', '.nfo', '.diz', '.txt')
+
+
+def art_files(path):
+    # path itself or every ANSi file below it when path is a directory,
+    # including the ones in .zip archives (as archive.zip/member.ans)
+    if os.path.isfile(path) and path.lower().endswith('.zip'):
+        return archive_files(path)
+    if not os.path.isdir(path):
+        return [path]
+    found = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            extension = os.path.splitext(name)[1].lower()
+            if extension in art_extensions:
+                found.append(os.path.join(root, name))
+            elif extension == '.zip':
+                found += archive_files(os.path.join(root, name))
+    return found
+
+
+def archive_files(archive):
+    # The ANSi files in a .zip archive as archive.zip/member paths
+    try:
+        with zipfile.ZipFile(archive) as pack:
+            return [os.path.join(archive, name) for name in sorted(pack.namelist())
+                    if os.path.splitext(name)[1].lower() in art_extensions]
+    except (zipfile.BadZipFile, OSError) as e:
+        logger.warning("Skipping {}: {}".format(archive, e))
+        return []
+
+
+def split_archive(path):
+    # (archive, member) for a path in to a .zip archive, (path, None) otherwise
+    if os.path.exists(path):
+        return path, None
+    parts = path.split(os.sep)
+    for i in range(1, len(parts)):
+        archive = os.sep.join(parts[:i])
+        if archive.lower().endswith('.zip') and os.path.isfile(archive):
+            return archive, '/'.join(parts[i:])
+    return path, None
+
+
+def read_art(path):
+    # The bytes of an ANSi file, which can be in a .zip archive
+    archive, member = split_archive(path)
+    if member is None:
+        with open(path, 'rb') as f:
+            return f.read()
+    with zipfile.ZipFile(archive) as pack:
+        return pack.read(member)
+
+
+# Telnet commands and options used by TN3270
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+SE = 240
+EOR = 239
+TELOPT_BINARY = 0
+TELOPT_TTYPE = 24
+TELOPT_EOR = 25
+TTYPE_IS = 0
+TTYPE_SEND = 1
+
+
+def tn3270_record(stream):
+    # Escapes IAC bytes and terminates the 3270 data stream with IAC EOR
+    return stream.replace(bytes([IAC]), bytes([IAC, IAC])) + bytes([IAC, EOR])
+
+
+class TelnetReader:
+
+    # Splits a telnet byte stream in to option commands, subnegotiations
+    # and IAC EOR terminated records
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.buffer = bytearray()
+        self.record = bytearray()
+        self.received = 0
+
+    async def read(self):
+        # Returns ('cmd', verb, option), ('sb', data) or ('record', data)
+        while True:
+            i = self.buffer.find(IAC)
+            if i < 0:
+                self.record += self.buffer
+                del self.buffer[:]
+            else:
+                self.record += self.buffer[:i]
+                del self.buffer[:i]
+                verb = self.buffer[1] if len(self.buffer) > 1 else None
+                if verb == IAC:
+                    self.record.append(IAC)
+                    del self.buffer[:2]
+                    continue
+                elif verb == EOR:
+                    record = bytes(self.record)
+                    del self.record[:]
+                    del self.buffer[:2]
+                    return ('record', record)
+                elif verb in (DO, DONT, WILL, WONT):
+                    if len(self.buffer) > 2:
+                        option = self.buffer[2]
+                        del self.buffer[:3]
+                        return ('cmd', verb, option)
+                elif verb == SB:
+                    end = self.buffer.find(bytes([IAC, SE]))
+                    if end > 0:
+                        data = bytes(self.buffer[2:end])
+                        del self.buffer[:end + 2]
+                        return ('sb', data)
+                elif verb is not None:
+                    # NOP, GA and friends
+                    del self.buffer[:2]
+                    continue
+            data = await self.reader.read(4096)
+            if not data:
+                raise ConnectionResetError
+            self.received += len(data)
+            self.buffer += data
+
+
+class Link:
+
+    # A network link of bandwidth bytes per second shared by every session,
+    # 0 means unlimited. Writes are sent in chunks, each one reserving the
+    # next free slot on the link.
+
+    def __init__(self, bandwidth=0, chunk=512):
+        self.bandwidth = bandwidth
+        self.chunk = chunk
+        self.free_at = 0.0
+
+    async def send(self, writer, data):
+        if not self.bandwidth:
+            writer.write(data)
+            await writer.drain()
+            return
+        for i in range(0, len(data), self.chunk):
+            piece = data[i:i + self.chunk]
+            now = time.monotonic()
+            self.free_at = max(now, self.free_at) + len(piece) / self.bandwidth
+            await asyncio.sleep(self.free_at - now)
+            writer.write(piece)
+            await writer.drain()
+
+
+class TN3270Server:
+
+    # Serves the screen ANSITN3270 generates to local tn3270 clients and
+    # pushes a fresh copy every time the ANSi file changes
+
+    def __init__(self, art, ansifile, host='127.0.0.1', port=3270, interval=0.25,
+                 link=None, verbose=True):
+        self.art = art
+        self.ansifile = ansifile
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self.link = link or Link()
+        self.verbose = verbose
+        # Connected clients and the lock that keeps the records sent to
+        # each one from being interleaved
+        self.clients = {}
+        self.record = tn3270_record(art.data_stream())
+
+    async def negotiate(self, telnet, writer):
+        writer.write(bytes([IAC, DO, TELOPT_TTYPE]))
+        await writer.drain()
+        event = await telnet.read()
+        while event != ('cmd', WILL, TELOPT_TTYPE):
+            if event == ('cmd', WONT, TELOPT_TTYPE):
+                raise ConnectionError("client refused terminal type")
+            event = await telnet.read()
+        writer.write(bytes([IAC, SB, TELOPT_TTYPE, TTYPE_SEND, IAC, SE]))
+        await writer.drain()
+        event = await telnet.read()
+        while event[0] != 'sb' or event[1][:2] != bytes([TELOPT_TTYPE, TTYPE_IS]):
+            event = await telnet.read()
+        writer.write(bytes([IAC, DO, TELOPT_EOR, IAC, WILL, TELOPT_EOR,
+                            IAC, DO, TELOPT_BINARY, IAC, WILL, TELOPT_BINARY]))
+        await writer.drain()
+        return event[1][2:].decode('ascii', 'replace')
+
+    async def handle(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        try:
+            telnet = TelnetReader(reader)
+            terminal = await asyncio.wait_for(self.negotiate(telnet, writer), 10)
+            if self.verbose:
+                print("[+] {} connected ({})".format(peer, terminal))
+            self.clients[writer] = asyncio.Lock()
+            await self.send(writer, self.record)
+            while True:
+                event = await telnet.read()
+                if event[0] == 'record':
+                    # Any AID (Enter, PF key, Clear) redisplays the art
+                    await self.send(writer, self.record)
+        except (ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.clients.pop(writer, None)
+            writer.close()
+            if self.verbose:
+                print("[+] {} disconnected".format(peer))
+
+    async def send(self, writer, record):
+        # Sends record to a client over the link, waiting until it's drained
+        async with self.clients[writer]:
+            await self.link.send(writer, record)
+
+    async def reload(self, writer, record):
+        # send() for a changed screen, a client that went away meanwhile
+        # is left to handle() to clean up
+        try:
+            await self.send(writer, record)
+        except (ConnectionError, KeyError):
+            pass
+
+    async def watch(self):
+        mtime = os.stat(self.ansifile).st_mtime_ns
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                current = os.stat(self.ansifile).st_mtime_ns
+            except OSError:
+                continue
+            if current == mtime:
+                continue
+            mtime = current
+            try:
+                self.art.read_ansi(self.ansifile)
+                self.art.convert()
+                self.record = tn3270_record(self.art.data_stream())
+            except Exception as e:
+                print("[!] Could not convert {}: {}".format(self.ansifile, e))
+                continue
+            print("[+] {} changed, sending {} bytes to {} client(s)".format(
+                self.ansifile, len(self.record), len(self.clients)))
+            await asyncio.gather(*[self.reload(writer, self.record) for writer in list(self.clients)])
+
+    async def run(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        print("[+] TN3270 preview of {} on {}:{}".format(self.ansifile, self.host, self.port))
+        print("[+] Connect with e.g. x3270 {}:{} (Ctrl-C to stop)".format(self.host, self.port))
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.watch())
+
+
+async def storm_logon(host, port, terminal='IBM-3278-2-E'):
+    # A stand-in tn3270 client: negotiates like x3270 and waits for the
+    # first screen. Returns (seconds to screen, bytes received, screen bytes)
+    start = time.monotonic()
+    reader, writer = await asyncio.open_connection(host, port)
+    telnet = TelnetReader(reader)
+    try:
+        while True:
+            event = await telnet.read()
+            if event[0] == 'cmd' and event[1] == DO:
+                writer.write(bytes([IAC, WILL, event[2]]))
+            elif event[0] == 'cmd' and event[1] == WILL:
+                writer.write(bytes([IAC, DO, event[2]]))
+            elif event[0] == 'sb' and event[1] == bytes([TELOPT_TTYPE, TTYPE_SEND]):
+                writer.write(bytes([IAC, SB, TELOPT_TTYPE, TTYPE_IS]) + terminal.encode('ascii') + bytes([IAC, SE]))
+            elif event[0] == 'record':
+                return time.monotonic() - start, telnet.received, len(event[1])
+    finally:
+        writer.close()
+
+
+def percentile(values, percent):
+    # Nearest rank percentile of an already sorted list
+    return values[max(0, -(-len(values) * percent // 100) - 1)]
+
+
+async def logon_storm(art, ansifile, sessions, bandwidth=0):
+    # Reconnects sessions tn3270 clients at once to a local server sending
+    # the generated screen over a link of bandwidth bytes per second
+    tn3270 = TN3270Server(art, ansifile, port=0, link=Link(bandwidth), verbose=False)
+    server = await asyncio.start_server(tn3270.handle, tn3270.host, 0, backlog=max(100, sessions))
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        start = time.monotonic()
+        results = await asyncio.gather(*[storm_logon(tn3270.host, port) for _ in range(sessions)],
+                                       return_exceptions=True)
+        elapsed = time.monotonic() - start
+
+    logons = [r for r in results if not isinstance(r, BaseException)]
+    failed = len(results) - len(logons)
+    print("[+] Logon storm: {} sessions to {} ({})".format(
+        sessions, ansifile, "{} bytes/s link".format(bandwidth) if bandwidth else "unlimited bandwidth"))
+    if failed:
+        print("    Failed sessions:\t{} ({})".format(failed, next(r for r in results if isinstance(r, BaseException))))
+    if not logons:
+        return
+    times = sorted(r[0] for r in logons)
+    total = sum(r[1] for r in logons)
+    print("    Screen size:\t{} bytes (3270 data stream)".format(len(art.data_stream())))
+    print("    Bytes per logon:\t{} bytes (including telnet negotiation)".format(total // len(logons)))
+    print("    Total sent:\t\t{} bytes in {:.3f}s".format(total, elapsed))
+    print("    Throughput:\t\t{:.1f} KB/s".format(total / elapsed / 1024))
+    print("    Time to screen:\tp50 {:.1f}ms  p90 {:.1f}ms  p99 {:.1f}ms  max {:.1f}ms".format(
+        *[percentile(times, p) * 1000 for p in (50, 90, 99, 100)]))
+
+
+def mutate(text, rng):
+    # text with a few random changes, the kind broken or truncated ANSi has
+    pieces = '\x1b\x1b[[;?0123456789mHJK\n\r' + 'ab█'
+    for _ in range(rng.randint(1, 5)):
+        at = rng.randrange(len(text) + 1)
+        change = rng.randrange(5)
+        if change == 0:
+            text = text[:at] + rng.choice(pieces) + text[at + 1:]
+        elif change == 1:
+            text = text[:at]
+        elif change == 2:
+            text = text[:at] + '\x1b[' + ''.join(rng.choice('0123456789;?') for _ in range(rng.randint(0, 80))) + text[at:]
+        elif change == 3:
+            text = text[:at] + text[at + rng.randint(1, 200):]
+        else:
+            text = text[:at] + text[max(0, at - 200):at] + text[at:]
+    return text
+
+
+def fuzz(art, rounds, seed=0):
+    # Converts and verifies rounds mutations of the ANSi, then times
+    # pathological inputs of growing size to check conversion time stays
+    # linear in the input's size. Returns the number of failed rounds.
+    rng = random.Random(seed)
+    original = art.ansi
+    failed = differ = 0
+    left_out = dict.fromkeys(('malformed', 'overlong', 'ignored', 'unknown'), 0)
+    for round in range(rounds):
+        art.ansi = mutate(original, rng)
+        try:
+            screen, differences = art.verify()
+        except Exception as e:
+            failed += 1
+            if failed <= 10:
+                print("[!] Round {}: {!r}".format(round, e))
+            continue
+        differ += bool(differences)
+        for key in left_out:
+            left_out[key] += art.parse_stats[key]
+
+    print("[+] Fuzzing: {} mutations of {} (seed {})".format(rounds, art.ansifile, seed))
+    print("    Failed:\t\t{}".format(failed))
+    print("    Screens differing:\t{}".format(differ))
+    print("    Left out:\t\t{}".format(", ".join("{} {}".format(count, key) for key, count in left_out.items())))
+
+    cases = {
+        'Unterminated CSI': lambda size: '\x1b[' + '1' * size,
+        'ESC flood': lambda size: '\x1b' * size,
+        'Private modes': lambda size: '\x1b[?7h' * (size // 5),
+        'Long SGR': lambda size: '\x1b[' + '1;' * (size // 2) + 'm',
+        'Random bytes': lambda size: ''.join(chr(rng.randrange(256)) for _ in range(size)),
+        'Art': lambda size: (original * (size // max(len(original), 1) + 1))[:size],
+    }
+    sizes = (4096, 16384, 65536)
+    print("\n[+] Conversion time per KB for {} byte inputs".format(', '.join(map(str, sizes))))
+    for name, make in cases.items():
+        per_kb = []
+        for size in sizes:
+            art.ansi = make(size)
+            start = time.perf_counter()
+            art.convert()
+            per_kb.append((time.perf_counter() - start) / size * 1024)
+        growth = per_kb[-1] / per_kb[0]
+        print("    {:<18}{}  x{:.1f}{}".format(name, "  ".join("{:8.2f}ms".format(t * 1000) for t in per_kb),
+                                               growth, "  NOT LINEAR" if growth > 4 else ""))
+    art.ansi = original
+    return failed
+
+
+# Columns of the --index table, path is the ANSi file (archive.zip/member
+# for art in a .zip archive), mtime, size and settings say if it has to
+# be converted again
+index_columns = (
+    ('path', 'TEXT PRIMARY KEY'), ('mtime', 'REAL'), ('size', 'INTEGER'), ('settings', 'TEXT'),
+    # SAUCE record
+    ('title', 'TEXT'), ('author', 'TEXT'), ('group_name', 'TEXT'), ('date', 'TEXT'),
+    ('width', 'INTEGER'), ('height', 'INTEGER'), ('font', 'TEXT'),
+    # Conversion: rows and columns the art writes to, bytes of the 3270 data
+    # stream, SA orders, share of graphic characters, escape sequences used
+    # and left out, 256/RGB color codes and the error if conversion failed
+    ('rows', 'INTEGER'), ('cols', 'INTEGER'), ('bytes', 'INTEGER'), ('sa', 'INTEGER'),
+    ('graphic', 'REAL'), ('escapes', 'INTEGER'), ('unsupported', 'INTEGER'), ('rgb', 'INTEGER'),
+    ('error', 'TEXT'),
+)
+
+# The converter index_worker() uses in each worker process
+index_art = None
+
+
+def sauce_fields(sauced):
+    # title, author, group_name, date, width, height and font of a SAUCE
+    # record, all None without one
+    fields = dict.fromkeys(('title', 'author', 'group_name', 'date', 'width', 'height', 'font'))
+    try:
+        for key, value in (('title', sauced.title), ('author', sauced.author), ('group_name', sauced.group),
+                           ('date', sauced.date), ('font', sauced.filler)):
+            if isinstance(value, bytes):
+                value = value.decode('cp437')
+            fields[key] = value.replace('\x00', '').strip() or None
+        fields['width'], fields['height'] = int(sauced.tinfo1), int(sauced.tinfo2)
+    except:
+        pass
+    return fields
+
+
+def art_stats(art, path):
+    # The --index row for the ANSi file at path
+    stats = {'path': path, 'error': None}
+    try:
+        art.read_ansi(path)
+        stats.update(sauce_fields(art.sauced))
+        art.reset_parser()
+        tokens = art.tokenize(art.ansi)
+        characters = [len(token[1]) for token in tokens if token[0] == 'text']
+        graphic = [len(token[1]) for token in tokens if token[0] == 'text' and token[2]]
+        stats['graphic'] = round(sum(graphic) / sum(characters), 3) if characters and sum(characters) else 0.0
+        stats['rows'], stats['cols'] = art.art_extent(tokens)
+        art.convert()
+        stats['bytes'] = len(art.data_stream())
+        stats['sa'] = sum(order.op == 'SA' for order in art.orders + art.cursor_orders)
+        stats['escapes'] = art.parse_stats['escapes']
+        stats['unsupported'] = sum(art.parse_stats[key] for key in ('ignored', 'malformed', 'overlong', 'unknown'))
+        stats['rgb'] = art.parse_stats['rgb']
+    except Exception as e:
+        stats['error'] = repr(e)
+    return stats
+
+
+def index_init(art):
+    global index_art
+    index_art = art
+
+
+def index_worker(path):
+    return art_stats(index_art, path)
+
+
+def index_library(art, path, database, workers=None):
+    # Adds the SAUCE records and conversion stats of every ANSi file in
+    # path (a file, .zip archive or directory) to the sqlite database,
+    # converting only new files and ones that changed since the last scan
+    # and dropping the ones that are gone. Returns (converted, unchanged,
+    # removed).
+    db = sqlite3.connect(database)
+    db.execute("CREATE TABLE IF NOT EXISTS art ({})".format(
+        ', '.join('{} {}'.format(name, kind) for name, kind in index_columns)))
+    for column in ('rows', 'cols', 'bytes', 'rgb', 'author', 'group_name'):
+        db.execute("CREATE INDEX IF NOT EXISTS art_{0} ON art ({0})".format(column))
+
+    settings = "{} {} {} {} {} {} {}".format(art.jcl, art.tk4, art.extended, art.color_method,
+                                             art.codepage, art.input_codec, art.viewport)
+    known = {row[0]: row[1:] for row in db.execute("SELECT path, mtime, size, settings FROM art")}
+    found = {}
+    for ansi_file in art_files(path):
+        stat = os.stat(split_archive(ansi_file)[0])
+        found[ansi_file] = (stat.st_mtime, stat.st_size, settings)
+    todo = [ansi_file for ansi_file in found if known.get(ansi_file) != found[ansi_file]]
+
+    # Files that were in path but are gone now
+    root = path if not os.path.isdir(path) else os.path.join(path, '')
+    gone = [(name,) for name in known if name not in found and (name == root or name.startswith(root))]
+    db.executemany("DELETE FROM art WHERE path = ?", gone)
+
+    workers = workers or os.cpu_count() or 1
+    try:
+        # Workers start out with a copy of art, anything but fork would
+        # run this script again in each of them
+        context = multiprocessing.get_context('fork')
+    except ValueError:
+        workers = 1
+    if workers > 1 and len(todo) > 1:
+        pool = concurrent.futures.ProcessPoolExecutor(workers, mp_context=context,
+                                                      initializer=index_init, initargs=(art,))
+        results = pool.map(index_worker, todo, chunksize=8)
+    else:
+        pool = None
+        results = (art_stats(art, ansi_file) for ansi_file in todo)
+
+    insert = "INSERT OR REPLACE INTO art VALUES ({})".format(', '.join('?' * len(index_columns)))
+    try:
+        for count, stats in enumerate(results, 1):
+            stats['mtime'], stats['size'], stats['settings'] = found[stats['path']]
+            db.execute(insert, [stats.get(name) for name, kind in index_columns])
+            if stats['error']:
+                logger.warning("{}: conversion failed: {}".format(stats['path'], stats['error']))
+            if count % 100 == 0:
+                db.commit()
+                print("    {} of {} converted".format(count, len(todo)))
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+        db.commit()
+        db.close()
+    return len(todo), len(found) - len(todo), len(gone)
+
+
+def query_index(database, where):
+    # The indexed ANSi files matching the SQL expression where, smallest
+    # screens first
+    db = sqlite3.connect(database)
+    db.row_factory = sqlite3.Row
+    try:
+        return db.execute("SELECT * FROM art WHERE {} ORDER BY bytes, path".format(where)).fetchall()
+    finally:
+        db.close()
+
+
 
 arg_colors = ["WHITE", "RED", "GREEN", "YELLOW", "BLUE", "PINK", "TURQ"]
 
@@ -1611,55 +4943,267 @@ arg_parser.add_argument('--COL', help="Cursor location for user input column", d
 arg_parser.add_argument('--input', help="Cursor input field size", default="20")
 arg_parser.add_argument('--color', help="Cursor input field color", choices=arg_colors, type=str.upper, default="RED")
 arg_parser.add_argument('--extended', help='Use extended graphic colors ({}) like those supported by x3270'.format(graphic_colors), action='store_true')
-arg_parser.add_argument("ansi_file", help="Your ANSI art file you wish to convert", default=False)
-action = arg_parser.add_mutually_exclusive_group(required=True)
+arg_parser.add_argument('--color-method', help="How colors are sent: sa uses Set Attribute orders where the ANSi changes color, sfe puts protected fields carrying the color in front of color changes, auto picks whichever makes the smaller screen", choices=['auto', 'sa', 'sfe'], type=str.lower, default='auto')
+arg_parser.add_argument('--input-codec', help="Code page of the ANSi file, auto uses the SAUCE font or UTF-8 when the file is valid UTF-8 and CP437 otherwise", choices=['auto'] + list(input_codecs), type=str.lower, default='auto')
+arg_parser.add_argument('--codepage', help="EBCDIC code page of the mainframe and terminals", choices=list(ebcdic_codepages), default='037')
+arg_parser.add_argument('--binary', help="Save --file already translated to EBCDIC (--codepage) as 80 byte records, upload it in binary to a RECFM=FB,LRECL=80 member", action='store_true')
+arg_parser.add_argument('--object', help="Put the art in an object deck the linkage editor reads straight from the JCL instead of assembling it (--tso, --sysgen and --usstable, implies --binary)", action='store_true')
+arg_parser.add_argument('--max-bytes', help="Largest data stream the screen may take. Over it the art is made smaller step by step (extended colors merged in to base colors, background colors dropped, graphic characters replaced with plain ones, rows cropped off the bottom) and every change is reported, 0 for no limit", type=int, metavar='N', default=0)
+arg_parser.add_argument('--import-hlasm', help="The input file is a screen in HLASM or JCL (made by an earlier version of this script or by hand) instead of ANSi: it's played on an emulated 3270 and generated again, printing the old and new size", action='store_true')
+arg_parser.add_argument('--write-messages', help="USS table: only MSG 10 shows the art, the other messages are a Write that puts the message on the line below the input field (above it when the field is on the last line) and leaves the art on the screen. The art isn't drawn on that line from the input column on", action='store_true')
+arg_parser.add_argument('--variants', help="USS table: comma separated ANSi files (or images) to build from the same source as the input file, one member per variant. Each is assembled by a step of its own with its name in SYSPARM and linked in to a member of its own, the input file's is --member. Rows they have in common are written in the source once, every step still assembles them", metavar='FILES', default=None)
+arg_parser.add_argument('--dense', help="Pack the art's DC statements on to as few cards as possible using continuation cards, without comments. The assembler has far fewer statements to process and the object code is the same", action='store_true')
+arg_parser.add_argument('--shrink', help="Shrink the art (needs NumPy) so every COLS x ROWS cells become one block graphic in the most common colors, or auto to shrink wide art to 80 columns", metavar='COLS,ROWS', default=None)
+arg_parser.add_argument('--viewport', help="Row and column of the art to show in the top left corner of the screen, anything outside the 24x80 screen is left out", metavar='ROW,COL', default='1,1')
+arg_parser.add_argument('--pages', help="With --tso show art taller than the screen 24 rows at a time starting at --viewport, Enter and PF8 go to the next page and PF7 back", action='store_true')
+arg_parser.add_argument('--overlap', help="Rows each --pages page repeats from the one before", type=int, default=0)
+arg_parser.add_argument('--serve', help="Instead of generating JCL serve the screen to tn3270 clients on localhost, resending it whenever the ANSi file changes", action='store_true')
+arg_parser.add_argument('--port', help="TCP port used by --serve", type=int, default=3270)
+arg_parser.add_argument('--watch', help="Keep running and regenerate --file every time the ANSi file changes. Only the lines that changed are parsed again, the colors are still chosen from the whole screen", action='store_true')
+arg_parser.add_argument('--storm', help="Instead of generating JCL simulate this many tn3270 sessions logging on at once over loopback and report the cost of sending the screen", type=int, metavar='SESSIONS', default=0)
+arg_parser.add_argument('--bandwidth', help="Bytes per second of the link shared by all --storm sessions, 0 for unlimited", type=int, default=0)
+arg_parser.add_argument('--targets', help="Instead of one of --tso/--netsol/--sysgen/--usstable parse the ANSi once and write a JCL file for each of these comma separated targets: {} (file names are based on --file)".format(', '.join(target_types)), default=None)
+arg_parser.add_argument('--color-modes', help="Comma separated color modes (basic, extended) to generate for each of --targets, defaults to extended when --extended is used and basic otherwise", default=None)
+arg_parser.add_argument('--fuzz', help="Instead of generating JCL convert and verify this many random mutations of the ANSi file, then time pathological inputs to check conversion time grows linearly", type=int, metavar='ROUNDS', default=0)
+arg_parser.add_argument('--verify', help="Instead of generating JCL play the generated screen on an emulated 3270 and report every cell that differs from the ANSi, ansi_file can also be a directory of ANSi files to check", action='store_true')
+arg_parser.add_argument('--index', help="Instead of generating JCL add the SAUCE records and conversion stats (for the chosen target) of every ANSi file in ansi_file, which can be a directory or .zip archive, to this sqlite database. Only new and changed files are converted", metavar='DATABASE', default=None)
+arg_parser.add_argument('--where', help="With --index list the indexed ANSi files matching this SQL expression on the columns {}, e.g. \"rows <= 24 and bytes <= 1500 and rgb = 0\"".format(', '.join(name for name, kind in index_columns)), default=None)
+arg_parser.add_argument('--workers', help="Processes --index converts ANSi files with, defaults to one per CPU", type=int, default=0)
+arg_parser.add_argument('--render', help="Instead of generating JCL print the screen an emulated 3270 shows (or save it to --file)", choices=['ansi', 'html'], type=str.lower, default=None)
+arg_parser.add_argument('--costs', help="Instead of generating JCL show where the data stream's bytes go: the emulated screen with every cell colored by the bytes spent on it and a table of each row's bytes by cause (text, GE prefixes, SBA, SA, fields and the input field), or save it to --file", choices=['ansi', 'html'], type=str.lower, default=None)
+arg_parser.add_argument("ansi_file", help="Your ANSI art file you wish to convert, or a PBM/PGM/PPM image (needs NumPy)", default=False)
+action = arg_parser.add_mutually_exclusive_group()
 action.add_argument('--tso', action='store_true', help='Creates a TSO program you can use with "call"')
 action.add_argument('--netsol', action='store_true', help='Creates the JCL required to replace the TK4 VTAM screen')
 action.add_argument('--sysgen', action='store_true', help='Creates the JCL required to replace the SYSGEN VTAM screen')
 action.add_argument('--usstable', action='store_true', help='Creates the JCL to make a USSTABLE')
-args = arg_parser.parse_args()
-
-if args.tso and (not args.tk4 and not args.zos):
-    arg_parser.error("--tso requires either --tk4 or --zos")
-
-if len(args.member) > 8:
-    arg_parser.error("Member name: {} must not be longer than 8 characters".format(args.member))
-
-if len(args.jobname) > 8:
-    arg_parser.error("Jobname: {} must not be longer than 8 characters".format(args.jobname))
-
-if len(args.dataset) > 44:
-    arg_parser.error("Dataset max length is 44, supplied dataset: {}".format(args.dataset))
-
-if int(args.ROW) > 24:
-    arg_parser.error("Max screen height is 24, row supplied {}".format(args.ROW))
-
-if int(args.COL) > 80:
-    arg_parser.error("Max screen width is 80, coloumn supplied {}".format(args.COL))
-
-# Create the Logger
-logger = logging.getLogger(__name__)
-logger.setLevel(args.loglevel)
-logger_formatter = logging.Formatter('%(levelname)-8s :: %(funcName)-22s :: %(message)s')
-# Log everything to the log file
-ch = logging.StreamHandler()
-ch.setFormatter(logger_formatter)
-ch.setLevel(args.loglevel)
-# Add the Handler to the Logger
-logger.addHandler(ch)
-
-ANSITN3270(ansifile=args.ansi_file,
-          filename=args.file, dataset=args.dataset, member=args.member,
-          jobname=args.jobname, tk4=args.tk4, zos=args.zos,
-          row=args.ROW, column=args.COL,input=args.input, color=args.color,
-          tso=args.tso, netsol=args.netsol, sysgen=args.sysgen,
-          usstable=args.usstable, extended=args.extended)
-
-
-
-
-
 
 
+def main():
+    args = arg_parser.parse_args()
+
+    if not (args.tso or args.netsol or args.sysgen or args.usstable or args.targets):
+        arg_parser.error("one of the arguments --tso --netsol --sysgen --usstable --targets is required")
+
+    if args.targets:
+        if args.tso or args.netsol or args.sysgen or args.usstable:
+            arg_parser.error("--targets can not be used with --tso, --netsol, --sysgen or --usstable")
+        if args.serve or args.storm or args.watch or args.verify or args.render:
+            arg_parser.error("--targets can not be used with --serve, --storm, --watch, --verify or --render")
+        args.targets = args.targets.lower().split(',')
+        for target in args.targets:
+            if target not in target_types:
+                arg_parser.error("Unknown target: {} (choose from {})".format(target, ', '.join(target_types)))
+        if not args.color_modes:
+            args.color_modes = 'extended' if args.extended else 'basic'
+        args.color_modes = args.color_modes.lower().split(',')
+        for mode in args.color_modes:
+            if mode not in ('basic', 'extended'):
+                arg_parser.error("Unknown color mode: {} (choose from basic, extended)".format(mode))
+
+    if args.tso and (not args.tk4 and not args.zos):
+        arg_parser.error("--tso requires either --tk4 or --zos")
+
+    if os.path.isdir(args.ansi_file) and not (args.verify or args.index):
+        arg_parser.error("{} is a directory, only --verify and --index take a directory".format(args.ansi_file))
+
+    if args.where and not args.index:
+        arg_parser.error("--where requires --index")
+
+    if args.index and (args.targets or args.serve or args.storm or args.watch or args.verify or args.render or args.fuzz):
+        arg_parser.error("--index can not be used with --targets, --serve, --storm, --watch, --verify, --render or --fuzz")
+
+    try:
+        args.viewport = tuple(int(i) for i in args.viewport.split(','))
+        if len(args.viewport) != 2 or min(args.viewport) < 1:
+            raise ValueError
+    except ValueError:
+        arg_parser.error("--viewport must be ROW,COL, e.g. 25,1")
+
+    if args.shrink:
+        if np is None:
+            arg_parser.error("--shrink needs NumPy (pip install numpy)")
+        if args.shrink.lower() == 'auto':
+            args.shrink = 'auto'
+        else:
+            try:
+                args.shrink = tuple(int(i) for i in args.shrink.split(','))
+                if len(args.shrink) != 2 or min(args.shrink) < 1:
+                    raise ValueError
+            except ValueError:
+                arg_parser.error("--shrink must be COLS,ROWS or auto, e.g. 2,1")
+
+    if args.pages and not args.tso:
+        arg_parser.error("--pages requires --tso")
+
+    if args.max_bytes and (args.pages or args.targets):
+        arg_parser.error("--max-bytes can not be used with --pages or --targets")
+
+    if not 0 <= args.overlap < 24:
+        arg_parser.error("--overlap must be between 0 and 23")
+
+    if args.import_hlasm and (args.pages or args.shrink):
+        arg_parser.error("--import-hlasm can not be used with --pages or --shrink")
+
+    if args.write_messages and not (args.usstable or (args.targets and 'usstable' in args.targets)):
+        arg_parser.error("--write-messages requires --usstable")
+
+    if args.variants:
+        if not args.usstable:
+            arg_parser.error("--variants requires --usstable")
+        if args.object or args.max_bytes:
+            arg_parser.error("--variants can not be used with --object or --max-bytes")
+        if args.serve or args.storm or args.watch or args.verify or args.render or args.fuzz or args.index:
+            arg_parser.error("--variants can not be used with --serve, --storm, --watch, --verify, --render, --fuzz or --index")
+        args.variants = args.variants.split(',')
+        for variant in args.variants:
+            if not os.path.isfile(variant):
+                arg_parser.error("Variant {} is not a file".format(variant))
+            if np is None and os.path.splitext(variant)[1].lower() in image_extensions:
+                arg_parser.error("Images need NumPy (pip install numpy)")
+
+    if args.object:
+        if args.netsol or args.targets:
+            arg_parser.error("--object can not be used with --netsol (NETSOL fills in fields inside the screen) or --targets")
+        if args.serve or args.storm or args.watch or args.verify or args.render:
+            arg_parser.error("--object can not be used with --serve, --storm, --watch, --verify or --render")
+        args.binary = True
+
+    if args.binary and not (args.file or args.targets):
+        arg_parser.error("--binary requires --file")
+
+    if args.binary and (args.render or args.costs):
+        arg_parser.error("--binary can not be used with --render or --costs")
+
+    if args.costs and (args.pages or args.targets or args.object or args.variants or args.serve or args.storm or
+                       args.watch or args.verify or args.render or args.fuzz or args.index):
+        arg_parser.error("--costs can not be used with --pages, --targets, --object, --variants, --serve, --storm, "
+                         "--watch, --verify, --render, --fuzz or --index")
+
+    if args.watch and not args.file:
+        arg_parser.error("--watch requires --file")
+
+    if len(args.member) > 8:
+        arg_parser.error("Member name: {} must not be longer than 8 characters".format(args.member))
+
+    if len(args.jobname) > 8:
+        arg_parser.error("Jobname: {} must not be longer than 8 characters".format(args.jobname))
+
+    if len(args.dataset) > 44:
+        arg_parser.error("Dataset max length is 44, supplied dataset: {}".format(args.dataset))
+
+    if int(args.ROW) > 24:
+        arg_parser.error("Max screen height is 24, row supplied {}".format(args.ROW))
+
+    if int(args.COL) > 80:
+        arg_parser.error("Max screen width is 80, coloumn supplied {}".format(args.COL))
+
+    # Set up the logger
+    logger.setLevel(args.loglevel)
+    logger_formatter = logging.Formatter('%(levelname)-8s :: %(funcName)-22s :: %(message)s')
+    # Log everything to the log file
+    ch = logging.StreamHandler()
+    ch.setFormatter(logger_formatter)
+    ch.setLevel(args.loglevel)
+    # Add the Handler to the Logger
+    logger.addHandler(ch)
+
+    ansi_files = art_files(args.ansi_file)
+    if not ansi_files:
+        arg_parser.error("No ANSi files found in {}".format(args.ansi_file))
+    if np is None and os.path.splitext(ansi_files[0])[1].lower() in image_extensions:
+        arg_parser.error("Images need NumPy (pip install numpy)")
+
+    art = ANSITN3270(ansifile=ansi_files[0],
+              filename=args.file, dataset=args.dataset, member=args.member,
+              jobname=args.jobname, tk4=args.tk4, zos=args.zos,
+              row=args.ROW, column=args.COL,input=args.input, color=args.color,
+              tso=args.tso, netsol=args.netsol, sysgen=args.sysgen,
+              usstable=args.usstable, extended=args.extended,
+              color_method=args.color_method, input_codec=args.input_codec,
+              codepage=args.codepage, binary=args.binary, viewport=args.viewport,
+              paged=args.pages, overlap=args.overlap, object=args.object,
+              max_bytes=args.max_bytes, dense=args.dense, shrink=args.shrink,
+              write_messages=args.write_messages, import_hlasm=args.import_hlasm,
+              variants=args.variants or (),
+              generate=not (args.serve or args.storm or args.watch or args.targets or
+                            args.verify or args.render or args.costs or args.fuzz or args.index))
+
+    if not art.fits:
+        sys.exit(1)
+
+    if args.targets:
+        art.generate_targets(args.targets, [mode == 'extended' for mode in args.color_modes])
+    elif args.verify:
+        failed = 0
+        for ansi_file in ansi_files:
+            art.read_ansi(ansi_file)
+            try:
+                screen, differences = art.verify()
+            except Exception as e:
+                print("[!] {}: conversion failed: {!r}".format(ansi_file, e))
+                failed += 1
+                continue
+            report = art.parse_report()
+            if not differences:
+                print("[+] {}: OK{}".format(ansi_file, " ({})".format(report) if report else ''))
+                continue
+            failed += 1
+            print("[!] {}: {} cells differ".format(ansi_file, len(differences)))
+            for row, col, expected, got in differences[:10]:
+                print("    ({},{}) expected {} got {}".format(row, col, expected, got))
+        print("\n[+] {} of {} screens match".format(len(ansi_files) - failed, len(ansi_files)))
+        print("[+] {}".format(segment_cache_report()))
+        sys.exit(1 if failed else 0)
+    elif args.fuzz:
+        sys.exit(1 if fuzz(art, args.fuzz) else 0)
+    elif args.index:
+        start = time.perf_counter()
+        converted, unchanged, removed = index_library(art, args.ansi_file, args.index, args.workers)
+        print("[+] Indexed {} in {}: {} converted, {} unchanged, {} removed ({:.1f}s)".format(
+            args.ansi_file, args.index, converted, unchanged, removed, time.perf_counter() - start))
+        if args.where:
+            try:
+                matches = query_index(args.index, args.where)
+            except sqlite3.Error as e:
+                arg_parser.error("--where {}: {}".format(args.where, e))
+            print("\n[+] {} ANSi files where {}\n".format(len(matches), args.where))
+            for match in matches:
+                credit = " by ".join(filter(None, (match['title'], match['author'])))
+                print("    {:>6} bytes {:>4}x{:<4}{}{}".format(match['bytes'] if match['bytes'] is not None else '-',
+                                                             match['rows'] or 0, match['cols'] or 0, match['path'],
+                                                             "  ({})".format(credit) if credit else ''))
+    elif args.render:
+        screen, differences = art.verify()
+        rendered = screen.to_html() if args.render == 'html' else screen.to_ansi()
+        if args.file:
+            print("[+] Saving {} rendering to {}".format(args.render, args.file))
+            art.write_output(rendered)
+        else:
+            print(rendered)
+    elif args.costs:
+        report = cost_report(*art.byte_costs(), html=args.costs == 'html')
+        if args.file:
+            print("[+] Saving {} byte costs to {}".format(args.costs, args.file))
+            art.write_output(report)
+        else:
+            print(report)
+    elif args.watch:
+        print("[+] Watching {} (Ctrl-C to stop)".format(args.ansi_file))
+        try:
+            art.watch(args.ansi_file)
+        except KeyboardInterrupt:
+            print("\n[+] Stopped watching {}".format(args.ansi_file))
+    elif args.storm:
+        art.convert()
+        asyncio.run(logon_storm(art, args.ansi_file, args.storm, args.bandwidth))
+    elif args.serve:
+        art.convert()
+        try:
+            asyncio.run(TN3270Server(art, args.ansi_file, port=args.port).run())
+        except KeyboardInterrupt:
+            print("\n[+] TN3270 preview stopped")
 
 
+if __name__ == '__main__':
+    main()
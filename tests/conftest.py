@@ -0,0 +1,45 @@
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+import ansi2ebcdic  # noqa: E402
+
+# The sample corpus every target is checked against
+corpus_dir = os.path.join(root, 'art')
+corpus = sorted(os.path.join(corpus_dir, name) for name in os.listdir(corpus_dir))
+
+# ANSITN3270 keyword arguments for every target
+targets = {
+    'tso-tk4': dict(tso=True, tk4=True),
+    'tso-zos': dict(tso=True, tk4=False, zos=True),
+    'netsol': dict(tso=False, netsol=True),
+    'sysgen': dict(tso=False, sysgen=True),
+    'usstable': dict(tso=False, usstable=True),
+}
+
+
+def make(path, **kwargs):
+    # An ANSITN3270 for path that hasn't converted anything yet, without
+    # the banner it prints
+    with contextlib.redirect_stdout(io.StringIO()):
+        return ansi2ebcdic.ANSITN3270(path, generate=False, **kwargs)
+
+
+def art_path(name):
+    return os.path.join(corpus_dir, name)
+
+
+@pytest.fixture
+def write_art(tmp_path):
+    # Saves ANSi text (str, encoded as CP437) or bytes to a file, returning its path
+    def write(data, name='art.ans'):
+        path = tmp_path / name
+        path.write_bytes(data.encode('cp437') if isinstance(data, str) else data)
+        return str(path)
+    return write
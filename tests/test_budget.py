@@ -0,0 +1,59 @@
+# --max-bytes: degrading the art until the data stream fits
+import pytest
+
+import ansi2ebcdic
+from conftest import art_path, make
+
+
+def played(art):
+    screen = ansi2ebcdic.Screen3270()
+    screen.write(art.data_stream())
+    return screen
+
+
+@pytest.mark.parametrize('target', ['netsol', 'sysgen', 'usstable'])
+def test_budget_keeps_input_field(target):
+    art = make(art_path('big.ans'), tso=False, max_bytes=1660, **{target: True})
+    art.convert()
+    assert art.fits and art.reductions
+    assert len(art.data_stream()) <= 1660
+    assert art.cursor_orders
+    row, col = map(int, art.cursor['loc'])
+    field = (row - 1) * 80 + col - 1
+    screen = played(art)
+    assert not screen.fields[field][0] & 0x20
+    assert screen.cursor == field + 1
+
+
+def test_reductions_in_order():
+    art = make(art_path('big.ans'), tso=False, usstable=True, extended=True, max_bytes=3000)
+    art.convert()
+    assert art.fits
+    assert len(art.data_stream()) <= 3000
+    assert [reduction.split(' (')[0] for reduction in art.reductions][-1].startswith(('merged', 'dropped', 'replaced'))
+
+
+def test_crop_keeps_a_row():
+    # One row plus the input field and cursor is the smallest usable screen
+    art = make(art_path('big.ans'), tso=False, usstable=True, max_bytes=200)
+    art.convert()
+    assert art.fits
+    assert art.reductions[-1].startswith('cropped the screen to 1 rows')
+    assert art.cursor_orders
+    art = make(art_path('big.ans'), tso=False, usstable=True, max_bytes=120)
+    art.convert()
+    assert not art.fits
+
+
+def test_impossible_budget_writes_nothing(tmp_path):
+    output = tmp_path / 'out.jcl'
+    art = make(art_path('big.ans'), tso=False, usstable=True, max_bytes=10, filename=str(output))
+    art.generate_output()
+    assert not art.fits
+    assert not output.exists()
+
+
+def test_no_budget():
+    art = make(art_path('big.ans'), tso=False, usstable=True)
+    art.convert()
+    assert art.fits and art.reductions == []
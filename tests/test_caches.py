@@ -0,0 +1,42 @@
+# The LRU caches of converted segments
+import ansi2ebcdic
+from conftest import art_path, make
+
+
+def clear():
+    for cache in ansi2ebcdic.segment_caches:
+        cache.cache_clear()
+
+
+def convert(name, **options):
+    art = make(art_path(name), **options)
+    art.convert()
+    return art.hlasm, art.data_stream()
+
+
+def test_cached_conversion_is_the_same():
+    clear()
+    first = convert('big.ans')
+    misses = sum(cache.cache_info().misses for cache in ansi2ebcdic.segment_caches)
+    assert convert('big.ans') == first
+    assert sum(cache.cache_info().misses for cache in ansi2ebcdic.segment_caches) == misses
+    assert sum(cache.cache_info().hits for cache in ansi2ebcdic.segment_caches) > 0
+
+
+def test_code_pages_are_cached_apart():
+    clear()
+    assert ansi2ebcdic.segment_codes('[]', 'cp437', '037') != ansi2ebcdic.segment_codes('[]', 'cp437', '1047')
+    assert convert('simple.ans', codepage='1047') != convert('simple.ans')
+
+
+def test_cached_lines_are_tuples():
+    assert isinstance(ansi2ebcdic.text_lines('HELLO'), tuple)
+    assert isinstance(ansi2ebcdic.graphic_lines(b'\x08\xad'), tuple)
+
+
+def test_report():
+    clear()
+    assert ansi2ebcdic.segment_cache_report() == 'Segment cache: 0 hits, 0 misses (0.0% hit rate)'
+    ansi2ebcdic.text_lines('HELLO')
+    ansi2ebcdic.text_lines('HELLO')
+    assert ansi2ebcdic.segment_cache_report() == 'Segment cache: 1 hits, 1 misses (50.0% hit rate)'
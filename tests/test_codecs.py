@@ -0,0 +1,52 @@
+# --input-codec: input code pages and their decode tables
+import pytest
+
+import ansi2ebcdic
+from conftest import make
+
+art = '\x1b[1;34m█▓▒░ ANSI ▀▄\x1b[0m café\n'
+
+
+@pytest.mark.parametrize('font, codec', [
+    ('IBM VGA', 'cp437'), ('IBM VGA 437', 'cp437'), ('IBM VGA 819', 'iso-8859-1'),
+    ('Amiga Topaz 2+', 'amiga'), ('IBM VGA 850', None), ('C64 PETSCII', None),
+])
+def test_sauce_codec(font, codec):
+    assert ansi2ebcdic.sauce_codec(font) == codec
+
+
+def test_single_byte_tables_are_compiled():
+    codec = ansi2ebcdic.input_codec('cp437', '037')
+    assert len(codec) == 256
+    assert codec['█'][1] and not codec['A'][1]
+    assert ansi2ebcdic.input_codec('cp437', '037') is codec
+
+
+@pytest.mark.parametrize('encoding, expected', [('cp437', 'cp437'), ('utf-8', 'utf-8')])
+def test_detect_codec(write_art, encoding, expected):
+    converted = make(write_art(art.encode(encoding)))
+    assert converted.codec.name == expected
+    assert converted.ansi == art
+
+
+def test_plain_ascii_is_cp437(write_art):
+    assert make(write_art(b'HELLO\n')).codec.name == 'cp437'
+
+
+def test_same_screen_from_every_encoding(write_art):
+    streams = []
+    for encoding in ('cp437', 'utf-8'):
+        converted = make(write_art(art.encode(encoding), encoding + '.ans'))
+        converted.convert()
+        streams.append(converted.data_stream())
+    assert streams[0] == streams[1]
+
+
+def test_amiga_csi(write_art):
+    converted = make(write_art(b'\x9b1;31mRED\xa0TEXT\n'), input_codec='amiga')
+    assert converted.ansi == '\x1b[1;31mRED TEXT\n'
+
+
+def test_forced_codec(write_art):
+    converted = make(write_art('café\n'.encode('latin-1')), input_codec='iso-8859-1')
+    assert converted.ansi == 'café\n'
@@ -0,0 +1,57 @@
+# --codepage and --binary: EBCDIC target code pages and FB80 records
+import pytest
+
+import ansi2ebcdic
+from conftest import art_path, make
+
+# Characters CP1047 has somewhere else than CP037
+moved = {'[': (0xBA, 0xAD), ']': (0xBB, 0xBD), '^': (0xB0, 0x5F), '¬': (0x5F, 0xB0),
+         'Ý': (0xAD, 0xBA), '¨': (0xBD, 0xBB), '\n': (0x25, 0x15), '\x85': (0x15, 0x25)}
+
+
+@pytest.mark.parametrize('char', sorted(moved))
+def test_1047(char):
+    cp037, cp1047 = moved[char]
+    assert ansi2ebcdic.to_ebcdic(char, '037') == bytes([cp037])
+    assert ansi2ebcdic.to_ebcdic(char, '1047') == bytes([cp1047])
+
+
+def test_1047_matches_037_elsewhere():
+    others = ''.join(chr(code) for code in range(256) if chr(code) not in moved)
+    assert ansi2ebcdic.to_ebcdic(others, '1047') == ansi2ebcdic.to_ebcdic(others, '037')
+
+
+@pytest.mark.parametrize('codepage', sorted(ansi2ebcdic.ebcdic_codepages))
+def test_round_trip(codepage):
+    text = ''.join(map(chr, range(256)))
+    assert sorted(ansi2ebcdic.ebcdic_codepages[codepage]) == list(range(256))
+    assert ansi2ebcdic.from_ebcdic(ansi2ebcdic.to_ebcdic(text, codepage), codepage) == text
+
+
+def test_records():
+    records = ansi2ebcdic.ebcdic_records('//JOB\n' + 'X' * 90 + '\n', '1047')
+    assert len(records) == 160
+    assert ansi2ebcdic.from_ebcdic(records, '1047') == '//JOB'.ljust(80) + 'X' * 80
+
+
+@pytest.mark.parametrize('codepage', ['037', '1047'])
+def test_binary_output(tmp_path, codepage):
+    text, binary = str(tmp_path / 'art.jcl'), str(tmp_path / 'art.bin')
+    make(art_path('simple.ans'), filename=text, codepage=codepage).generate_output()
+    make(art_path('simple.ans'), filename=binary, codepage=codepage, binary=True).generate_output()
+    records = open(binary, 'rb').read()
+    assert len(records) % 80 == 0
+    lines = open(text).read().splitlines()
+    assert ansi2ebcdic.from_ebcdic(records, codepage) == ''.join(line.ljust(80) for line in lines)
+
+
+def test_codepage_in_the_stream(write_art):
+    streams = {}
+    for codepage in ('037', '1047'):
+        art = make(write_art('[ARRAY]\n'), codepage=codepage)
+        art.convert()
+        streams[codepage] = art.data_stream()
+        screen = ansi2ebcdic.Screen3270(codepage=codepage)
+        screen.write(streams[codepage])
+        assert ''.join(look[0] for look in screen.looks()[:7]) == '[ARRAY]'
+    assert streams['037'] != streams['1047']
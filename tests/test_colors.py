@@ -0,0 +1,76 @@
+# Choosing between SA and SFE coloring from the finished screen
+import os
+
+import pytest
+
+import ansi2ebcdic
+from conftest import art_path, corpus, make, targets
+
+
+def finished_screen(art):
+    art.reset_parser()
+    return art.ansi_screen(art.tokenize(art.ansi))
+
+
+@pytest.mark.parametrize('path', [path for path in corpus if path.endswith('.ans')], ids=os.path.basename)
+def test_smallest_method_wins(path):
+    art = make(path, tso=False, usstable=True)
+    screen = finished_screen(art)
+    sa = ansi2ebcdic.optimize(art.field_colors(*screen, fields=False))
+    sfe = art.field_colors(*screen)
+    chosen = art.screen_orders(screen)
+    sizes = [len(ansi2ebcdic.bytes_backend(sa))]
+    if sfe is not None:
+        sizes.append(len(ansi2ebcdic.bytes_backend(ansi2ebcdic.optimize(sfe))))
+    assert len(ansi2ebcdic.bytes_backend(chosen)) == min(sizes)
+
+
+@pytest.mark.parametrize('method', ['sa', 'sfe'])
+def test_forced_method_round_trips(method):
+    art = make(art_path('simple.ans'), tso=False, usstable=True, color_method=method)
+    screen, differences = art.verify()
+    assert differences == []
+    ops = {order.op for order in art.orders}
+    assert ('SFE' in ops) == (method == 'sfe')
+
+
+def test_position_comments():
+    # Orders drawn from the finished screen keep the state machine's
+    # "* (row,col) colors" comments
+    art = make(art_path('simple.ans'), tso=False, usstable=True, color_method='sa')
+    art.convert()
+    assert "* (1,1) (FG) Turquoise (HL) Intensify\n         DC    X'2842F52841F8'\n" in art.hlasm
+    assert "* (1,36) (FG) Red\n" in art.hlasm
+
+
+@pytest.mark.skipif(ansi2ebcdic.np is None, reason='needs NumPy')
+@pytest.mark.parametrize('target', targets)
+@pytest.mark.parametrize('path', [path for path in corpus if path.endswith('.ans')], ids=os.path.basename)
+def test_vectorized_runs_match(path, target):
+    art = make(path, **targets[target])
+    screen = finished_screen(art)
+    vectorized = art.lower(ansi2ebcdic.optimize(art.sa_runs(*screen)))
+    assert vectorized == art.lower(ansi2ebcdic.optimize(art.field_colors(*screen, fields=False)))
+
+
+def test_convert_rows_reuses_lines(write_art):
+    lines = ['\x1b[1;3{}mline {}\r\n'.format(i % 8, i) for i in range(20)]
+    path = write_art(''.join(lines))
+    art = make(path, tso=False, usstable=True)
+    assert art.convert_rows() == len(art.rows) == 21
+    rows_hlasm = art.hlasm
+    art.convert()
+    assert rows_hlasm == art.hlasm
+
+    # Nothing changed: nothing is converted or redrawn
+    assert art.convert_rows() == 0
+    assert art.hlasm == rows_hlasm and art.cursor_orders
+
+    lines[5] = '\x1b[1;35mLINE 5\r\n'
+    with open(path, 'wb') as f:
+        f.write(''.join(lines).encode('cp437'))
+    art.read_ansi(path)
+    assert art.convert_rows() == 1
+    changed = art.hlasm
+    art.convert()
+    assert changed == art.hlasm
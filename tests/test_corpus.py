@@ -0,0 +1,30 @@
+# Converts every file of the sample corpus for every target and color mode
+# and plays the generated data stream on the emulated 3270
+import os
+
+import pytest
+
+from conftest import corpus, make, targets
+
+
+@pytest.mark.parametrize('extended', [False, True], ids=['basic', 'extended'])
+@pytest.mark.parametrize('target', targets)
+@pytest.mark.parametrize('path', corpus, ids=os.path.basename)
+def test_round_trip(path, target, extended):
+    art = make(path, extended=extended, **targets[target])
+    screen, differences = art.verify()
+    assert differences == []
+
+
+@pytest.mark.parametrize('target', targets)
+def test_input_field(target):
+    # Every target but TSO ends with the unprotected input field, its
+    # attribute at --ROW,--COL and the cursor right after it
+    art = make(corpus[0], **targets[target])
+    screen, differences = art.verify()
+    if target.startswith('tso'):
+        return
+    row, col = map(int, art.cursor['loc'])
+    field = (row - 1) * 80 + col - 1
+    assert not screen.fields[field][0] & 0x20
+    assert screen.cursor == field + 1
@@ -0,0 +1,48 @@
+# --costs: where the bytes of the data stream go
+import re
+
+import pytest
+
+import ansi2ebcdic
+from ansi2ebcdic import Order
+from conftest import art_path, make, targets
+
+# The command, WCC and what each target adds around the art
+frames = {'tso-tk4': 7, 'tso-zos': 7, 'netsol': 10, 'sysgen': 10, 'usstable': 2}
+
+
+@pytest.mark.parametrize('target', sorted(targets))
+def test_costs_add_up(target):
+    art = make(art_path('big.ans'), **targets[target])
+    screen, costs, frame = art.byte_costs()
+    assert frame == frames[target]
+    assert sum(size for address, cause, size in costs) + frame == len(art.data_stream())
+    assert {cause for address, cause, size in costs} <= set(ansi2ebcdic.cost_causes)
+    assert any(cause == 'cursor' for address, cause, size in costs) == (target in ('netsol', 'sysgen', 'usstable'))
+
+
+def test_order_costs():
+    costs = []
+    ansi2ebcdic.bytes_backend([Order('SBA', address=81), Order('SA', type=0x42, value=0xF2), Order('TEXT', data='AB'),
+                               Order('GE', data=b'\x08\xad\xc1'), Order('RA', address=100, data=b'\x08\xad'),
+                               Order('SF', value=0x30)], costs=costs)
+    assert costs == [(81, 'sba', 3), (81, 'sa', 3), (81, 'text', 1), (82, 'text', 1), (83, 'text', 1), (83, 'ge', 1),
+                     (84, 'text', 1), (85, 'text', 4), (85, 'ge', 1), (100, 'field', 2)]
+
+
+def test_report_rows(write_art):
+    art = make(write_art('\x1b[31mRED\n\n\x1b[44mBLUE<&>\n'), tso=False, usstable=True)
+    screen, costs, frame = art.byte_costs()
+    report = ansi2ebcdic.cost_report(screen, costs, frame)
+    rows = {int(line[:3]): [int(value) for value in line[5:].split()]
+            for line in report.splitlines() if re.match(r' {0,2}\d+  ', line)}
+    assert len(rows) == 24 and rows[2] == [0] * 7
+    assert rows[1][0] == 3 and rows[3][0] == 7
+    total = [int(value) for value in next(line for line in report.splitlines() if line.startswith('All'))[3:].split()]
+    assert total == [sum(row[i] for row in rows.values()) for i in range(7)]
+    assert 'Data stream: {} bytes, {} of them'.format(len(art.data_stream()), frame) in report
+
+    html = ansi2ebcdic.cost_report(screen, costs, frame, html=True)
+    assert html.startswith('<pre')
+    text = re.sub(r'<[^>]*>', '', html)
+    assert '&lt;&amp;&gt;' in text and '<&>' not in text
@@ -0,0 +1,48 @@
+# --dense: DC operands packed on full cards with continuations
+import pytest
+
+import ansi2ebcdic
+from conftest import art_path, corpus, make
+
+
+def orders(path):
+    art = make(path, tso=False, usstable=True)
+    art.convert()
+    return art.orders
+
+
+@pytest.mark.parametrize('continuations', [2, 9])
+@pytest.mark.parametrize('path', [path for path in corpus if path.endswith('.ans')])
+def test_dense_assembles_to_the_same_bytes(path, continuations):
+    art = orders(path)
+    dense = ansi2ebcdic.dense_backend(art, continuations)
+    assert ansi2ebcdic.assemble_hlasm(dense) == ansi2ebcdic.bytes_backend(art)
+    assert dense.count('\n') <= ansi2ebcdic.zos_backend(art).count('\n')
+
+
+@pytest.mark.parametrize('continuations', [2, 9])
+def test_card_layout(continuations):
+    dense = ansi2ebcdic.dense_backend(orders(art_path('big.ans')), continuations)
+    run = 0
+    for card in dense.splitlines():
+        assert len(card) <= 72
+        assert not card.startswith('*')
+        if run:
+            assert card[:15] == ' ' * 15 and card[15] != ' '
+        else:
+            assert card.startswith('         DC    ')
+        if len(card) == 72:
+            assert card[71] == 'X' and card[:71].rstrip().endswith(',')
+            run += 1
+            assert run <= continuations
+        else:
+            run = 0
+
+
+def test_dense_job(tmp_path):
+    streams = []
+    for dense in (False, True):
+        output = str(tmp_path / 'art{}.jcl'.format(dense))
+        make(art_path('big.ans'), filename=output, dense=dense).generate_output()
+        streams.append(ansi2ebcdic.hlasm_stream(open(output).read()))
+    assert streams[0] == streams[1]
@@ -0,0 +1,48 @@
+# ESC[J and ESC[K: RA orders instead of painted blanks
+import pytest
+
+import ansi2ebcdic
+from conftest import make
+
+
+@pytest.mark.parametrize('x, y, etype, mode, expected', [
+    (3, 5, 'K', '', (164, 239)),
+    (3, 5, 'K', '1', (160, 164)),
+    (3, 5, 'K', '2', (160, 239)),
+    (3, 5, 'J', '0', (164, 1919)),
+    (3, 5, 'J', '1', (0, 164)),
+    (3, 5, 'J', '2', (0, 1919)),
+])
+def test_erase_range(x, y, etype, mode, expected):
+    assert ansi2ebcdic.erase_range(x, y, etype, mode) == expected
+
+
+def state_machine(write_art, ansi):
+    art = make(write_art(ansi), tso=False, usstable=True)
+    art.reset()
+    art.ansi_state_machine(art.ansi)
+    return art
+
+
+def test_erase_line_is_one_ra(write_art):
+    art = state_machine(write_art, 'HELLO WORLD\n\x1b[1;7H\x1b[K')
+    ras = [order for order in art.orders if order.op == 'RA']
+    assert len(ras) == 1
+    assert (ras[0].address, ras[0].data) == (11, b'\x40')
+
+
+def test_empty_cells_are_skipped(write_art):
+    art = state_machine(write_art, '\x1b[2JHELLO\x1b[K\x1b[2;1H\x1b[0J')
+    assert not [order for order in art.orders if order.op == 'RA']
+
+
+def test_erase_round_trips(write_art):
+    ansi = ('\x1b[44m' + 'X' * 80 * 4 + '\x1b[0m\x1b[2;10H\x1b[K\x1b[3;40H\x1b[1K'
+            '\x1b[4;1H\x1b[45m\x1b[2K\x1b[0m\x1b[6;1HDONE')
+    art = make(write_art(ansi), tso=False, usstable=True, color_method='sa')
+    screen, differences = art.verify()
+    assert differences == []
+    looks = screen.looks()
+    assert looks[80 + 8][0] == 'X' and looks[80 + 9][0] == ' '
+    assert looks[160 + 40][0] == 'X' and looks[160 + 39][0] == ' '
+    assert looks[240][2] == 0xF3
@@ -0,0 +1,77 @@
+# The bounded CSI parser and --fuzz
+import pytest
+
+import ansi2ebcdic
+from conftest import art_path, make
+
+
+@pytest.fixture
+def parser(write_art):
+    art = make(write_art('\n'))
+    art.reset_parser()
+    return art
+
+
+def escapes(tokens):
+    return [token[1:] for token in tokens if token[0] == 'escape']
+
+
+def text(tokens):
+    return ''.join(token[1] for token in tokens if token[0] == 'text')
+
+
+@pytest.mark.parametrize('ansi, expected', [
+    ('\x1b[1;31mA', [('[1;31', 'm')]),
+    ('\x1b[01;031mA', [('[1;31', 'm')]),
+    ('\x1b[;5HA', [('[;5', 'H')]),
+    ('\x1b[10;20fA', [('[10;20', 'H')]),
+    ('\x1b[2;7JA', [('[2', 'J')]),
+    ('\x1b[K\x1b[0KA', [('[', 'K'), ('[0', 'K')]),
+])
+def test_control_sequences(parser, ansi, expected):
+    tokens = parser.tokenize(ansi + '\n')
+    assert escapes(tokens) == expected
+    assert text(tokens) == 'A'
+    assert parser.parse_stats['escapes'] == len(expected)
+
+
+@pytest.mark.parametrize('ansi, stat', [
+    ('\x1b[?7hA', 'ignored'),
+    ('\x1b(BA', 'ignored'),
+    ('\x1b7A', 'ignored'),
+    ('\x1b[1;31zA', 'ignored'),
+    ('\x1b[' + '1' * 100 + 'mA', 'overlong'),
+])
+def test_left_out(parser, ansi, stat):
+    tokens = parser.tokenize(ansi + '\n')
+    assert escapes(tokens) == []
+    assert text(tokens) == 'A'
+    assert parser.parse_stats[stat] == 1
+
+
+def test_broken_sequence_keeps_the_text(parser):
+    tokens = parser.tokenize('\x1b[1;3\x01AB\x1b\x02C\n')
+    assert escapes(tokens) == []
+    assert parser.parse_stats['malformed'] == 2
+    assert text(tokens) == '\x01AB\x02C'
+
+
+def test_sequence_split_across_calls(parser):
+    assert parser.tokenize('AB\x1b[1;') == [('text', 'AB', False)]
+    tokens = parser.tokenize('31mC\n')
+    assert escapes(tokens) == [('[1;31', 'm')]
+
+
+def test_unterminated_sequence_stays_bounded(parser):
+    parser.tokenize('\x1b[' + '1;' * 50000)
+    assert len(parser.escape_sequence) <= ansi2ebcdic.max_escape + 1
+
+
+def test_fuzz(capsys):
+    art = make(art_path('simple.ans'), tso=False, usstable=True)
+    original = art.ansi
+    assert ansi2ebcdic.fuzz(art, 10) == 0
+    report = capsys.readouterr().out
+    assert 'Failed:\t\t0' in report
+    # The art is put back afterwards
+    assert art.ansi == original
@@ -0,0 +1,57 @@
+# PBM/PGM/PPM images as 3270 block art
+import pytest
+
+import ansi2ebcdic
+from conftest import art_path, make
+
+np = pytest.importorskip('numpy')
+
+# A 3x2 image: red, green, blue / white, black, grey
+rgb = [[(255, 0, 0), (0, 255, 0), (0, 0, 255)], [(255, 255, 255), (0, 0, 0), (128, 128, 128)]]
+
+
+@pytest.mark.parametrize('data', [
+    b'P3\n# comment\n3 2\n255\n' + b' '.join(str(value).encode() for row in rgb for pixel in row for value in pixel),
+    b'P6\n3 2\n255\n' + bytes(value for row in rgb for pixel in row for value in pixel),
+    b'P6 3 2 65535\n' + b''.join((value * 257).to_bytes(2, 'big') for row in rgb for pixel in row for value in pixel),
+])
+def test_color_images(data):
+    assert read(data) == rgb
+
+
+def read(data):
+    return [[tuple(pixel) for pixel in row] for row in ansi2ebcdic.read_pnm(data).tolist()]
+
+
+def test_gray_and_bitmaps():
+    gray = [[(0, 0, 0), (255, 255, 255)]]
+    assert read(b'P2 2 1 15\n0 15') == gray
+    assert read(b'P5 2 1 255\n\x00\xff') == gray
+    # 1 is black, plain bits need no whitespace, raw rows are padded
+    assert read(b'P1\n2 1\n10') == gray
+    assert read(b'P4\n2 1\n\x80') == gray
+
+
+@pytest.mark.parametrize('data', [b'GIF89a', b'P7 1 1', b'P3 0 1 255\n', b'P6 2 2 255\n\x00\x00\x00', b'P2 2 x'])
+def test_bad_images(data):
+    with pytest.raises(ValueError):
+        ansi2ebcdic.read_pnm(data)
+
+
+def test_image_grid():
+    pixels = ansi2ebcdic.read_pnm(b'P3 2 3 255\n255 0 0  0 0 0  255 0 0  0 0 255  250 240 10  250 240 10')
+    chars, fg, bg, hl, written = ansi2ebcdic.image_grid(pixels)
+    assert chars.shape == (2, 2) and written.all()
+    assert [chr(char) for char in chars.reshape(-1)] == ['█', '▄', '▀', '▀']
+    assert fg.tolist() == [[0xF2, 0xF1], [0xF6, 0xF6]]
+    assert bg.tolist() == [[0, 0], [0, 0]]
+
+
+@pytest.mark.parametrize('name', ['logo.pbm', 'logo16.pgm', 'logo.ppm'])
+@pytest.mark.parametrize('extended', [False, True])
+def test_image_files(name, extended):
+    art = make(art_path(name), tso=False, usstable=True, extended=extended)
+    screen, differences = art.verify()
+    assert differences == []
+    assert art.image is not None
+    assert set(''.join(look[0] for look in screen.looks()[:80 * 20])) <= set(' █▀▄')
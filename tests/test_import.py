@@ -0,0 +1,54 @@
+# --import-hlasm: generating existing HLASM screens again
+import pytest
+
+import ansi2ebcdic
+from conftest import art_path, make, targets
+
+
+def looks(stream):
+    screen = ansi2ebcdic.Screen3270()
+    screen.write(stream)
+    return screen.looks()
+
+
+@pytest.mark.parametrize('target', sorted(targets))
+def test_generated_job_round_trips(tmp_path, target):
+    job = str(tmp_path / 'old.jcl')
+    old = make(art_path('big.ans'), filename=job, row='12', column='30', **targets[target])
+    old.generate_output()
+    old_stream = ansi2ebcdic.hlasm_stream(open(job).read())
+
+    new = make(job, import_hlasm=True, **targets[target])
+    new.convert()
+    assert new.imported[0].looks() == looks(old_stream)
+    assert looks(new.data_stream()) == looks(old.data_stream())
+    assert len(new.data_stream()) <= new.imported[1]
+    if target.startswith('tso'):
+        assert new.cursor['loc'] == ('23', '20')
+    else:
+        assert new.cursor['loc'] == ('12', '30')
+        assert int(new.cursor['spaces']) == 20
+
+
+def test_hand_written_macros(write_art):
+    hlasm = '\n'.join([
+        'SCREEN   $WCC  (RESETKBD)',
+        '         $SBA  (1,1)',
+        "         DC    X'2842F2'",
+        "         DC    C'HELLO'",
+        '         $SBA  (10,5)',
+        '         $SF   (UNPROT,HI)',
+        '         $IC',
+        '         $SBA  (10,16)',
+        '         $SF   (SKIP)',
+    ]) + '\n'
+    art = make(write_art(hlasm, 'screen.asm'), tso=False, netsol=True, import_hlasm=True)
+    screen = art.imported[0]
+    assert ''.join(look[0] for look in screen.looks()[:5]) == 'HELLO'
+    assert screen.looks()[0][1] == 0xF2
+    assert art.cursor['loc'] == ('10', '5') and art.cursor['spaces'] == '10'
+
+
+def test_no_screen(write_art):
+    with pytest.raises(ValueError):
+        make(write_art('* NOTHING HERE\n         END\n', 'empty.asm'), tso=False, usstable=True, import_hlasm=True)
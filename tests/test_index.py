@@ -0,0 +1,57 @@
+# --index: the sqlite catalogue of an art library
+import os
+import shutil
+import zipfile
+
+import pytest
+
+import ansi2ebcdic
+from conftest import art_path, make
+
+
+@pytest.fixture
+def library(tmp_path):
+    root = tmp_path / 'library'
+    (root / 'group').mkdir(parents=True)
+    for name in ('simple.ans', 'rows.ans'):
+        shutil.copy(art_path(name), str(root / name))
+    shutil.copy(art_path('big.ans'), str(root / 'group' / 'big.ans'))
+    with zipfile.ZipFile(str(root / 'pack.zip'), 'w') as pack:
+        pack.write(art_path('repeats.ans'), 'repeats.ans')
+        pack.writestr('logo.gif', 'not art')
+    return str(root)
+
+
+def index(library, tmp_path, workers=1):
+    art = make(art_path('simple.ans'), tso=False, usstable=True)
+    return art, ansi2ebcdic.index_library(art, library, str(tmp_path / 'art.db'), workers)
+
+
+def test_art_files(library):
+    files = [os.path.relpath(path, library) for path in ansi2ebcdic.art_files(library)]
+    assert files == [os.path.join('pack.zip', 'repeats.ans'), 'rows.ans', 'simple.ans', os.path.join('group', 'big.ans')]
+    assert ansi2ebcdic.read_art(os.path.join(library, 'pack.zip', 'repeats.ans')) == open(art_path('repeats.ans'), 'rb').read()
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_index_and_query(library, tmp_path, workers):
+    art, counts = index(library, tmp_path, workers)
+    assert counts == (4, 0, 0)
+    rows = {os.path.relpath(row['path'], library): row for row in ansi2ebcdic.query_index(str(tmp_path / 'art.db'), '1')}
+    assert sorted(rows) == sorted(os.path.relpath(path, library) for path in ansi2ebcdic.art_files(library))
+    single = make(art_path('big.ans'), tso=False, usstable=True)
+    single.convert()
+    assert rows[os.path.join('group', 'big.ans')]['bytes'] == len(single.data_stream())
+    assert all(row['error'] is None for row in rows.values())
+    # Smallest screens first
+    found = ansi2ebcdic.query_index(str(tmp_path / 'art.db'), 'bytes > 0')
+    assert [row['bytes'] for row in found] == sorted(row['bytes'] for row in found)
+
+
+def test_rescan_converts_only_changes(library, tmp_path):
+    index(library, tmp_path)
+    assert index(library, tmp_path)[1] == (0, 4, 0)
+    with open(os.path.join(library, 'rows.ans'), 'ab') as f:
+        f.write(b'\x1b[31mMORE\r\n')
+    os.remove(os.path.join(library, 'simple.ans'))
+    assert index(library, tmp_path)[1] == (1, 2, 1)
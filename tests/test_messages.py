@@ -0,0 +1,48 @@
+# --write-messages: MSG 10 with the art, the other messages written over it
+import pytest
+
+import ansi2ebcdic
+from conftest import art_path, make
+
+
+def messages(row):
+    art = make(art_path('big.ans'), tso=False, usstable=True, write_messages=True, row=row, column='20')
+    art.convert()
+    screen = ansi2ebcdic.Screen3270()
+    screen.write(art.data_stream())
+    return art, screen
+
+
+def line(screen, row):
+    return ''.join(char for r, col, char, fg, bg, hl in screen.display() if r == row)
+
+
+@pytest.mark.parametrize('row, message_row', [('12', 13), ('23', 24), ('24', 23)])
+def test_message_row(row, message_row):
+    art, screen = messages(row)
+    assert line(screen, message_row)[19:] == ' ' * 61
+    before = screen.looks()
+    screen.write(art.message_stream('LOGON FAILED'))
+    assert line(screen, message_row)[19:] == 'LOGON FAILED'.ljust(61)
+    # Nothing else changes and the input field is ready again
+    after = screen.looks()
+    start = (message_row - 1) * 80 + 19
+    changed = [address for address in range(1920) if before[address] != after[address]]
+    assert changed == [start + offset for offset, char in enumerate('LOGON FAILED') if char != ' ']
+    assert screen.cursor == (int(row) - 1) * 80 + 20
+
+
+def test_message_cut_to_the_line():
+    art, screen = messages('23')
+    stream = art.message_stream('X' * 100)
+    assert stream[:2] == bytes.fromhex('F1C3')
+    screen.write(stream)
+    assert line(screen, 24)[19:] == 'X' * 61
+    assert len(stream) == len(art.message_stream())
+
+
+def test_round_trip():
+    art = make(art_path('big.ans'), tso=False, usstable=True, write_messages=True)
+    art.convert()
+    screen, differences = art.verify()
+    assert differences == []
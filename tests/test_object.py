@@ -0,0 +1,113 @@
+# --object: the object deck the linkage editor reads instead of HLASM
+import pytest
+
+import ansi2ebcdic
+from conftest import art_path, make
+
+ebcdic = ansi2ebcdic.to_ebcdic
+
+
+def cards(deck):
+    assert len(deck) % 80 == 0
+    return [deck[i:i + 80] for i in range(0, len(deck), 80)]
+
+
+def test_card_layout():
+    data = bytes(range(130))
+    labels = [('LABEL{}'.format(n), 8 * n) for n in range(4)]
+    relocations = list(range(0, 64, 4))
+    deck = cards(ansi2ebcdic.object_deck('ART', data, labels, relocations))
+    kinds = [ansi2ebcdic.from_ebcdic(card[1:4]) for card in deck]
+    assert kinds == ['ESD', 'ESD', 'TXT', 'TXT', 'TXT', 'RLD', 'RLD', 'RLD', 'END']
+    for number, card in enumerate(deck, 1):
+        assert card[0] == 0x02
+        assert card[72:80] == ebcdic('A2E{:05d}'.format(number))
+
+    # The SD and up to three items per ESD card, only the first has the ESDID
+    first, second = deck[0], deck[1]
+    assert first[10:12] == (48).to_bytes(2, 'big') and first[14:16] == (1).to_bytes(2, 'big')
+    assert first[16:32] == ebcdic('ART     ') + b'\x00\x00\x00\x00\x00' + len(data).to_bytes(3, 'big')
+    assert first[32:48] == ebcdic('LABEL0  ') + b'\x01\x00\x00\x00\x40\x00\x00\x01'
+    assert second[10:12] == (32).to_bytes(2, 'big') and second[14:16] == ebcdic('  ')
+    assert second[32:40] == ebcdic('LABEL3  ') and second[40:44] == b'\x01\x00\x00\x18'
+
+    # TXT cards carry 56 bytes each at their offset
+    text = b''
+    for card in deck[2:5]:
+        offset, count = int.from_bytes(card[5:8], 'big'), int.from_bytes(card[10:12], 'big')
+        assert offset == len(text) and card[14:16] == (1).to_bytes(2, 'big')
+        text += card[16:16 + count]
+    assert text == data
+
+    # Seven 8 byte RLD entries per card
+    entries = b''.join(card[16:16 + int.from_bytes(card[10:12], 'big')] for card in deck[5:8])
+    assert [entries[i:i + 8] for i in range(0, len(entries), 8)] == [
+        b'\x00\x01\x00\x01\x0c' + offset.to_bytes(3, 'big') for offset in relocations]
+
+
+@pytest.mark.parametrize('options', [dict(tso=True), dict(tso=False, usstable=True), dict(tso=False, sysgen=True)])
+def test_deck_in_the_job(tmp_path, options):
+    output = str(tmp_path / 'art.jcl')
+    art = make(art_path('simple.ans'), filename=output, object=True, **options)
+    art.generate_output()
+    records = cards(open(output, 'rb').read())
+    deck = [number for number, record in enumerate(records) if record[0] == 0x02]
+    assert deck == list(range(deck[0], deck[-1] + 1))
+    assert records[deck[0]][1:4] == ebcdic('ESD') and records[deck[-1]][1:4] == ebcdic('END')
+    text = b''.join(record[16:16 + int.from_bytes(record[10:12], 'big')]
+                    for record in records if record[:4] == b'\x02' + ebcdic('TXT'))
+    stream = art.data_stream()
+    assert (stream[1:] if options.get('sysgen') else stream) in text
+
+
+def test_streamed_deck():
+    chunks = [bytes([n]) * size for n, size in enumerate((30, 100, 0, 56, 7))]
+    taken = []
+
+    def stream():
+        for chunk in chunks:
+            taken.append(chunk)
+            yield chunk
+
+    deck = ansi2ebcdic.object_stream('DATA', stream())
+    assert cards(next(deck))[0][16:32] == ebcdic('DATA    ') + bytes(8)
+    # A chunk's whole TXT cards are written before the next one is read
+    records = cards(next(deck))
+    assert len(records) == 0 and len(taken) == 1
+    records += cards(next(deck))
+    assert len(records) == 2 and len(taken) == 2
+    records += cards(b''.join(deck))
+    text = b''
+    for number, card in enumerate(records[:-1], 2):
+        assert card[1:4] == ebcdic('TXT') and card[72:80] == ebcdic('A2E{:05d}'.format(number))
+        assert int.from_bytes(card[5:8], 'big') == len(text)
+        text += card[16:16 + int.from_bytes(card[10:12], 'big')]
+    assert text == b''.join(chunks)
+    # The SD's length is on the END card
+    assert records[-1][1:4] == ebcdic('END') and records[-1][28:32] == len(text).to_bytes(4, 'big')
+
+
+def test_paged_deck_points_in_to_the_pages():
+    art = make(art_path('tall.ans'), tso=True, paged=True, object=True)
+    records = cards(b''.join(art.pages_deck()))
+    ends = [number for number, card in enumerate(records) if card[1:4] == ebcdic('END')]
+    assert len(ends) == 2 and ends[1] == len(records) - 1
+    pagedata, table = records[:ends[0] + 1], records[ends[0] + 1:]
+    data = b''.join(card[16:16 + int.from_bytes(card[10:12], 'big')]
+                    for card in pagedata if card[1:4] == ebcdic('TXT'))
+    entries = b''.join(card[16:16 + int.from_bytes(card[10:12], 'big')]
+                       for card in table if card[1:4] == ebcdic('TXT'))
+    pages = [entries[i:i + 8] for i in range(0, len(entries) - 4, 8)]
+    assert len(pages) == -(-130 // 24) and entries[-4:] == bytes(4)
+    offset = 0
+    for page in pages:
+        assert int.from_bytes(page[:4], 'big') == offset
+        assert data[offset:offset + 3] == bytes.fromhex('27F5C3')
+        offset += int.from_bytes(page[4:], 'big')
+    assert offset == len(data)
+    # The table's address constants are relocated against PAGEDATA (ESDID 2)
+    assert table[0][32:41] == ebcdic('PAGEDATA') + b'\x02'
+    rld = b''.join(card[16:16 + int.from_bytes(card[10:12], 'big')]
+                   for card in table if card[1:4] == ebcdic('RLD'))
+    assert [rld[i:i + 8] for i in range(0, len(rld), 8)] == [
+        b'\x00\x02\x00\x01\x0c' + (8 * n).to_bytes(3, 'big') for n in range(len(pages))]
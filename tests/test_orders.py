@@ -0,0 +1,78 @@
+# The Order IR, the optimizer passes and the backends lowering it
+import pytest
+
+import ansi2ebcdic
+from ansi2ebcdic import Order
+from conftest import art_path, make, targets
+
+
+def orders():
+    return [
+        Order('SBA', address=81, comment='* start'),
+        Order('SA', type=0x42, value=0xF2),
+        Order('TEXT', data='ITS A-B'),
+        Order('GE', data=b'\x08\xad\x08\xad'),
+        Order('RA', address=160, data=b'\x08\xad'),
+        Order('SF', value=0x30),
+        Order('SFE', data=[(0xC0, 0x30), (0x42, 0xF4)]),
+        Order('TEXT', data='OK'),
+        Order('SBA', address=1919),
+        Order('IC'),
+    ]
+
+
+def test_bytes_backend():
+    assert ansi2ebcdic.bytes_backend(orders()).hex().upper() == (
+        '11C1D1' '2842F2' 'C9E3E240C160C2' '08AD08AD' '3CC26008AD' '1DF0' '2902C0F042F4' 'D6D2' '115D7F' '13')
+
+
+@pytest.mark.parametrize('backend', [ansi2ebcdic.tk4_backend, ansi2ebcdic.zos_backend])
+def test_hlasm_backends_assemble_to_the_same_bytes(backend):
+    hlasm = backend(orders())
+    assert hlasm.startswith('* start\n')
+    assert ansi2ebcdic.assemble_hlasm(hlasm) == ansi2ebcdic.bytes_backend(orders())
+
+
+def test_bytes_backend_code_page():
+    assert ansi2ebcdic.bytes_backend([Order('TEXT', data='[]')], '1047') == b'\xad\xbd'
+
+
+def test_drop_attributes():
+    sa = [Order('SA', type=0x42, value=0xF2), Order('SA', type=0x42, value=0xF4, comment='* green'),
+          Order('TEXT', data='A'), Order('SA', type=0x42, value=0xF4), Order('TEXT', data='B'),
+          Order('SA', type=0x45, value=0xF1), Order('SA', type=0x41, value=0xF8), Order('TEXT', data='C'),
+          Order('SA', type=0x45, value=0x00), Order('SA', type=0x41, value=0x00), Order('SA', type=0x42, value=0x00),
+          Order('TEXT', data='D')]
+    assert repr(ansi2ebcdic.drop_attributes(sa)) == (
+        "[SA(42,F4), TEXT('A'), TEXT('B'), SA(45,F1), SA(41,F8), TEXT('C'), SA(00,00), TEXT('D')]")
+    assert ansi2ebcdic.drop_attributes(sa)[0].comment == '* green'
+
+
+def test_drop_addresses():
+    addresses = [Order('SBA', address=0), Order('TEXT', data='AB'), Order('SBA', address=2), Order('TEXT', data='C'),
+                 Order('SBA', address=80), Order('SBA', address=160), Order('GE', data=b'\x08\xad'),
+                 Order('RA', address=200, data=b'\x40'), Order('SBA', address=200), Order('TEXT', data='D')]
+    assert repr(ansi2ebcdic.drop_addresses(addresses)) == (
+        "[TEXT('AB'), TEXT('C'), SBA(160), GE(b'\\x08\\xad'), RA(200,40), TEXT('D')]")
+
+
+def test_join_text_keeps_comments():
+    joined = ansi2ebcdic.join_text([Order('TEXT', data='A'), Order('TEXT', data='B'),
+                                    Order('TEXT', data='C', comment='* here'), Order('GE', data=b'\x08\xad'),
+                                    Order('GE', data=b'\x08\xc5')])
+    assert repr(joined) == "[TEXT('AB'), TEXT('C'), GE(b'\\x08\\xad\\x08\\xc5')]"
+    assert joined[1].comment == '* here'
+
+
+@pytest.mark.parametrize('name', ['simple.ans', 'big.ans', 'repeats.ans'])
+@pytest.mark.parametrize('target', sorted(targets))
+def test_optimize_keeps_the_screen(name, target):
+    art = make(art_path(name), **targets[target])
+    art.reset()
+    art.ansi_state_machine(art.ansi)
+    before, after = ansi2ebcdic.Screen3270(), ansi2ebcdic.Screen3270()
+    before.write(b'\xf5\xc3' + ansi2ebcdic.bytes_backend(art.orders))
+    optimized = ansi2ebcdic.optimize(art.orders)
+    after.write(b'\xf5\xc3' + ansi2ebcdic.bytes_backend(optimized))
+    assert after.looks() == before.looks()
+    assert len(optimized) <= len(art.orders)
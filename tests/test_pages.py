@@ -0,0 +1,72 @@
+# --pages: a TSO program with a page for every screenful of tall art
+import re
+
+import pytest
+
+import ansi2ebcdic
+from conftest import art_path, make
+
+
+def pages(overlap):
+    art = make(art_path('tall.ans'), paged=True, overlap=overlap)
+    hlasm = list(art.paged_hlasm())
+    streams = []
+    for page in hlasm:
+        if re.match(r'P\d{4} ', page):
+            stream = ansi2ebcdic.assemble_hlasm(page)
+            assert stream[:1] == b'\x27'
+            screen = ansi2ebcdic.Screen3270()
+            screen.write(stream[1:])
+            streams.append(''.join(look[0] for look in screen.looks()))
+    return hlasm, streams
+
+
+@pytest.mark.parametrize('overlap', [0, 4])
+def test_page_per_screenful(overlap):
+    hlasm, screens = pages(overlap)
+    step = 24 - overlap
+    assert len(screens) == -(-130 // step)
+    for number, screen in enumerate(screens):
+        assert screen.startswith('{:03d}'.format(number * step + 1))
+        assert screen[80 * overlap:].startswith('{:03d}'.format(number * step + overlap + 1))
+    # The page table points at every page and ends with a zero
+    table = ''.join(hlasm[-(len(screens) + 2):])
+    assert re.findall(r"DC    A\(P(\d{4}),L\1\)", table) == ['{:04d}'.format(n) for n in range(1, len(screens) + 1)]
+    assert table.endswith("         DC    F'0'\n")
+
+
+def test_pages_are_generated_lazily():
+    art = make(art_path('tall.ans'), paged=True)
+    generator = art.paged_hlasm()
+    first = next(generator)
+    assert first.startswith('P0001 ')
+    assert 'P0002' not in first
+
+
+def test_pages_are_drawn_one_window_at_a_time():
+    art = make(art_path('tall.ans'), paged=True)
+    art.reset_parser()
+    tokens = art.tokenize(art.ansi)
+    read = []
+
+    def stream():
+        for token in tokens:
+            read.append(token)
+            yield token
+
+    pages = art.ansi_pages(stream())
+    screen, written, text = next(pages)
+    # Handed out as soon as the ANSi writes below it
+    assert len(read) < len(tokens) / 2
+    assert ''.join(text[address][0] for address in range(3)) == '001'
+    assert len(list(pages)) == 130 // 24
+    assert len(read) == len(tokens)
+
+
+def test_drawing_back_up_misses_finished_pages():
+    art = make(art_path('tall.ans'), paged=True)
+    art.ansi = ''.join('{:03d}\n'.format(row) for row in range(1, 31)) + '\x1b[1;1HXX\n'
+    art.reset_parser()
+    first, second = art.ansi_pages(art.tokenize(art.ansi))
+    assert first[2][0] == ('0', False)
+    assert second[2][0] == ('0', False) and second[2][2] == ('5', False)
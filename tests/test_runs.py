@@ -0,0 +1,61 @@
+# Drawing the finished screen with NumPy array comparisons
+import random
+
+import pytest
+
+import ansi2ebcdic
+from conftest import art_path, make
+
+pytest.importorskip('numpy')
+
+
+def random_art(seed):
+    rng = random.Random(seed)
+    pieces = []
+    for _ in range(300):
+        choice = rng.randrange(6)
+        if choice == 0:
+            pieces.append('\x1b[{}m'.format(';'.join(str(rng.choice((0, 1, 4, 5, 7, 30, 31, 32, 33, 34, 35, 36, 37,
+                                                                      40, 41, 42, 43, 44, 45, 46, 47)))
+                                                 for _ in range(rng.randint(1, 3)))))
+        elif choice == 1:
+            pieces.append('\x1b[{};{}H'.format(rng.randint(1, 24), rng.randint(1, 80)))
+        elif choice == 2:
+            pieces.append(rng.choice('█▓▒░▀▄ ') * rng.randint(1, 12))
+        elif choice == 3:
+            pieces.append('\n')
+        elif choice == 4:
+            pieces.append('\x1b[{}C'.format(rng.randint(1, 10)))
+        else:
+            pieces.append(''.join(rng.choice('ABC xyz.-') for _ in range(rng.randint(1, 12))))
+    return ''.join(pieces) + '\n'
+
+
+def runs_match(art):
+    art.reset_parser()
+    screen = art.ansi_screen(art.tokenize(art.ansi))
+    vectorized = art.lower(ansi2ebcdic.optimize(art.sa_runs(*screen)))
+    assert vectorized == art.lower(ansi2ebcdic.optimize(art.field_colors(*screen, fields=False)))
+
+
+@pytest.mark.parametrize('seed', range(8))
+@pytest.mark.parametrize('extended', [False, True])
+def test_random_screens(write_art, seed, extended):
+    runs_match(make(write_art(random_art(seed)), tso=False, usstable=True, extended=extended))
+
+
+def test_reserved_cells(write_art):
+    runs_match(make(write_art(random_art(99)), tso=False, usstable=True, write_messages=True, row='12'))
+
+
+def test_image():
+    runs_match(make(art_path('logo.ppm'), tso=False, netsol=True, extended=True))
+
+
+def test_without_numpy(monkeypatch):
+    art = make(art_path('big.ans'), tso=False, usstable=True, color_method='sa')
+    art.convert()
+    expected = art.data_stream()
+    monkeypatch.setattr(ansi2ebcdic, 'np', None)
+    art.convert()
+    assert art.data_stream() == expected
@@ -0,0 +1,73 @@
+# The emulated 3270 --verify and --render play data streams on
+from ansi2ebcdic import Screen3270, buffer_address, to_ebcdic
+
+
+def write(*parts):
+    screen = Screen3270()
+    screen.write(bytes.fromhex('F5C3') + b''.join(bytes.fromhex(part) if isinstance(part, str) else part
+                                                for part in parts))
+    return screen
+
+
+def text(screen, row, col, length):
+    cells = list(screen.display())
+    start = (row - 1) * 80 + col - 1
+    return ''.join(cell[2] for cell in cells[start:start + length])
+
+
+def test_text_and_sba():
+    screen = write(to_ebcdic('HI'), '11' + buffer_address(48), to_ebcdic('THERE'))
+    assert text(screen, 1, 1, 2) == 'HI'
+    assert text(screen, 1, 49, 5) == 'THERE'
+
+
+def test_fourteen_bit_address():
+    screen = write('110700', to_ebcdic('X'))
+    assert text(screen, 23, 33, 1) == 'X'
+
+
+def test_set_attribute_colors():
+    screen = write('2842F2', to_ebcdic('R'), '2845F1', to_ebcdic('B'), '280000', to_ebcdic('N'))
+    assert [screen.cell(address)[2:] for address in range(3)] == [(0xF2, 0, 0), (0xF2, 0xF1, 0), (0, 0, 0)]
+
+
+def test_repeat_to_address():
+    screen = write('3C40C3', to_ebcdic('-'))
+    assert text(screen, 1, 1, 4) == '--- '
+
+
+def test_graphic_escape():
+    screen = write('08AD', '3C404308AD')
+    assert screen.ge[0] and screen.ge[1] and screen.ge[2]
+    assert screen.chars[:3] == bytes.fromhex('ADADAD')
+
+
+def test_fields_and_cursor():
+    # Protected field with hidden text, then an unprotected field and IC
+    screen = write('1D6C', to_ebcdic('SECRET'), '11' + buffer_address(80) + '1D40', '13', to_ebcdic('IN'))
+    assert screen.fields == {0: (0x6C, 0, 0, 0), 80: (0x40, 0, 0, 0)}
+    assert screen.cursor == 81
+    assert text(screen, 1, 2, 6) == '      '
+    assert text(screen, 2, 2, 2) == 'IN'
+
+
+def test_start_field_extended():
+    screen = write('2902C060 42F6', to_ebcdic('Y'))
+    row, col, char, fg, bg, hl = list(screen.display())[1]
+    assert screen.fields[0] == (0x60, 0xF6, 0, 0)
+    assert (char, fg) == ('Y', 0xF6)
+
+
+def test_erase_write_clears_and_write_keeps():
+    screen = write(to_ebcdic('OLD'))
+    screen.write(bytes.fromhex('F1C3') + to_ebcdic('N'))
+    assert text(screen, 1, 1, 3) == 'NLD'
+    screen.write(bytes.fromhex('F5C3'))
+    assert text(screen, 1, 1, 3) == '   '
+
+
+def test_renderings():
+    screen = write('2842F2', to_ebcdic('A<&'))
+    assert '\x1b[0;91mA<&' in screen.to_ansi()
+    assert 'A&lt;&amp;' in screen.to_html()
+    assert screen.looks()[0] == ('A', 0xF2, 0, 0)
@@ -0,0 +1,116 @@
+# --serve: the telnet framing and the TN3270 preview server
+import asyncio
+import os
+
+import ansi2ebcdic
+from ansi2ebcdic import DO, IAC, SB, SE, TELOPT_EOR, TELOPT_TTYPE, TTYPE_IS, TTYPE_SEND, WILL
+from conftest import art_path, make
+
+
+def events(data, count):
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        telnet = ansi2ebcdic.TelnetReader(reader)
+        return [await telnet.read() for _ in range(count)], telnet.received
+    return asyncio.run(read())
+
+
+def test_record_escapes_iac():
+    assert ansi2ebcdic.tn3270_record(b'\xf5\xc3\xff\x40') == b'\xf5\xc3\xff\xff\x40\xff\xef'
+
+
+def test_reader_splits_commands_subnegotiations_and_records():
+    data = (bytes([IAC, WILL, TELOPT_TTYPE, IAC, SB, TELOPT_TTYPE, TTYPE_IS]) + b'IBM-3278-2' + bytes([IAC, SE]) +
+            ansi2ebcdic.tn3270_record(b'\x7d\xff\x40') + bytes([IAC, 241]) + ansi2ebcdic.tn3270_record(b'\x6d'))
+    got, received = events(data, 4)
+    assert got == [('cmd', WILL, TELOPT_TTYPE), ('sb', bytes([TELOPT_TTYPE, TTYPE_IS]) + b'IBM-3278-2'),
+                   ('record', b'\x7d\xff\x40'), ('record', b'\x6d')]
+    assert received == len(data)
+
+
+async def connect(port):
+    # A client that has negotiated and is waiting for its first screen
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    telnet = ansi2ebcdic.TelnetReader(reader)
+    while True:
+        event = await telnet.read()
+        if event == ('cmd', DO, TELOPT_TTYPE):
+            writer.write(bytes([IAC, WILL, TELOPT_TTYPE]))
+        elif event == ('sb', bytes([TELOPT_TTYPE, TTYPE_SEND])):
+            writer.write(bytes([IAC, SB, TELOPT_TTYPE, TTYPE_IS]) + b'IBM-3278-2-E' + bytes([IAC, SE]))
+        elif event[0] == 'record':
+            return telnet, writer, event[1]
+
+
+async def next_record(telnet):
+    event = await telnet.read()
+    while event[0] != 'record':
+        event = await telnet.read()
+    return event[1]
+
+
+def test_server_sends_the_screen():
+    art = make(art_path('simple.ans'))
+    art.convert()
+
+    async def logon():
+        server = ansi2ebcdic.TN3270Server(art, art_path('simple.ans'), port=0, verbose=False)
+        listener = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+        port = listener.sockets[0].getsockname()[1]
+        async with listener:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            telnet = ansi2ebcdic.TelnetReader(reader)
+            assert await telnet.read() == ('cmd', DO, TELOPT_TTYPE)
+            writer.write(bytes([IAC, WILL, TELOPT_TTYPE]))
+            assert await telnet.read() == ('sb', bytes([TELOPT_TTYPE, TTYPE_SEND]))
+            writer.write(bytes([IAC, SB, TELOPT_TTYPE, TTYPE_IS]) + b'IBM-3278-2-E' + bytes([IAC, SE]))
+            assert await telnet.read() == ('cmd', DO, TELOPT_EOR)
+            event = await telnet.read()
+            while event[0] != 'record':
+                event = await telnet.read()
+            first = event[1]
+            # Enter redisplays the art
+            writer.write(ansi2ebcdic.tn3270_record(b'\x7d\x40\x40'))
+            event = await telnet.read()
+            while event[0] != 'record':
+                event = await telnet.read()
+            writer.close()
+            return first, event[1]
+
+    first, again = asyncio.run(asyncio.wait_for(logon(), 10))
+    assert first == again == art.data_stream()
+
+
+def test_reload_reaches_clients(write_art):
+    path = write_art('\x1b[31mFIRST\n')
+    art = make(path)
+    art.convert()
+    sent = []
+
+    class Link(ansi2ebcdic.Link):
+        async def send(self, writer, data):
+            sent.append(data)
+            await super().send(writer, data)
+
+    async def reload():
+        server = ansi2ebcdic.TN3270Server(art, path, port=0, interval=0.01, link=Link(), verbose=False)
+        listener = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+        async with listener:
+            watch = asyncio.ensure_future(server.watch())
+            telnet, writer, first = await connect(listener.sockets[0].getsockname()[1])
+            with open(path, 'wb') as f:
+                f.write(b'\x1b[32mSECOND SCREEN\n')
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            second = await next_record(telnet)
+            watch.cancel()
+            writer.close()
+            return first, second
+
+    first, second = asyncio.run(asyncio.wait_for(reload(), 10))
+    assert b'\xc6\xc9\xd9\xe2\xe3' in first
+    assert second == art.data_stream() and b'\xe2\xc5\xc3\xd6\xd5\xc4' in second
+    # Both screens went through the link
+    assert [ansi2ebcdic.tn3270_record(first), ansi2ebcdic.tn3270_record(second)] == sent
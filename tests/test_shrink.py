@@ -0,0 +1,54 @@
+# --shrink: downscaling art with NumPy
+import pytest
+
+import ansi2ebcdic
+from conftest import art_path, corpus, make
+
+np = pytest.importorskip('numpy')
+
+
+def test_cell_blocks_pads_with_zeros():
+    cells = np.arange(1, 16, dtype=np.uint8).reshape(3, 5)
+    blocks = ansi2ebcdic.cell_blocks(cells, 2, 2)
+    assert blocks.shape == (2, 3, 4)
+    assert blocks[0, 0].tolist() == [1, 2, 6, 7]
+    assert blocks[1, 2].tolist() == [15, 0, 0, 0]
+
+
+def test_dominant_prefers_colors_on_a_tie():
+    values = np.array([[0xF2, 0xF2, 0, 0xF4], [0, 0, 0xF1, 0xF1]], np.uint8)
+    assert ansi2ebcdic.dominant(values).tolist() == [0xF2, 0xF1]
+
+
+def test_pixel_cells():
+    top = np.array([0, 0xF2, 0xF2, 0, 0xF2], np.uint8)
+    bottom = np.array([0, 0xF2, 0, 0xF4, 0xF4], np.uint8)
+    chars, fg, bg = ansi2ebcdic.pixel_cells(top, bottom)
+    assert [chr(char) for char in chars] == [' ', '█', '▀', '▄', '▀']
+    assert fg.tolist() == [0, 0xF2, 0xF2, 0xF4, 0xF2]
+    assert bg.tolist() == [0, 0, 0, 0, 0xF4]
+
+
+@pytest.mark.parametrize('path', [path for path in corpus if path.endswith('.ans')])
+def test_grid_matches_the_screen(path):
+    # Without shrinking the arrays hold the same screen ansi_screen draws
+    art = make(path, tso=False, usstable=True)
+    art.reset_parser()
+    tokens = art.tokenize(art.ansi)
+    expected, written, text = art.ansi_screen(tokens)
+    screen, grid_written, grid_text = next(art.grid_pages(art.art_grid(tokens), 1))
+    if 'J' not in ''.join(token[2] for token in tokens if token[0] == 'escape'):
+        assert grid_written == written
+        assert screen.looks() == expected.looks()
+
+
+def test_shrink_halves_the_art(write_art):
+    # 88 columns, the text wraps on to the second row
+    ansi = '\x1b[44m' + '  ' * 20 + '\x1b[41m' + '  ' * 20 + '\x1b[0mAABBCCDD\n'
+    art = make(write_art(ansi), tso=False, usstable=True, shrink=(2, 1))
+    screen, differences = art.verify()
+    assert differences == []
+    looks = screen.looks()
+    # Background spaces become full blocks, text keeps every other character
+    assert looks[:40] == [('█', 0xF1, 0, 0)] * 20 + [('█', 0xF2, 0, 0)] * 20
+    assert ''.join(look[0] for look in looks[80:85]) == 'ABCD '
@@ -0,0 +1,54 @@
+# --storm: concurrent logons against the local server
+import asyncio
+
+import ansi2ebcdic
+from conftest import art_path, make
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert [ansi2ebcdic.percentile(values, p) for p in (50, 90, 99, 100)] == [50, 90, 99, 100]
+    assert ansi2ebcdic.percentile([7], 50) == 7
+
+
+def test_storm_report(capsys):
+    art = make(art_path('simple.ans'))
+    art.convert()
+    asyncio.run(ansi2ebcdic.logon_storm(art, art_path('simple.ans'), 20))
+    report = capsys.readouterr().out
+    assert 'Logon storm: 20 sessions' in report
+    assert 'Failed sessions' not in report
+    assert "Screen size:\t{} bytes".format(len(art.data_stream())) in report
+
+
+def test_storm_logon_receives_the_record():
+    art = make(art_path('simple.ans'))
+    art.convert()
+
+    async def one():
+        server = ansi2ebcdic.TN3270Server(art, art_path('simple.ans'), port=0, verbose=False)
+        listener = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+        async with listener:
+            return await ansi2ebcdic.storm_logon('127.0.0.1', listener.sockets[0].getsockname()[1])
+
+    seconds, received, screen = asyncio.run(asyncio.wait_for(one(), 10))
+    assert screen == len(art.data_stream())
+    assert received > screen
+
+
+def test_link_bandwidth_paces_writes():
+    class Writer:
+        def __init__(self):
+            self.data = b''
+
+        def write(self, data):
+            self.data += data
+
+        async def drain(self):
+            pass
+
+    writer = Writer()
+    link = ansi2ebcdic.Link(bandwidth=100000, chunk=512)
+    asyncio.run(link.send(writer, bytes(2000)))
+    assert writer.data == bytes(2000)
+    assert link.free_at > 0
@@ -0,0 +1,28 @@
+# --targets: every target and color mode from one parse
+import os
+
+import pytest
+
+import ansi2ebcdic
+from conftest import art_path, make, targets
+
+
+def looks(stream):
+    screen = ansi2ebcdic.Screen3270()
+    screen.write(stream)
+    return screen.looks()
+
+
+@pytest.mark.parametrize('name', ['simple.ans', 'rows.ans', 'big.ans'])
+def test_targets_look_like_single_conversions(tmp_path, name):
+    output = str(tmp_path / 'art.jcl')
+    art = make(art_path(name), filename=output)
+    art.generate_targets(sorted(targets), (False, True))
+    assert sorted(os.listdir(str(tmp_path))) == sorted('art-{}{}.jcl'.format(target, extended)
+                                                       for target in targets for extended in ('', '-extended'))
+    for target, options in targets.items():
+        for extended in (False, True):
+            single = make(art_path(name), extended=extended, **options)
+            single.convert()
+            jcl = open(os.path.join(str(tmp_path), 'art-{}{}.jcl'.format(target, '-extended' if extended else ''))).read()
+            assert looks(ansi2ebcdic.hlasm_stream(jcl)) == looks(ansi2ebcdic.hlasm_stream(single.jcl_output())), (target, extended)
@@ -0,0 +1,58 @@
+# --variants: one source, an assemble and link step per variant
+import re
+
+from conftest import art_path, make
+
+
+def job(tmp_path, **kwargs):
+    output = tmp_path / 'variants.jcl'
+    art = make(art_path('big.ans'), tso=False, usstable=True, filename=str(output),
+               variants=(art_path('simple.ans'), art_path('rows.ans')), **kwargs)
+    art.generate_output()
+    return art, output.read_text()
+
+
+def test_step_per_variant(tmp_path):
+    art, jcl = job(tmp_path, member='LOGO')
+    steps = re.findall(r"^//(\w+) +EXEC ASMACL,PARM.C='OBJECT,NODECK,SYSPARM\((\w+)\)'\n(?://.*\n)*?  NAME (\w+)\(R\)$",
+                       jcl, re.M)
+    assert steps == [('BUILD', 'BIG', 'LOGO'), ('BUILD2', 'SIMPLE', 'SIMPLE'), ('BUILD3', 'ROWS', 'ROWS')]
+    # The source is only in the job once, copied to the data set every step reads
+    assert jcl.count('USSTAB   USSTAB') == 1
+    assert jcl.count('//C.SYSIN   DD DSN=&&USSSRC,DISP=(OLD,PASS)') == 3
+    assert re.findall(r"^         AIF   \('&SYSPARM' EQ '(\w+)'\)", jcl, re.M) == ['SIMPLE', 'ROWS']
+
+
+def test_member_name_taken(tmp_path):
+    art, jcl = job(tmp_path, member='ROWS')
+    assert art.variant_members() == ['ROWS', 'SIMPLE', 'VAR3']
+    assert re.findall(r"^  NAME (\w+)\(R\)$", jcl, re.M) == ['ROWS', 'SIMPLE', 'VAR3']
+
+
+def test_single_table_unchanged(tmp_path):
+    output = tmp_path / 'single.jcl'
+    art = make(art_path('big.ans'), tso=False, usstable=True, filename=str(output))
+    art.generate_output()
+    jcl = output.read_text()
+    assert '//BUILD   EXEC ASMACL\n' in jcl and 'SYSPARM' not in jcl and '&&USSSRC' not in jcl
+
+
+def test_shared_rows_once_in_the_source(tmp_path, write_art):
+    rows = ''.join('\x1b[3{}mROW {:02d} {}\r\n'.format(n % 7 + 1, n, 'X' * 40) for n in range(20))
+    paths = [write_art(rows.replace('ROW 10', name[:6]), name + '.ans') for name in ('FIRST', 'SECOND', 'THIRD')]
+    output = tmp_path / 'variants.jcl'
+    art = make(paths[0], tso=False, usstable=True, filename=str(output), member='LOGO', variants=paths[1:])
+    art.generate_output()
+    jcl = output.read_text()
+    # One source, one member per variant
+    assert jcl.count('USSTAB   USSTAB') == 1
+    assert re.findall(r"^  NAME (\w+)\(R\)$", jcl, re.M) == ['LOGO', 'SECOND', 'THIRD']
+    # Every shared row is defined once and called from all three variants
+    macros = re.findall(r"^         MACRO\n         (SEG\d{4})\n((?:.*\n)*?)         MEND$", jcl, re.M)
+    assert len(macros) > 10
+    for name, hlasm in macros:
+        assert jcl.count(hlasm) == 1
+        assert len(re.findall(r"^         {}$".format(name), jcl, re.M)) == 4
+    # The row that's different isn't shared
+    shared = ''.join(hlasm for name, hlasm in macros)
+    assert 'ROW 05' in shared and 'SECOND' not in shared and 'SECOND' in jcl
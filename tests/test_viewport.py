@@ -0,0 +1,43 @@
+# --viewport: clipping art to the screen and dropping overdrawn cells
+import pytest
+
+import ansi2ebcdic
+from conftest import art_path, make
+
+
+def rows(art):
+    screen = ansi2ebcdic.Screen3270()
+    screen.write(art.data_stream())
+    text = ''.join(look[0] for look in screen.looks())
+    return [text[row * 80:row * 80 + 80] for row in range(24)]
+
+
+@pytest.mark.parametrize('top', [1, 10, 40])
+def test_viewport_rows(top):
+    art = make(art_path('tall.ans'), tso=False, usstable=True, viewport=(top, 1))
+    art.convert()
+    assert art.clipped
+    shown = rows(art)
+    assert shown[0].startswith('{:03d}'.format(top))
+    assert shown[5].startswith('{:03d}'.format(top + 5))
+    screen, differences = art.verify()
+    assert differences == []
+
+
+def test_viewport_past_the_art():
+    art = make(art_path('simple.ans'), tso=False, usstable=True, viewport=(30, 1))
+    art.convert()
+    assert art.clipped
+    assert rows(art)[0].strip() == ''
+
+
+def test_overdrawn_cells_cost_nothing(write_art):
+    art = make(write_art('AAAAAAAA\x1b[1;1HBB\x1b[1;30HC\x1b[1;30HD\n'), tso=False, usstable=True)
+    art.convert()
+    assert rows(art)[0].startswith('BBAAAAAA' + ' ' * 21 + 'D')
+    # The finished screen only holds the last write to every cell
+    art.reset_parser()
+    screen, written, text = art.ansi_screen(art.tokenize(art.ansi))
+    assert sorted(written) == list(range(8)) + [29]
+    drawn = ansi2ebcdic.bytes_backend(art.screen_orders((screen, written, text)))
+    assert ansi2ebcdic.from_ebcdic(drawn).count('A') == 6 and 'C' not in ansi2ebcdic.from_ebcdic(drawn)
@@ -0,0 +1,65 @@
+# --watch: line by line re-conversion and atomic output
+import os
+
+import pytest
+
+from conftest import make, targets
+
+lines = ''.join('\x1b[{};3{}mLINE {}\r\n'.format(i % 2, i % 8, i) for i in range(20))
+
+
+@pytest.mark.parametrize('target', sorted(targets))
+def test_rows_match_convert(write_art, target):
+    path = write_art(lines)
+    art = make(path, **targets[target])
+    assert art.convert_rows() == 21
+    stream, hlasm, output = art.data_stream(), art.hlasm, art.watch_output()
+    art.convert()
+    assert art.data_stream() == stream
+    assert art.hlasm == hlasm
+    assert art.jcl_output() == output
+
+
+def test_longer_line_converts_the_rest(write_art):
+    art = make(write_art(lines), tso=False, usstable=True)
+    art.convert_rows()
+    art.ansi = art.ansi.replace('LINE 15', 'A MUCH LONGER LINE 15')
+    converted = art.convert_rows()
+    assert 1 <= converted <= 6
+    stream = art.data_stream()
+    art.convert()
+    assert art.data_stream() == stream
+    assert art.cursor_orders
+
+
+def test_unchanged_rows_reuse_their_hlasm(write_art):
+    art = make(write_art(lines), tso=False, usstable=True)
+    art.convert_rows()
+    before = dict(art.row_hlasm)
+    art.ansi = art.ansi.replace('LINE 15', 'LINE XV')
+    assert art.convert_rows() == 1
+    assert 1 <= art.lowered <= 2
+    reused = [key for key in art.row_hlasm if key in before]
+    assert len(reused) == len(art.row_hlasm) - art.lowered >= 18
+    assert all(art.row_hlasm[key] is before[key] for key in reused)
+    assert 'LINE XV' in art.hlasm
+    hlasm = art.hlasm
+    art.convert()
+    assert art.hlasm == hlasm
+
+
+def test_dense_rows_lower_in_one_go(write_art):
+    art = make(write_art(lines), tso=False, usstable=True, dense=True)
+    art.convert_rows()
+    hlasm = art.hlasm
+    art.convert()
+    assert art.hlasm == hlasm
+
+
+def test_write_output_replaces_the_file(write_art, tmp_path):
+    output = str(tmp_path / 'out.jcl')
+    art = make(write_art(lines), filename=output)
+    art.write_output('first\n')
+    art.write_output(['second\n', 'third\n'])
+    assert open(output).read() == 'second\nthird\n'
+    assert not os.path.exists(output + '.tmp')